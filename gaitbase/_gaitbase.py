@@ -4,23 +4,39 @@ Gait database.
 
 """
 
+import logging
 import sys
+import threading
+import time
 import traceback
 from copy import copy
 from dataclasses import dataclass, fields
 from pathlib import Path
 
 import sqlite3
-from pkg_resources import resource_filename
-from PyQt5 import QtCore, QtSql, QtWidgets, uic
-from ulstools.env import named_tempfile
-from ulstools.num import check_hetu
+from PyQt5 import QtCore, QtSql, QtWidgets
 
 from config import cfg
-from rom_entryapp import EntryApp
+from db_writer import shared_writer, stop_writers
+from dbconnect import configure_qt_database, connect, active_journal_mode_qt
+from replica import LocalReplica
+from rom_record import RomRecord
+from schema import has_search_index_qt, search_filter
+import sqlstats
+import startup_profile
+from sqlstats import exec_query, exec_sql
+from editor_pool import EditorPool
+from uicache import load_ui
 from utils import _startfile, validate_code
-from widgets import qt_message_dialog, qt_confirm_dialog
+from widgets import qt_message_dialog, qt_confirm_dialog, qt_text_dialog
 from constants import Constants
+from varcatalog import load_catalog
+
+logger = logging.getLogger(__name__)
+
+# maximum number of changed rows to update one by one after changes by other
+# clients; for more changes, the tables are reloaded
+MAX_ROW_UPDATES = 100
 
 
 @dataclass
@@ -40,6 +56,8 @@ class PatientData:
 
         Returns a tuple of (is_valid, reason).
         """
+        from ulstools.num import check_hetu
+
         if not check_hetu(self.ssn):
             return (False, 'Invalid SSN')
         elif not validate_code(self.patient_code):
@@ -47,26 +65,247 @@ class PatientData:
         return (True, '')
 
 
-class NonLazyQSqlTableModel(QtSql.QSqlTableModel):
-    """QSqlTableModel without the lazy fetch feature.
+class SqlRecord(dict):
+    """A row of SqlRowModel, with a QSqlRecord style accessor"""
+
+    def value(self, name):
+        return self[name]
+
+
+class SqlRowModel(QtCore.QAbstractTableModel):
+    """Read-only model that keeps the rows of a SQL table in memory.
+
+    Unlike QSqlTableModel, single rows can be inserted, updated and removed by
+    their primary key (refresh_rows), so the whole table does not need to be
+    reloaded after every change.
 
-    Initially, QSqlTableModel will only fetch 256 first rows from a table, to
-    speed up access to large tables. It then reads further rows as necessary. In
-    case of SQLite, this behavior results in a SHARED lock to the database being
-    held indefinitely, preventing writes. This class disables the lazy fetch
-    feature.
+    All rows are read at once. QSqlTableModel would fetch the rows lazily,
+    which in case of SQLite results in a SHARED lock to the database being held
+    indefinitely, preventing writes.
+
+    The model always has all the columns of the table, but only the values of
+    the fetched columns are read from the database; the rest are None. See
+    set_fetched_columns().
     """
 
-    def fetchMore(self, parent: QtCore.QModelIndex = ...) -> None:
-        """Whenever fetchMore is called, we fetch everything"""
-        while super().canFetchMore():
-            super().fetchMore()
+    def __init__(self, database, table, key, fetched_columns=None, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.table = table
+        self.key = key  # the primary key column
+        self._filter = ''
+        self._sort = None
+        self._columns = self._table_columns()
+        self._headers = list(self._columns)
+        self._rows = list()
+        # whether the rows have been read by select()
+        self.loaded = False
+        self._fetched = self._columns
+        if fetched_columns is not None:
+            self.set_fetched_columns(fetched_columns)
+
+    def _table_columns(self):
+        """Read the column names of the table"""
+        sql = f"PRAGMA table_info('{self.table}')"
+        t0 = time.perf_counter()
+        query = exec_sql(self.database, sql)
+        columns = list()
+        while query.next():
+            columns.append(query.value(1))
+        query.finish()
+        if sqlstats.enabled:
+            sqlstats.record_fetch(sql, t0, len(columns))
+        return columns
+
+    def set_fetched_columns(self, columns=None):
+        """Set the columns to read from the database; None means all.
+
+        The primary key is always read. If the rows have already been loaded
+        and new columns are needed, the rows are reloaded.
+        """
+        if columns is None:
+            fetched = self._columns
+        else:
+            fetched = [
+                col for col in self._columns if col == self.key or col in columns
+            ]
+        needs_reload = self.loaded and not set(fetched) <= set(self._fetched)
+        self._fetched = fetched
+        if needs_reload:
+            self.select()
+
+    def _fetch(self, where=''):
+        """Read rows matching a WHERE clause from the database"""
+        sql = f'SELECT {",".join(self._fetched)} FROM {self.table}'
+        if where:
+            sql += f' WHERE {where}'
+        sql += f' ORDER BY {self.key}'
+        query = QtSql.QSqlQuery(self.database)
+        t0 = time.perf_counter()
+        if not exec_query(query, sql):
+            db_failure(query, fatal=False)
+            return list()
+        # positions of the fetched values in the model row
+        positions = [self._columns.index(col) for col in self._fetched]
+        ncols = len(self._columns)
+        rows = list()
+        while query.next():
+            row = [None] * ncols
+            for k, pos in enumerate(positions):
+                row[pos] = query.value(k)
+            rows.append(row)
+        # release the read lock
+        query.finish()
+        if sqlstats.enabled:
+            # exec_query() only times the execution; record also the fetch
+            sqlstats.record_fetch(sql, t0, len(rows))
+        return rows
+
+    def setFilter(self, where):
+        """Set a SQL WHERE clause for the rows; takes effect on select()"""
+        self._filter = where
+
+    def select(self):
+        """Reload all rows from the database"""
+        self.beginResetModel()
+        self._rows = self._fetch(self._filter)
+        self._sort_rows()
+        self.endResetModel()
+        self.loaded = True
+
+    def refresh_rows(self, keys):
+        """Reload the rows with given primary keys.
+
+        Rows are updated, inserted or removed, depending on whether they exist
+        in the database (and match the filter) and in the model.
+        """
+        keys = [int(key) for key in keys]
+        if not keys or not self.loaded:
+            return
+        where = f'{self.key} IN ({",".join(map(str, keys))})'
+        if self._filter:
+            where += f' AND ({self._filter})'
+        key_col = self._columns.index(self.key)
+        fresh_rows = {row[key_col]: row for row in self._fetch(where)}
+        inserted = False
+        for key in keys:
+            row = self.row_of(key)
+            fresh = fresh_rows.get(key)
+            if row is not None and fresh is not None:
+                self._update_row(row, fresh)
+            elif row is not None:
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self._rows[row]
+                self.endRemoveRows()
+            elif fresh is not None:
+                pos = self._sorted_position(fresh)
+                self.beginInsertRows(QtCore.QModelIndex(), pos, pos)
+                self._rows.insert(pos, fresh)
+                self.endInsertRows()
+
+    def _update_row(self, row, fresh):
+        """Replace a row, moving it if needed to keep the sort order.
+
+        The row is moved instead of resetting the model, so that the selection
+        is kept.
+        """
+        pos = self._sorted_position(fresh, skip=row)
+        if pos != row:
+            # destination is given as a position in the list before the move
+            parent = QtCore.QModelIndex()
+            self.beginMoveRows(parent, row, row, parent, pos if pos < row else pos + 1)
+            del self._rows[row]
+            self._rows.insert(pos, fresh)
+            self.endMoveRows()
+            row = pos
+        else:
+            self._rows[row] = fresh
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._columns) - 1))
+
+    def _sorted_position(self, new_row, skip=None):
+        """Return the position of a row in the sort order.
+
+        The position is counted without the row at index skip.
+        """
+        rows = [row for k, row in enumerate(self._rows) if k != skip]
+        if self._sort is None:
+            return len(rows) if skip is None else skip
+        key = self._sort_key(new_row)
+        descending = self._sort[1] == QtCore.Qt.DescendingOrder
+        for k, row in enumerate(rows):
+            row_key = self._sort_key(row)
+            if (row_key < key) if descending else (row_key > key):
+                return k
+        return len(rows)
+
+    def row_of(self, key):
+        """Return the row number for a primary key value, or None"""
+        key_col = self._columns.index(self.key)
+        return next(
+            (k for k, row in enumerate(self._rows) if row[key_col] == key), None
+        )
+
+    def record(self, row):
+        """Return a row as a SqlRecord, or None for an invalid row"""
+        if row is None or not 0 <= row < len(self._rows):
+            return None
+        return SqlRecord(zip(self._columns, self._rows[row]))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            value = self._rows[index.row()][index.column()]
+            # NULL is shown (and filtered, see MultiColumnFilter) as empty
+            if value is None and role == QtCore.Qt.DisplayRole:
+                return ''
+            return value
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self._headers[section]
+        return super().headerData(section, orientation, role)
+
+    def setHeaderData(self, section, orientation, value, role=QtCore.Qt.EditRole):
+        if orientation != QtCore.Qt.Horizontal:
+            return False
+        self._headers[section] = value
+        self.headerDataChanged.emit(orientation, section, section)
+        return True
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort the rows in memory"""
+        self._sort = (column, order)
+        self.beginResetModel()
+        self._sort_rows()
+        self.endResetModel()
+
+    def _sort_key(self, row):
+        """Sort key of a row: NULLs first, then numbers, then text (as in SQLite)"""
+        val = row[self._sort[0]]
+        if val is None:
+            return (0, 0)
+        return (2, val) if isinstance(val, str) else (1, val)
+
+    def _sort_rows(self):
+        if self._sort is None:
+            return
+        self._rows.sort(
+            key=self._sort_key, reverse=self._sort[1] == QtCore.Qt.DescendingOrder
+        )
 
 
 class MultiColumnFilter(QtCore.QSortFilterProxyModel):
     """Filter proxy that returns textual match on given columns"""
 
     def filterAcceptsRow(self, source_row, source_parent):
+        if not self.filterRegExp().pattern():
+            return True
         model = self.sourceModel()
         # range defines the columns to include in the matching
         inds = (model.index(source_row, k, source_parent) for k in range(1, 6))
@@ -87,9 +326,8 @@ class PatientEditor(QtWidgets.QDialog):
         If a patient record is provided, its values will be displayed for
         editing. Otherwise, a new patient will be created.
         """
-        uifile = resource_filename('gaitbase', 'edit_patient.ui')
         super().__init__(parent)
-        uic.loadUi(uifile, self)
+        load_ui('edit_patient.ui', self)
         self.setStyleSheet('QWidget { font-size: %dpt;}' % cfg.visual.fontsize)
         self.btnSave.clicked.connect(self.accept)
         self.btnCancel.clicked.connect(self.reject)
@@ -130,6 +368,123 @@ class PatientEditor(QtWidgets.QDialog):
             super().reject()
 
 
+class CohortStatsDialog(QtWidgets.QDialog):
+    """Dialog to compute cohort statistics of numeric ROM variables"""
+
+    # emitted by the computing thread; arguments are the results as (statistics,
+    # asymmetries) and a status text, or None and an error message
+    _computed = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, db_fname, catalog, parent=None):
+        """Init the dialog.
+
+        The statistics are computed from the database db_fname, which is read
+        using a separate sqlite3 connection. Loading all the ROMs may take a
+        while, so it is done in a background thread.
+        """
+        super().__init__(parent)
+        # numpy is imported only when the statistics are needed
+        import cohort_stats
+
+        self.cohort_stats = cohort_stats
+        self.db_fname = db_fname
+        self.catalog = catalog
+        self.setWindowTitle('Cohort statistics')
+        self.setStyleSheet('QWidget { font-size: %dpt;}' % cfg.visual.fontsize)
+        layout = QtWidgets.QVBoxLayout(self)
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(QtWidgets.QLabel('Variables:'))
+        self.lnVariables = QtWidgets.QLineEdit()
+        self.lnVariables.setPlaceholderText('e.g. Lonkka* Polvi*; empty for all')
+        controls.addWidget(self.lnVariables)
+        self.cbByDiagnosis = QtWidgets.QCheckBox('By diagnosis')
+        controls.addWidget(self.cbByDiagnosis)
+        self.cbByAge = QtWidgets.QCheckBox('By age')
+        controls.addWidget(self.cbByAge)
+        self.btnCompute = QtWidgets.QPushButton('Compute')
+        controls.addWidget(self.btnCompute)
+        layout.addLayout(controls)
+        self.tabs = QtWidgets.QTabWidget()
+        self.tblStats = QtWidgets.QTableWidget()
+        self.tabs.addTab(self.tblStats, 'Statistics')
+        self.tblAsymmetry = QtWidgets.QTableWidget()
+        self.tabs.addTab(self.tblAsymmetry, 'Asymmetry')
+        layout.addWidget(self.tabs)
+        self.lblStatus = QtWidgets.QLabel()
+        layout.addWidget(self.lblStatus)
+        self.btnCompute.clicked.connect(self._compute)
+        self.lnVariables.returnPressed.connect(self._compute)
+        self._computed.connect(self._show_results)
+        self._computing = False
+        self.resize(1100, 700)
+
+    def _compute(self):
+        """Start computing the statistics"""
+        if self._computing:
+            return
+        patterns = self.lnVariables.text().split()
+        varnames = self.cohort_stats.select_variables(self.catalog, patterns)
+        if not varnames:
+            qt_message_dialog('No numeric variables match')
+            return
+        by = list()
+        if self.cbByDiagnosis.isChecked():
+            by.append('diagnosis')
+        if self.cbByAge.isChecked():
+            by.append('age')
+        self._computing = True
+        self.btnCompute.setEnabled(False)
+        self.lblStatus.setText(f'Computing the statistics of {len(varnames)} variables...')
+        thread = threading.Thread(target=self._compute_thread, args=(varnames, by), daemon=True)
+        thread.start()
+
+    def _compute_thread(self, varnames, by):
+        """Load the ROMs and compute the statistics (in a background thread)"""
+        t0 = time.perf_counter()
+        try:
+            conn = connect(self.db_fname)
+            try:
+                data = self.cohort_stats.load_cohort(conn, varnames)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._computed.emit(None, f'Could not read the ROMs from the database:\n{e}')
+            return
+        stats = self.cohort_stats.grouped_stats(data, by)
+        asymmetry = self.cohort_stats.asymmetry_stats(data, by)
+        status = (
+            f'{len(data.age)} ROMs, {len(varnames)} variables, '
+            f'computed in {time.perf_counter() - t0:.2f} s'
+        )
+        self._computed.emit((stats, asymmetry), status)
+
+    def _show_results(self, results, status):
+        """Show the results of the computing thread"""
+        self._computing = False
+        self.btnCompute.setEnabled(True)
+        if results is None:
+            self.lblStatus.clear()
+            qt_message_dialog(status)
+            return
+        stats, asymmetry = results
+        self._fill_table(self.tblStats, stats)
+        self._fill_table(self.tblAsymmetry, asymmetry)
+        self.lblStatus.setText(status)
+
+    def _fill_table(self, table, results):
+        """Show a list of result dicts in a table widget"""
+        headers = list(results[0]) if results else list()
+        table.clear()
+        table.setColumnCount(len(headers))
+        table.setRowCount(len(results))
+        table.setHorizontalHeaderLabels(headers)
+        for row, result in enumerate(results):
+            for col, value in enumerate(result.values()):
+                item = QtWidgets.QTableWidgetItem(self.cohort_stats.format_value(value))
+                table.setItem(row, col, item)
+        table.resizeColumnsToContents()
+
+
 def db_failure(query, fatal=False):
     """Handle database failures"""
     err = query.lastError().databaseText()
@@ -145,11 +500,18 @@ def db_failure(query, fatal=False):
 class PatientDialog(QtWidgets.QMainWindow):
     """Visualize patients and measurements in table views"""
 
+    # emitted by the thread copying the database into the replica; arguments
+    # are the primary state before the copy, the change log position of the
+    # copy and an error message ('' on success)
+    _replica_copied = QtCore.pyqtSignal(object, object, str)
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        uifile = resource_filename('gaitbase', 'gaitbase_main.ui')
-        uic.loadUi(uifile, self)
+        load_ui('gaitbase_main.ui', self)
+        startup_profile.mark('main window: user interface')
         self._rom_windows = dict()
+        # ROM variables, used to create reports without the ROM editor
+        self.var_catalog = load_catalog()
 
         # some configurable stuff
         self.CONFIRM_EXIT = False
@@ -163,7 +525,7 @@ class PatientDialog(QtWidgets.QMainWindow):
 
         # Check the DB schema version
         try:
-            conn = sqlite3.connect(cfg.database.database)
+            conn = connect(cfg.database.database)
             db_ver = list(conn.execute('PRAGMA user_version'))[0][0]
             conn.close()
         except:
@@ -189,14 +551,47 @@ class PatientDialog(QtWidgets.QMainWindow):
 
         self.database.setDatabaseName(cfg.database.database)
         self.database.open()
+        configure_qt_database(self.database)
+        startup_profile.mark('main window: open database')
+
+        # In replica mode, the tables are browsed from a local copy of the
+        # database, while all writes go to the primary database. The copy is
+        # made in a background thread; until it is ready, the tables are
+        # browsed from the primary.
+        self.replica = None
+        self.read_database = self.database
+        self._replica_copying = False
+        if cfg.database.use_replica:
+            self.replica = LocalReplica(
+                cfg.database.database, cfg.database.replica_path
+            )
+            self._replica_copied.connect(self._swap_replica)
+            self._start_replica_copy()
+        # The table models are updated row by row after our own changes. In
+        # replica mode, the changes of other clients are also applied row by
+        # row. Otherwise, a full reload is done if another client has modified
+        # the database. The commits of the ROM editors also change the database
+        # state, so they are counted.
+        self.writer = shared_writer(cfg.database.database)
+        self._data_version = self._get_data_version()
+        self._own_commits_seen = self.writer.commits
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self._check_external_changes)
+        self.refresh_timer.start(int(cfg.database.refresh_interval * 1000))
+        self.writer.foreign_commit.connect(self._reload_tables)
+        # keep the ROM list up to date while ROMs are being edited; the rows
+        # written by the editors are updated in batches
+        self._written_roms = set()
+        self.written_timer = QtCore.QTimer(self)
+        self.written_timer.setSingleShot(True)
+        self.written_timer.setInterval(int(cfg.database.written_update_delay * 1000))
+        self.written_timer.timeout.connect(self._flush_written_roms)
+        self.writer.write_done.connect(self._rom_written)
 
         # patient table
-        # self.patient_model = QtSql.QSqlTableModel(db=self.database)
-        self.patient_model = NonLazyQSqlTableModel(db=self.database)
-        # turn on foreign key support (necessary for cascade)
-        self.patient_model.database().exec('PRAGMA foreign_keys = ON')
-        self.patient_model.setTable('patients')
+        self.patient_model = SqlRowModel(self.read_database, 'patients', 'patient_id')
         self.patient_model.select()
+        startup_profile.mark('main window: read patients')
         # set more readable column headers; order must match SQL schema
         col_hdrs = ['ID', 'First name', 'Last name', 'SSN', 'Patient code', 'Diagnosis']
         for k, hdr in enumerate(col_hdrs):
@@ -205,13 +600,13 @@ class PatientDialog(QtWidgets.QMainWindow):
         self.patient_filter = MultiColumnFilter(self)
         self.patient_filter.setFilterCaseSensitivity(False)
         self.patient_filter.setSourceModel(self.patient_model)
-        # rom table
-        # self.rom_model = QtSql.QSqlTableModel(db=self.database)
-        self.rom_model = NonLazyQSqlTableModel(db=self.database)
-        # turn on foreign key support (necessary for cascade)
-        self.rom_model.database().exec('PRAGMA foreign_keys = ON')
-        self.rom_model.setTable('roms')
-        self.rom_model.select()
+        # rom table; rows are read when a patient is selected
+        # only the columns shown in the list are read, unless all ROM vars are
+        # shown
+        self.rom_list_columns = ['rom_id', 'patient_id', 'TiedotPvm', 'TiedotMittaajat']
+        self.rom_model = SqlRowModel(
+            self.read_database, 'roms', 'rom_id', self.rom_list_columns
+        )
         # the ROM view
         # NB: lot of view properties are set in Qt Designer
         self.tvROM.setModel(self.rom_model)
@@ -232,8 +627,20 @@ class PatientDialog(QtWidgets.QMainWindow):
                 )
         self._rom_show_all(False)
 
+        # Patient search. If the database has a search index, the search is done
+        # in SQL after a short typing delay, so that only the matching rows are
+        # loaded. Otherwise, the rows are filtered by the proxy model.
+        self.search_index = has_search_index_qt(self.read_database)
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(cfg.visual.search_delay)
+        self.search_timer.timeout.connect(self._apply_search)
+        if self.search_index:
+            self.lineEdit.textChanged.connect(self.search_timer.start)
+        else:
+            self.lineEdit.textChanged.connect(self.patient_filter.setFilterFixedString)
+
         # connect signals
-        self.lineEdit.textChanged.connect(self.patient_filter.setFilterFixedString)
         self.btnOpenROM.clicked.connect(lambda x: self._edit_rom())
         self.btnOpenROMExcel.clicked.connect(self._rom_excel_report)
         self.btnOpenROMText.clicked.connect(self._rom_text_report)
@@ -260,11 +667,193 @@ class PatientDialog(QtWidgets.QMainWindow):
         self.tvROM.resizeColumnsToContents()
         self.tvPatient.selectRow(0)
 
-        self.msg_db_ready = f'Ready, using database {cfg.database.database}'
+        # report the journal mode actually in use; it may differ from the
+        # configured one, e.g. if other clients prevent changing it
+        journal_mode = active_journal_mode_qt(self.database)
+        self.msg_db_ready = (
+            f'Ready, using database {cfg.database.database} '
+            f'(journal mode: {journal_mode})'
+        )
+        if self.replica is not None:
+            self.msg_db_ready += f', local copy {self.replica.replica_path}'
+        self.statusbar.showMessage(self.msg_db_ready)
+
+        # Closed ROM editors are kept for reuse. One editor is created in
+        # advance, after a delay so that the main window is shown first.
+        self.editor_pool = EditorPool(
+            self.database,
+            cfg.editor.pool_size,
+            cfg.editor.pool_memory_limit,
+            self._editor_closing,
+        )
+        QtCore.QTimer.singleShot(
+            int(cfg.editor.prefill_delay * 1000), self.editor_pool.prefill
+        )
+
+        self._cohort_dialog = None
+        menu = self.menuBar().addMenu('Analysis')
+        menu.addAction('Cohort statistics...').triggered.connect(self._show_cohort_stats)
+
+        # debug menu for viewing the SQL statistics
+        if sqlstats.enabled:
+            menu = self.menuBar().addMenu('Debug')
+            menu.addAction('SQL statistics...').triggered.connect(self._show_sql_stats)
+            menu.addAction('Save SQL statistics').triggered.connect(self._dump_sql_stats)
+
+    def _get_data_version(self):
+        """Return PRAGMA data_version of the database connection.
+
+        The value changes whenever another connection commits changes.
+        """
+        query = exec_sql(self.database, 'PRAGMA data_version')
+        version = query.value(0) if query.next() else None
+        query.finish()
+        return version
+
+    def _update_rows(self, model, keys, where=None, params=()):
+        """Update rows of a table model (and the replica) from the database.
+
+        keys are the primary keys of the rows. In replica mode, the rows are
+        also copied into the replica; by default they are selected by their
+        keys, but a different WHERE clause and parameters can be given.
+        """
+        if self.replica is not None:
+            if where is None:
+                where = f'{model.key} IN ({",".join("?" * len(keys))})'
+                params = list(keys)
+            self.replica.mirror(model.table, where, params)
+        model.refresh_rows(keys)
+
+    def _rows_changed(self, model, keys, where=None, params=()):
+        """Update a table model after a write by the main window"""
+        # the writer would see the commit as made by another client
+        self.writer.note_commit()
+        self._update_rows(model, keys, where, params)
+
+    def _check_external_changes(self):
+        """Update the tables if the database was modified by other clients"""
+        if self.replica is not None:
+            if self.replica.ready:
+                self._refresh_replica()
+                return
+            # retry a failed copy; until then, browse the primary
+            self._start_replica_copy()
+        # read the state before the commit count; a commit in between then
+        # causes an extra reload instead of going unnoticed
+        if (state := self._get_data_version()) == self._data_version:
+            return
+        own_commits = self.writer.commits
+        if own_commits == self._own_commits_seen:
+            self._reload_tables()
+            return
+        # We have written into the database, so the state change may be due to
+        # our own commits only. Accept the state, and let the writer check
+        # whether other clients have committed meanwhile (foreign_commit). The
+        # commits of the main window are reported to the writer (note_commit),
+        # so they do not cause a reload.
+        self._own_commits_seen = own_commits
+        self._data_version = state
+        self.writer.request_check()
+
+    def _refresh_replica(self):
+        """Apply the changes of the primary to the replica and the tables"""
+        if self._replica_copying or not self.replica.is_stale():
+            return
+        try:
+            changes = self.replica.refresh()
+        except sqlite3.Error as e:
+            logger.warning(f'could not update the local copy: {e}')
+            return
+        if changes is None:
+            # the changes are not known, so the whole database is copied
+            self._start_replica_copy()
+        elif sum(len(keys) for keys in changes.values()) > MAX_ROW_UPDATES:
+            self._reload_tables()
+        else:
+            self.patient_model.refresh_rows(changes['patients'])
+            self.rom_model.refresh_rows(changes['roms'])
+
+    def _start_replica_copy(self):
+        """Start copying the primary into the replica in a background thread"""
+        if self._replica_copying:
+            return
+        self._replica_copying = True
+        # changes made during the copy are detected on the next check
+        state = self.replica.primary_state()
+        threading.Thread(target=self._copy_replica, args=(state,), daemon=True).start()
+
+    def _copy_replica(self, state):
+        """Copy the primary into a new replica file (in a background thread)"""
+        try:
+            seq = self.replica.copy_primary()
+        except (sqlite3.Error, OSError) as e:
+            self._replica_copied.emit(state, None, str(e))
+            return
+        self._replica_copied.emit(state, seq, '')
+
+    def _swap_replica(self, state, seq, error):
+        """Take a finished copy of the primary into use"""
+        self._replica_copying = False
+        if error:
+            logger.warning(f'could not copy the database: {error}')
+            return
+        # the file is replaced, so the connection must be closed meanwhile
+        if self.read_database is not self.database:
+            self.read_database.close()
+        try:
+            self.replica.swap(state, seq)
+        except OSError as e:
+            logger.warning(f'could not replace the local copy: {e}')
+        if self.replica.ready:
+            if self.read_database is self.database:
+                self.read_database = QtSql.QSqlDatabase('QSQLITE')
+                self.read_database.setDatabaseName(self.replica.replica_path)
+                self.patient_model.database = self.read_database
+                self.rom_model.database = self.read_database
+            self.read_database.open()
+        self._reload_tables()
+
+    def _reload_tables(self):
+        """Reload the tables after changes by other clients"""
+        self._own_commits_seen = self.writer.commits
+        self._data_version = self._get_data_version()
+        patient_id = self._current_patient_id
+        self.patient_model.select()
+        if patient_id is not None:
+            self._select_patient(patient_id)
+        if self.rom_model.loaded:
+            self.rom_model.select()
         self.statusbar.showMessage(self.msg_db_ready)
 
+    def _rom_written(self, rom_id):
+        """Callback for ROM changes written by the ROM editor"""
+        self._written_roms.add(rom_id)
+        if not self.written_timer.isActive():
+            self.written_timer.start()
+
+    def _flush_written_roms(self):
+        """Update the ROMs written by the editors in the ROM list"""
+        self.written_timer.stop()
+        if self._written_roms:
+            rom_ids = sorted(self._written_roms)
+            self._written_roms.clear()
+            self._update_rows(self.rom_model, rom_ids)
+
+    def _apply_search(self):
+        """Show the patients that match the search text, using the search index"""
+        self.search_timer.stop()
+        text = self.lineEdit.text().strip()
+        self.patient_model.setFilter(search_filter(text) if text else '')
+        self.patient_model.select()
+
+    def _flush_search(self):
+        """Apply a pending search immediately"""
+        if self.search_timer.isActive():
+            self._apply_search()
+
     def _rom_show_all(self, show_all):
         """If show_all is True, show all ROM vars in table"""
+        self.rom_model.set_fetched_columns(None if show_all else self.rom_list_columns)
         for k in range(self.rom_model.columnCount()):
             if show_all:
                 if (
@@ -296,6 +885,23 @@ class PatientDialog(QtWidgets.QMainWindow):
         if (idx := self._current_patient_index) is not None:
             return idx.row()
 
+    @property
+    def _current_patient_id(self):
+        """Return the SQL id of the currently selected patient"""
+        if (rec := self.patient_model.record(self._current_patient_row)) is not None:
+            return rec.value('patient_id')
+
+    def _select_patient(self, patient_id):
+        """Select a patient in the patient view"""
+        if (row := self.patient_model.row_of(patient_id)) is None:
+            return
+        idx = self.patient_model.index(row, 1, QtCore.QModelIndex())
+        idx_filter = self.patient_filter.mapFromSource(idx)
+        flags = QtCore.QItemSelectionModel.ClearAndSelect | QtCore.QItemSelectionModel.Rows
+        self.tvPatient.selectionModel().select(idx_filter, flags)
+        self.tvPatient.selectionModel().setCurrentIndex(idx_filter, flags)
+        self.tvPatient.scrollTo(idx_filter)
+
     @staticmethod
     def _record_to_patient(rec):
         """Convert a SQL patient record to a Patient instance"""
@@ -329,55 +935,53 @@ class PatientDialog(QtWidgets.QMainWindow):
             return
         rec = self.patient_model.record(self._current_patient_row)
         patient = self._record_to_patient(rec)
-        dlg = PatientEditor(PatientData.is_valid, patient)
+        patient_id = rec.value('patient_id')
+        dlg = PatientEditor(lambda p: self._check_patient(p, patient_id), patient)
         if dlg.exec():
             # pass id to uniquely identify the patient
-            self._update_patient(dlg._patient, rec.value('patient_id'))
+            self._update_patient(dlg._patient, patient_id)
 
     def _new_patient(self):
         """Create a new patient"""
-        dlg = PatientEditor(self._check_new_patient)
+        dlg = PatientEditor(self._check_patient)
         if not dlg.exec():
             return
         patient_id = self._insert_patient(dlg._patient)
         if patient_id is None:
             return
-        self.patient_model.select()
         # clear the filter so that the newly inserted patient is visible
         self.lineEdit.clear()
+        self._flush_search()
+        self._rows_changed(self.patient_model, [patient_id])
         # select the newly created patient
-        # this is surprisingly hard to do
-        for k in range(self.patient_model.rowCount()):
-            if self.patient_model.record(k).value('patient_id') == patient_id:
-                idx = self.patient_model.index(k, 1, QtCore.QModelIndex())
-                idx_filter = self.patient_filter.mapFromSource(idx)
-                self.tvPatient.selectionModel().select(
-                    idx_filter,
-                    QtCore.QItemSelectionModel.ClearAndSelect
-                    | QtCore.QItemSelectionModel.Rows,
-                )
-                self.tvPatient.selectionModel().setCurrentIndex(
-                    idx_filter,
-                    QtCore.QItemSelectionModel.ClearAndSelect
-                    | QtCore.QItemSelectionModel.Rows,
-                )
-                self.tvPatient.scrollTo(idx_filter)
-                break
+        self._select_patient(patient_id)
+
+    def _check_patient(self, patient, patient_id=None):
+        """Check whether patient is valid and can be written into database.
 
-    def _check_new_patient(self, patient):
-        """Check whether patient is valid and can be inserted into database.
-        Returns tuple of (status, msg) where status is True or False.
-        If status is False, msg gives a reason why the patient is not ok.
+        patient_id is the SQL id of an existing patient that is being edited;
+        that record is excluded from the uniqueness checks. Returns tuple of
+        (status, msg) where status is True or False. If status is False, msg
+        gives a reason why the patient is not ok (e.g. which unique field
+        collided).
         """
-        query = self.database.exec('SELECT ssn, patient_code FROM patients')
-        while query.next():
-            if query.value(0) == patient.ssn:
-                return (False, 'Patient with this SSN already exists in database')
-            elif query.value(1) == patient.patient_code:
-                return (
-                    False,
-                    'Patient with this patient code already exists in database',
-                )
+        # these lookups use the indexes of the UNIQUE constraints
+        unique_fields = {'ssn': 'SSN', 'patient_code': 'patient code'}
+        for field, desc in unique_fields.items():
+            query = QtSql.QSqlQuery(self.database)
+            query.prepare(
+                f'SELECT EXISTS (SELECT 1 FROM patients WHERE {field} = :value '
+                'AND patient_id IS NOT :patient_id)'
+            )
+            query.bindValue(':value', getattr(patient, field))
+            query.bindValue(':patient_id', patient_id)
+            if not exec_query(query) or not query.first():
+                db_failure(query, fatal=False)
+                return (False, 'Could not check the database')
+            exists = query.value(0)
+            query.finish()
+            if exists:
+                return (False, f'Patient with this {desc} already exists in database')
         return patient.is_valid()
 
     def _update_patient(self, patient: PatientData, patient_id):
@@ -395,9 +999,9 @@ class PatientDialog(QtWidgets.QMainWindow):
         for field in fields(patient):
             query.bindValue(':' + field.name, getattr(patient, field.name))
         query.bindValue(':patient_id', patient_id)
-        if not query.exec():
+        if not exec_query(query):
             db_failure(query, fatal=False)
-        self.patient_model.select()
+        self._rows_changed(self.patient_model, [patient_id])
 
     def _insert_patient(self, patient: PatientData):
         """Insert a new patient record into the database."""
@@ -408,7 +1012,7 @@ class PatientDialog(QtWidgets.QMainWindow):
         )
         for field in fields(patient):
             query.bindValue(':' + field.name, getattr(patient, field.name))
-        if not query.exec():
+        if not exec_query(query):
             db_failure(query, fatal=False)
             return None
         return query.lastInsertId()
@@ -433,15 +1037,24 @@ class PatientDialog(QtWidgets.QMainWindow):
         q = QtSql.QSqlQuery(self.database)
         q.prepare('SELECT (rom_id) FROM roms WHERE patient_id = :patient_id')
         q.bindValue(':patient_id', patient_id)
-        q.exec()
+        exec_query(q)
+        rom_ids = list()
         while q.next():
-            rom_id = q.value(0)
+            rom_ids.append(q.value(0))
+        # release the read lock before closing the editors, since closing
+        # waits for their writes to complete
+        q.finish()
+        for rom_id in rom_ids:
             if rom_id in self._rom_windows:
                 self._rom_windows[rom_id].force_close()
-        self.patient_model.removeRow(self._current_patient_row)
-        # need to update, otherwise empty rows appear in the view
-        self.patient_model.select()
-        self.rom_model.select()
+        # the ROMs are deleted by the database (ON DELETE CASCADE)
+        query = QtSql.QSqlQuery(self.database)
+        query.prepare('DELETE FROM patients WHERE patient_id = :patient_id')
+        query.bindValue(':patient_id', patient_id)
+        if not exec_query(query):
+            db_failure(query, fatal=False)
+        self._rows_changed(self.patient_model, [patient_id])
+        self._rows_changed(self.rom_model, rom_ids, 'patient_id = ?', [patient_id])
 
     def _edit_rom(self, rom_id=None, newly_created=False):
         """Open a ROM measurement in an instance of the ROM editor.
@@ -455,30 +1068,41 @@ class PatientDialog(QtWidgets.QMainWindow):
         if rom_id in self._rom_windows:
             qt_message_dialog('This ROM is already open')
             return
-        app = EntryApp(self.database, rom_id, newly_created)
-        app.closing.connect(self._editor_closing)
+        app = self.editor_pool.acquire(rom_id, newly_created)
         # keep track of editor windows (keyed by rom id number)
         self._rom_windows[rom_id] = app
         app.show()
 
+    def _load_rom_record(self, rom_id):
+        """Load a ROM from the database for reporting"""
+        # if the ROM is open in the editor, make sure its changes are written
+        if (editor := self._rom_windows.get(rom_id)) is not None:
+            editor.flush_updates()
+            editor.wait_for_writes()
+        conn = connect(cfg.database.database)
+        try:
+            return RomRecord.load(conn, rom_id, self.var_catalog)
+        finally:
+            conn.close()
+
     def _rom_excel_report(self):
         """Create an Excel report of the current ROM"""
         if (rom_id := self.current_rom_id) is None:
             qt_message_dialog('Please select a ROM first')
             return
-        # we use an EntryApp instance to create the report
-        # the instance is not shown as a window
-        app = EntryApp(self.database, rom_id, False)
+        from ulstools.env import named_tempfile
+
         fname = named_tempfile(suffix='.xls')
         try:
-            report = app.make_excel_report(cfg.templates.xls)
+            record = self._load_rom_record(rom_id)
+            report = record.make_excel_report(cfg.templates.xls)
             report.save(fname)
             self.statusbar.showMessage('Opening report in Excel...')
             _startfile(fname)
+        except sqlite3.Error as e:
+            qt_message_dialog(f'Could not read the ROM from the database:\n{e}')
         except KeyError as e:
             qt_message_dialog(f'The Excel report template refers to an unknown variable:\n{e}')
-        finally:
-            app.force_close()
         self.statusbar.showMessage(self.msg_db_ready)
 
     def _rom_text_report(self):
@@ -486,22 +1110,22 @@ class PatientDialog(QtWidgets.QMainWindow):
         if (rom_id := self.current_rom_id) is None:
             qt_message_dialog('Please select a ROM first')
             return
-        # we use an EntryApp instance to create the report
-        # the instance is not shown as a window
-        app = EntryApp(self.database, rom_id, False)
+        from ulstools.env import named_tempfile
+
         fname = named_tempfile(suffix='.txt')
         try:
-            report_txt = app.make_text_report(cfg.templates.text)
+            record = self._load_rom_record(rom_id)
+            report_txt = record.make_text_report(cfg.templates.text)
             with open(fname, 'w', encoding='utf-8') as f:
                 f.write(report_txt)
             self.statusbar.showMessage('Opening report in text editor...')
             _startfile(fname)
+        except sqlite3.Error as e:
+            qt_message_dialog(f'Could not read the ROM from the database:\n{e}')
         except (SyntaxError, NameError) as e:
             qt_message_dialog(f'The report template contains syntax errors:\n{e}')
         except KeyError as e:
             qt_message_dialog(f'The report template refers to an unknown variable:\n{e}')
-        finally:
-            app.force_close()
         self.statusbar.showMessage(self.msg_db_ready)
 
     def _new_rom(self):
@@ -512,27 +1136,34 @@ class PatientDialog(QtWidgets.QMainWindow):
         query = QtSql.QSqlQuery(self.database)
         query.prepare('INSERT INTO roms (patient_id) VALUES (:patient_id)')
         query.bindValue(':patient_id', patient_id)
-        if not query.exec():
+        if not exec_query(query):
             db_failure(query, fatal=False)
         else:
-            self._edit_rom(query.lastInsertId(), newly_created=True)
+            rom_id = query.lastInsertId()
+            self._rows_changed(self.rom_model, [rom_id])
+            self._edit_rom(rom_id, newly_created=True)
 
     def _editor_closing(self, rom_id):
         """Callback for a closing a ROM editor"""
-        self._rom_windows.pop(rom_id)
-        self.rom_model.select()
+        self.editor_pool.release(self._rom_windows.pop(rom_id))
+        self._written_roms.add(rom_id)
+        self._flush_written_roms()
 
     def _delete_rom(self):
         """Delete the selected ROM measurement from database"""
-        if (rom_idx := self.current_rom_index) is None:
+        if self.current_rom_index is None:
             qt_message_dialog('Please select a ROM first')
             return
         msg = 'WARNING: are you sure you want to delete this ROM measurement? There is no undo.'
         if qt_confirm_dialog(msg):
             if (rom_id := self.current_rom_id) in self._rom_windows:
                 self._rom_windows[rom_id].force_close()
-            self.rom_model.removeRow(rom_idx.row())
-            self.rom_model.select()
+            query = QtSql.QSqlQuery(self.database)
+            query.prepare('DELETE FROM roms WHERE rom_id = :rom_id')
+            query.bindValue(':rom_id', rom_id)
+            if not exec_query(query):
+                db_failure(query, fatal=False)
+            self._rows_changed(self.rom_model, [rom_id])
 
     def _patient_row_selected(self, sel):
         """Callback for row selected on the patient table"""
@@ -547,21 +1178,59 @@ class PatientDialog(QtWidgets.QMainWindow):
         self.rom_model.select()
         self.tvROM.resizeColumnsToContents()
 
+    def _show_cohort_stats(self):
+        """Show the cohort statistics dialog"""
+        if self._cohort_dialog is None:
+            # read from the local copy, if any
+            db_fname = (
+                self.replica.replica_path
+                if self.replica is not None and self.replica.ready
+                else cfg.database.database
+            )
+            try:
+                self._cohort_dialog = CohortStatsDialog(db_fname, self.var_catalog, self)
+            except ImportError as e:
+                qt_message_dialog(f'Cohort statistics are not available:\n{e}')
+                return
+        self._cohort_dialog.show()
+        self._cohort_dialog.raise_()
+
+    def _show_sql_stats(self):
+        """Show the SQL statistics"""
+        qt_text_dialog('SQL statistics', sqlstats.summary_text())
+
+    def _dump_sql_stats(self):
+        """Write the SQL statistics into a file"""
+        if (fname := sqlstats.dump()) is not None:
+            self.statusbar.showMessage(f'SQL statistics written into {fname}')
+
     def closeEvent(self, event):
         """Confirm and close application."""
         if not self.CONFIRM_EXIT or qt_confirm_dialog('Do you want to exit?'):
             # close all ROM editor windows
             for editor in list(self._rom_windows.values()):
                 editor.force_close()
+            self.editor_pool.clear()
+            stop_writers(cfg.database.close_timeout)
+            if self.replica is not None:
+                self.replica.close()
+            if sqlstats.enabled:
+                sqlstats.dump()
             event.accept()
         else:
             event.ignore()
 
 
-def main():
+def main(profile_startup=None):
+    """Run the application.
 
+    If profile_startup is given, report the startup timings into it (see
+    startup_profile.report) and exit once the main window is shown.
+    """
     app = QtWidgets.QApplication(sys.argv)
+    startup_profile.mark('create application')
     pdi = PatientDialog()
+    startup_profile.mark('create main window')
 
 
     def my_excepthook(exc_type, value, tback):
@@ -579,6 +1248,15 @@ def main():
     sys.excepthook = my_excepthook
 
     pdi.show()
+    if profile_startup:
+        # runs when the event loop has processed the show and paint events
+        def _first_window_shown():
+            startup_profile.mark('show main window')
+            startup_profile.report(profile_startup)
+            pdi.close()
+            app.quit()
+
+        QtCore.QTimer.singleShot(0, _first_window_shown)
     app.exec()
 
 
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Create ROM reports in batch mode, without the GUI.
+
+ROMs can be selected by date range and/or patient codes. The reports are
+rendered in parallel using a process pool. Example:
+
+python batch_report.py outdir --from-date 1.1.2022 --to-date 31.12.2022
+
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from config import cfg
+from dbconnect import connect
+from rom_record import RomRecord
+from varcatalog import load_catalog
+
+REPORT_FORMATS = ('text', 'excel')
+
+# per-process state of the worker processes
+_worker = dict()
+
+
+def _parse_date(datestr):
+    """Parse a date in form of dd.mm.yyyy; return None if invalid"""
+    try:
+        return datetime.datetime.strptime(datestr, '%d.%m.%Y').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def select_roms(conn, from_date=None, to_date=None, patient_codes=None):
+    """Select ROMs by measurement date and patient code.
+
+    Returns a list of (rom_id, patient_code, date) tuples, where date is a
+    datetime.date or None if the ROM has no valid date.
+    """
+    query = (
+        'SELECT roms.rom_id, patients.patient_code, roms.TiedotPvm '
+        'FROM roms JOIN patients USING (patient_id)'
+    )
+    params = list()
+    if patient_codes:
+        query += f' WHERE patients.patient_code IN ({",".join("?" * len(patient_codes))})'
+        params.extend(patient_codes)
+    query += ' ORDER BY roms.rom_id'
+    roms = list()
+    for rom_id, patient_code, datestr in conn.execute(query, params):
+        # dates are stored as dd.mm.yyyy text (not always zero padded), so
+        # the date range is checked here instead of in SQL
+        date = _parse_date(datestr)
+        if from_date is not None and (date is None or date < from_date):
+            continue
+        if to_date is not None and (date is None or date > to_date):
+            continue
+        roms.append((rom_id, patient_code, date))
+    return roms
+
+
+def _init_worker(db_fname):
+    """Initialize a worker process"""
+    _worker['conn'] = connect(db_fname)
+    _worker['catalog'] = load_catalog()
+
+
+def _render_rom(rom_id, basename, outdir, formats):
+    """Render reports for a single ROM in a worker process.
+
+    Returns a tuple of (rom_id, list of written files, elapsed time, error).
+    """
+    t0 = time.perf_counter()
+    files = list()
+    try:
+        record = RomRecord.load(_worker['conn'], rom_id, _worker['catalog'])
+        if 'text' in formats:
+            fname = Path(outdir) / f'{basename}.txt'
+            report_txt = record.make_text_report(cfg.templates.text)
+            with open(fname, 'w', encoding='utf-8') as f:
+                f.write(report_txt)
+            files.append(fname)
+        if 'excel' in formats:
+            fname = Path(outdir) / f'{basename}.xls'
+            record.make_excel_report(cfg.templates.xls).save(fname)
+            files.append(fname)
+    except Exception as e:  # report any failure, but keep processing
+        return rom_id, files, time.perf_counter() - t0, repr(e)
+    return rom_id, files, time.perf_counter() - t0, None
+
+
+def run_batch(db_fname, outdir, roms, formats=REPORT_FORMATS, workers=None):
+    """Render reports for a list of selected ROMs.
+
+    Prints per-report timings and a summary. Returns the number of failures.
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    timings = list()
+    n_failed = 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(db_fname,)
+    ) as executor:
+        futures = list()
+        for rom_id, patient_code, date in roms:
+            datestr = date.isoformat() if date else 'nodate'
+            basename = f'{patient_code}_{datestr}_{rom_id}'
+            futures.append(
+                executor.submit(_render_rom, rom_id, basename, outdir, formats)
+            )
+        for future in as_completed(futures):
+            rom_id, files, elapsed, error = future.result()
+            if error:
+                n_failed += 1
+                print(f'ROM {rom_id}: FAILED ({elapsed * 1000:.1f} ms): {error}')
+            else:
+                timings.append(elapsed)
+                names = ', '.join(f.name for f in files)
+                print(f'ROM {rom_id}: {names} ({elapsed * 1000:.1f} ms)')
+    total = time.perf_counter() - t0
+    n_ok = len(timings)
+    print(f'\n{n_ok} ROMs rendered, {n_failed} failed, in {total:.2f} s')
+    if n_ok:
+        print(f'throughput: {n_ok / total:.1f} ROMs/s')
+        print(f'per report: mean {statistics.mean(timings) * 1000:.1f} ms, '
+              f'max {max(timings) * 1000:.1f} ms')
+    return n_failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create ROM reports in batch mode')
+    parser.add_argument('outdir', help='directory for the reports')
+    parser.add_argument(
+        '--database',
+        help='path to the database file (default: configured database)',
+        default=cfg.database.database,
+    )
+    parser.add_argument('--from-date', help='first measurement date (dd.mm.yyyy)')
+    parser.add_argument('--to-date', help='last measurement date (dd.mm.yyyy)')
+    parser.add_argument(
+        '--patient-code',
+        help='select ROMs of given patients (can be repeated)',
+        action='append',
+        dest='patient_codes',
+    )
+    parser.add_argument(
+        '--format',
+        help='report format (default: both)',
+        choices=REPORT_FORMATS,
+        action='append',
+        dest='formats',
+    )
+    parser.add_argument(
+        '--workers',
+        help='number of worker processes (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    dates = dict()
+    for name in ('from_date', 'to_date'):
+        if (datestr := getattr(args, name)) is not None:
+            if (date := _parse_date(datestr)) is None:
+                parser.error(f'invalid date: {datestr}')
+            dates[name] = date
+
+    conn = connect(args.database)
+    roms = select_roms(conn, patient_codes=args.patient_codes, **dates)
+    conn.close()
+    print(f'{len(roms)} ROMs selected')
+    if not roms:
+        return
+    formats = args.formats or REPORT_FORMATS
+    n_failed = run_batch(args.database, args.outdir, roms, formats, args.workers)
+    if n_failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the latency of opening a ROM editor window.
+
+Compares loading the user interface at runtime (uic.loadUi) with the compiled
+and cached user interface modules (uicache). The editor is opened without a
+database, so only the window creation is measured. Run in the package
+directory:
+
+python bench_editor_open.py [-n ROUNDS]
+
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from PyQt5 import QtWidgets
+
+from config import cfg
+from rom_entryapp import EntryApp
+from uicache import UI_FILES, compile_package_ui
+
+
+def _time_editor_open(rounds):
+    """Return list of editor open times (s)"""
+    times = list()
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        editor = EntryApp(database=None)
+        times.append(time.perf_counter() - t0)
+        editor.deleteLater()
+        QtWidgets.QApplication.processEvents()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark opening the ROM editor')
+    parser.add_argument('-n', '--rounds', type=int, default=10, help='number of rounds')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)  # noqa: F841
+    # compile in advance, so that the one-time compilation is not measured
+    for uiname in UI_FILES:
+        compile_package_ui(uiname)
+
+    for compiled_ui, desc in [(False, 'loadUi'), (True, 'compiled (cached)')]:
+        cfg.visual.compiled_ui = compiled_ui
+        # the first round includes module imports etc.
+        first, *rest = _time_editor_open(args.rounds + 1)
+        print(
+            f'{desc:>20}: first {first * 1000:.0f} ms, '
+            f'mean {statistics.mean(rest) * 1000:.0f} ms, '
+            f'min {min(rest) * 1000:.0f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
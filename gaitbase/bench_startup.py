@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the time to the first window of gaitbase.
+
+Starts run_gaitbase.py --profile-startup repeatedly in new processes, so that
+the interpreter startup and all the imports are included. Reports the median
+duration of each startup phase, and exits with an error if the median time to
+the first window exceeds the target. Example:
+
+python bench_startup.py --target 2.0 --database synthetic.db
+
+Without --database, the configured database is used. The GUI is run on the
+offscreen Qt platform, unless another platform is set by QT_QPA_PLATFORM.
+
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# default target for the time to the first window (s)
+DEFAULT_TARGET = 2.0
+
+
+def measure_startup(rounds, database=None):
+    """Start the program repeatedly; return median duration (s) of each phase"""
+    script = Path(__file__).parent / 'run_gaitbase.py'
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    durations = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = Path(tmpdir) / 'startup.json'
+        for _ in range(rounds):
+            cmd = [sys.executable, str(script), '--profile-startup', str(fname)]
+            if database is not None:
+                cmd += ['--database', str(database)]
+            subprocess.run(cmd, env=env, check=True)
+            with open(fname, encoding='utf-8') as f:
+                for phase, duration in json.load(f).items():
+                    durations.setdefault(phase, list()).append(duration)
+    return {phase: statistics.median(values) for phase, values in durations.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of gaitbase')
+    parser.add_argument('-n', '--rounds', type=int, default=5, help='number of rounds')
+    parser.add_argument('--database', help='use this database instead of the configured one')
+    parser.add_argument(
+        '--target',
+        type=float,
+        default=DEFAULT_TARGET,
+        help=f'maximum time to the first window (s), default {DEFAULT_TARGET}',
+    )
+    args = parser.parse_args()
+
+    medians = measure_startup(args.rounds, args.database)
+    for phase, duration in medians.items():
+        print(f'{phase:>40}: {duration * 1000:7.0f} ms')
+    if (ttfw := medians['time to first window']) > args.target:
+        print(f'time to first window {ttfw:.2f} s exceeds the target of {args.target:.2f} s')
+        sys.exit(1)
+    print(f'time to first window {ttfw:.2f} s is within the target of {args.target:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
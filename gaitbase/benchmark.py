@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmarks of gaitbase.
+
+Times the hot paths of the program (startup, patient search and
+selection, opening ROM editors, writing changes, creating reports) using a
+synthetic database (see synthdb.py). The results are written as JSON, so that
+they can be compared between versions. Example:
+
+python benchmark.py results.json --patients 50000 --roms 500000
+
+An existing database can be used instead with --database. The GUI is run on the
+offscreen Qt platform, unless another platform is set by QT_QPA_PLATFORM.
+
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PyQt5 import QtWidgets
+
+from _gaitbase import PatientDialog
+from bench_startup import measure_startup
+from config import cfg
+from dbconnect import connect
+from rom_entryapp import EntryApp
+from rom_record import RomRecord
+from synthdb import create_synthetic_db
+
+# texts for the patient search benchmark; the empty text clears the search
+SEARCH_TEXTS = ['virt', 'C00', 'aino', 'ne', '']
+
+
+def _timeit(func, rounds):
+    """Call func repeatedly and return timing statistics (s)"""
+    times = list()
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {
+        'rounds': rounds,
+        'mean': statistics.mean(times),
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+    }
+
+
+def _git_commit():
+    """Return the current git commit of the package, if available"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _random_rom_ids(db_fname, n):
+    """Return n random ROM ids from the database"""
+    conn = sqlite3.connect(db_fname)
+    rom_ids = [
+        row[0] for row in conn.execute('SELECT rom_id FROM roms ORDER BY random() LIMIT ?', [n])
+    ]
+    conn.close()
+    return rom_ids
+
+
+def _random_patient_ids(db_fname, n):
+    """Return n random ids of patients with ROMs"""
+    conn = sqlite3.connect(db_fname)
+    patient_ids = [
+        row[0]
+        for row in conn.execute(
+            'SELECT DISTINCT patient_id FROM roms ORDER BY random() LIMIT ?', [n]
+        )
+    ]
+    conn.close()
+    return patient_ids
+
+
+def _spinbox_accessor(editor):
+    """Return name and accessor of a numeric widget on an initialized page"""
+    return next(
+        (wname, accessor)
+        for wname, accessor in editor.accessors.items()
+        if accessor.widget.__class__.__name__ == 'QSpinBox'
+        and wname not in editor.autowidgets
+    )
+
+
+def run_benchmarks(db_fname, rounds):
+    """Run the benchmarks on a database; return dict of results"""
+    cfg.database.database = str(db_fname)
+    results = dict()
+    rom_ids = itertools.cycle(_random_rom_ids(db_fname, rounds))
+    patient_ids = itertools.cycle(_random_patient_ids(db_fname, rounds))
+
+    def _startup():
+        dlg = PatientDialog()
+        dlg.close()
+        dlg.deleteLater()
+
+    results['patient_dialog_startup'] = _timeit(_startup, rounds)
+    QtWidgets.QApplication.processEvents()
+
+    dlg = PatientDialog()
+    # create the editor in advance, like the delayed startup prefill
+    dlg.editor_pool.prefill()
+
+    search_texts = itertools.cycle(SEARCH_TEXTS)
+
+    def _search():
+        dlg.lineEdit.setText(next(search_texts))
+        dlg._flush_search()
+
+    results['patient_search'] = _timeit(_search, rounds * len(SEARCH_TEXTS))
+    dlg.lineEdit.clear()
+    dlg._flush_search()
+
+    results['patient_select'] = _timeit(
+        lambda: dlg._select_patient(next(patient_ids)), rounds
+    )
+
+    def _open_editor():
+        editor = EntryApp(dlg.database, next(rom_ids))
+        editor.deleteLater()
+
+    results['editor_open'] = _timeit(_open_editor, rounds)
+    QtWidgets.QApplication.processEvents()
+
+    def _open_pooled_editor():
+        editor = dlg.editor_pool.acquire(next(rom_ids))
+        dlg.editor_pool.release(editor)
+
+    results['editor_open_pooled'] = _timeit(_open_pooled_editor, rounds)
+
+    editor = EntryApp(dlg.database, next(rom_ids))
+    wname, accessor = _spinbox_accessor(editor)
+    widget = accessor.widget
+    values = itertools.cycle(range(widget.minimum() + 1, widget.maximum() + 1))
+
+    def _write_value():
+        # the widget signal calls values_changed, which queues the write
+        widget.setValue(next(values))
+        editor.flush_updates()
+        editor.wait_for_writes()
+
+    results['values_changed_write'] = _timeit(_write_value, rounds)
+    results['values_changed_write']['widget'] = wname
+    results['editor_text_report'] = _timeit(
+        lambda: editor.make_text_report(cfg.templates.text), rounds
+    )
+    editor.force_close()
+    editor.deleteLater()
+
+    conn = connect(db_fname)
+    catalog = dlg.var_catalog
+    results['text_report'] = _timeit(
+        lambda: RomRecord.load(conn, next(rom_ids), catalog).make_text_report(
+            cfg.templates.text
+        ),
+        rounds,
+    )
+    results['excel_report'] = _timeit(
+        lambda: RomRecord.load(conn, next(rom_ids), catalog).make_excel_report(
+            cfg.templates.xls
+        ),
+        rounds,
+    )
+    conn.close()
+
+    dlg.close()
+    dlg.deleteLater()
+    QtWidgets.QApplication.processEvents()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the gaitbase benchmarks')
+    parser.add_argument('output', help='JSON file for the results')
+    parser.add_argument(
+        '--database', help='use an existing database instead of a synthetic one'
+    )
+    parser.add_argument('--patients', type=int, default=5000, help='number of patients')
+    parser.add_argument('--roms', type=int, default=50000, help='number of ROMs')
+    parser.add_argument('--rounds', type=int, default=10, help='rounds per benchmark')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QtWidgets.QApplication(sys.argv)  # noqa: F841
+
+    meta = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'rounds': args.rounds,
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.database:
+            db_fname = Path(args.database)
+        else:
+            db_fname = Path(tmpdir) / 'synthetic.db'
+            print(f'creating a database with {args.patients} patients, {args.roms} ROMs')
+            t0 = time.perf_counter()
+            create_synthetic_db(db_fname, args.patients, args.roms)
+            meta['create_database'] = time.perf_counter() - t0
+        conn = sqlite3.connect(db_fname)
+        meta['patients'], meta['roms'] = (
+            conn.execute(f'SELECT COUNT(*) FROM {table}').fetchall()[0][0]
+            for table in ('patients', 'roms')
+        )
+        conn.close()
+        results = run_benchmarks(db_fname, args.rounds)
+        # startup in new processes, including the imports
+        startup = measure_startup(args.rounds, db_fname)
+
+    for name, result in results.items():
+        print(f'{name:>25}: mean {result["mean"] * 1000:.1f} ms, min {result["min"] * 1000:.1f} ms')
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results, 'startup': startup}, f, indent=2)
+    for phase, duration in startup.items():
+        print(f'{phase:>40}: {duration * 1000:7.0f} ms')
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
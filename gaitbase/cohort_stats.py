@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Cohort statistics of numeric ROM variables.
+
+The selected variables are loaded from the database into NumPy arrays. Numeric
+variables may contain texts instead of numbers (see technotes.txt), so each
+value also has a status: a number, NULL, the 'not measured' text or some other
+text (e.g. 'within normal range' of CheckableSpinBox). The values are read from
+the database as such and classified in NumPy. The statistics are computed from
+the numbers only.
+
+The ROMs can be grouped by diagnosis (the first letter of the patient code, see
+Constants.patient_code_prefixes) and age band at the time of measurement
+(stats.age_bands). Variables measured on both sides (Oik/Vas in the variable
+name) are reported per side, and the left/right asymmetry is computed for each
+ROM where both sides were measured. Example:
+
+python cohort_stats.py --var 'Lonkka*' --by diagnosis --by age
+
+"""
+
+import argparse
+import csv
+import fnmatch
+import re
+import time
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+
+from config import cfg
+from constants import Constants
+from dbconnect import connect
+from varcatalog import load_catalog
+
+GROUPINGS = ('diagnosis', 'age')
+PERCENTILES = [5, 25, 50, 75, 95]
+# rows per fetch
+CHUNK_SIZE = 20000
+
+# status of a value
+NUMBER, NULL, NOVALUE, TEXT = 0, 1, 2, 3
+
+# the side of a variable, e.g. AntropPolviOik or IsokinPolviFleksioMomenttiVasNorm
+_SIDE_RE = re.compile(r'(Oik|Vas)(?=[A-Z]|$)')
+
+# the SQL columns preceding the variables: the diagnosis, the date of birth
+# from the SSN, and the date of measurement (dd.mm.yyyy, not always zero
+# padded). The ages are computed from the dates.
+_META_SQL = [
+    # diagnosis prefix as 1-based index into Constants.patient_code_prefixes
+    "instr(?, substr(patients.patient_code, 1, 1))",
+    "CAST(substr(patients.ssn, 1, 2) AS INTEGER)",
+    "CAST(substr(patients.ssn, 3, 2) AS INTEGER)",
+    # century from the SSN separator character
+    "CASE WHEN substr(patients.ssn, 7, 1) = '+' THEN 1800 "
+    "WHEN substr(patients.ssn, 7, 1) IN ('-', 'U', 'V', 'W', 'X', 'Y') THEN 1900 "
+    "WHEN substr(patients.ssn, 7, 1) IN ('A', 'B', 'C', 'D', 'E', 'F') THEN 2000 END "
+    "+ CAST(substr(patients.ssn, 5, 2) AS INTEGER)",
+    "CAST(roms.TiedotPvm AS INTEGER)",
+    "CAST(substr(roms.TiedotPvm, instr(roms.TiedotPvm, '.') + 1) AS INTEGER)",
+    "CAST(substr(roms.TiedotPvm, -4) AS INTEGER)",
+]
+
+
+def side_of(varname):
+    """Return the variable name without the side, and the side ('' if none)"""
+    if (m := _SIDE_RE.search(varname)) is None:
+        return varname, ''
+    return varname[: m.start()] + varname[m.end() :], m.group()
+
+
+def select_variables(catalog, patterns=None):
+    """Return the numeric variables matching any of the patterns (default all).
+
+    The patterns are shell-style, e.g. 'Lonkka*'.
+    """
+    numeric = [var for var, info in catalog.items() if info.affinity == 'NUMERIC']
+    if not patterns:
+        return numeric
+    return [var for var in numeric if any(fnmatch.fnmatchcase(var, p) for p in patterns)]
+
+
+@dataclass
+class CohortData:
+    """Values of numeric variables for a set of ROMs"""
+
+    varnames: list
+    # values (n_roms, n_vars); NaN where the value is not a number
+    values: np.ndarray
+    # status of each value (NUMBER, NULL, NOVALUE or TEXT)
+    status: np.ndarray
+    # diagnosis prefix of each ROM; '?' if unknown
+    diagnosis: np.ndarray
+    # age (years) at the time of measurement; NaN if unknown
+    age: np.ndarray
+
+    def age_bands(self, bands):
+        """Return the age band labels of the ROMs"""
+        labels = [f'{lo}-{hi - 1}' for lo, hi in zip(bands[:-1], bands[1:])]
+        labels = np.array(['unknown'] + labels + ['unknown'])
+        # NaN is sorted after all the bands
+        return labels[np.digitize(self.age, bands)]
+
+    def group_labels(self, by=()):
+        """Return the group labels of the ROMs for the given groupings"""
+        labels = np.full(len(self.age), 'all')
+        for k, grouping in enumerate(by):
+            if grouping == 'diagnosis':
+                group = self.diagnosis
+            elif grouping == 'age':
+                group = self.age_bands(cfg.stats.age_bands)
+            else:
+                raise ValueError(f'Unknown grouping: {grouping}')
+            labels = group if k == 0 else np.char.add(np.char.add(labels, ', '), group)
+        return labels
+
+
+def _classify(raw):
+    """Return the float values and the status of an object array of raw values"""
+    types = np.frompyfunc(type, 1, 1)(raw)
+    is_number = (types == int) | (types == float)
+    is_text = types == str
+    status = np.full(raw.shape, TEXT, dtype=np.int8)
+    status[is_number] = NUMBER
+    status[types == type(None)] = NULL
+    status[is_text] = np.where(raw[is_text] == Constants.spinbox_novalue_text, NOVALUE, TEXT)
+    values = np.full(raw.shape, np.nan)
+    values[is_number] = raw[is_number].astype(float)
+    return values, status
+
+
+def load_cohort(conn, varnames):
+    """Load the values of numeric variables for all ROMs"""
+    columns = _META_SQL + [f'roms.{var}' for var in varnames]
+    cursor = conn.execute(
+        f'SELECT {",".join(columns)} FROM roms JOIN patients USING (patient_id)',
+        [Constants.patient_code_prefixes],
+    )
+    n_meta, n_vars = len(_META_SQL), len(varnames)
+    chunks = list()
+    # the values are read as such and classified here, which is much faster
+    # than classifying each value in SQL
+    while rows := cursor.fetchmany(CHUNK_SIZE):
+        block = np.empty((len(rows), n_meta + n_vars), dtype=object)
+        block[:] = rows
+        # NULLs become NaN in the float arrays
+        meta = block[:, :n_meta].astype(float)
+        chunks.append((meta, *_classify(block[:, n_meta:])))
+    if chunks:
+        meta, values, status = (np.concatenate(arrays) for arrays in zip(*chunks))
+    else:
+        meta = np.empty((0, n_meta))
+        values = np.empty((0, n_vars))
+        status = np.empty((0, n_vars), dtype=np.int8)
+
+    prefix_idx, birth_d, birth_m, birth_y, meas_d, meas_m, meas_y = meta.T
+    prefixes = np.array(['?'] + list(Constants.patient_code_prefixes))
+    diagnosis = prefixes[np.nan_to_num(prefix_idx).astype(int)]
+    # birthday not yet reached in the year of measurement
+    before_birthday = (meas_m < birth_m) | ((meas_m == birth_m) & (meas_d < birth_d))
+    age = meas_y - birth_y - before_birthday
+    age[(age < 0) | (age > 120)] = np.nan
+    return CohortData(varnames, values, status, diagnosis, age)
+
+
+def grouped_stats(data, by=()):
+    """Compute statistics of each variable per group.
+
+    Returns a list of dicts, one per group and variable.
+    """
+    labels = data.group_labels(by)
+    groups, inverse = np.unique(labels, return_inverse=True)
+    sides = [side_of(var) for var in data.varnames]
+    results = list()
+    for k, group in enumerate(groups):
+        in_group = inverse == k
+        values = data.values[in_group]
+        status = data.status[in_group]
+        counts = {s: (status == s).sum(axis=0) for s in (NUMBER, NULL, NOVALUE, TEXT)}
+        # all-NaN columns give NaN, with a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            sd = np.nanstd(values, axis=0, ddof=1)
+            pcts = np.nanpercentile(values, PERCENTILES, axis=0)
+        for j, varname in enumerate(data.varnames):
+            result = {
+                'group': group,
+                'variable': sides[j][0],
+                'side': sides[j][1],
+                'varname': varname,
+                'n': int(counts[NUMBER][j]),
+                'n_novalue': int(counts[NOVALUE][j]),
+                'n_text': int(counts[TEXT][j]),
+                'n_null': int(counts[NULL][j]),
+                'mean': mean[j],
+                'sd': sd[j],
+            }
+            result.update({f'p{p}': pcts[i, j] for i, p in enumerate(PERCENTILES)})
+            results.append(result)
+    return results
+
+
+def side_pairs(varnames):
+    """Return the variables measured on both sides as (name, right, left) indices"""
+    right = dict()
+    left = dict()
+    for k, varname in enumerate(varnames):
+        base, side = side_of(varname)
+        if side == 'Oik':
+            right[base] = k
+        elif side == 'Vas':
+            left[base] = k
+    return [(base, right[base], left[base]) for base in right if base in left]
+
+
+def asymmetry_stats(data, by=()):
+    """Compute the right-left differences of variables measured on both sides.
+
+    Only ROMs where both sides were measured are included. Returns a list of
+    dicts, one per group and variable.
+    """
+    if not (pairs := side_pairs(data.varnames)):
+        return list()
+    bases, right, left = zip(*pairs)
+    diff = data.values[:, list(right)] - data.values[:, list(left)]
+    labels = data.group_labels(by)
+    groups, inverse = np.unique(labels, return_inverse=True)
+    results = list()
+    for k, group in enumerate(groups):
+        group_diff = diff[inverse == k]
+        n = (~np.isnan(group_diff)).sum(axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(group_diff, axis=0)
+            sd = np.nanstd(group_diff, axis=0, ddof=1)
+            mean_abs = np.nanmean(np.abs(group_diff), axis=0)
+        for j, base in enumerate(bases):
+            results.append(
+                {
+                    'group': group,
+                    'variable': base,
+                    'n': int(n[j]),
+                    'mean_diff': mean[j],
+                    'sd_diff': sd[j],
+                    'mean_absdiff': mean_abs[j],
+                }
+            )
+    return results
+
+
+def format_value(value):
+    """Format a result value for display"""
+    if isinstance(value, float):
+        return '' if np.isnan(value) else f'{value:.4g}'
+    return str(value)
+
+
+def format_table(results):
+    """Format a list of result dicts as a text table"""
+    if not results:
+        return '(no results)'
+    headers = list(results[0])
+    rows = [[format_value(result[h]) for h in headers] for result in results]
+    widths = [max(len(h), *(len(row[k]) for row in rows)) for k, h in enumerate(headers)]
+    lines = ['  '.join(h.ljust(w) for h, w in zip(headers, widths))]
+    lines += ['  '.join(s.ljust(w) for s, w in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
+
+
+def write_csv(results, fname):
+    """Write a list of result dicts into a CSV file"""
+    with open(fname, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        if results:
+            writer.writerow(list(results[0]))
+            writer.writerows([format_value(v) for v in r.values()] for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute cohort statistics of ROM variables')
+    parser.add_argument(
+        '--database',
+        help='path to the database file (default: configured database)',
+        default=cfg.database.database,
+    )
+    parser.add_argument(
+        '--var',
+        help="numeric variables, e.g. 'Lonkka*' (can be repeated; default: all)",
+        action='append',
+        dest='patterns',
+    )
+    parser.add_argument(
+        '--by',
+        help='group the ROMs (can be repeated)',
+        choices=GROUPINGS,
+        action='append',
+        default=[],
+    )
+    parser.add_argument('--csv', help='write the statistics into a CSV file')
+    parser.add_argument('--asymmetry-csv', help='write the asymmetries into a CSV file')
+    args = parser.parse_args()
+
+    if not (varnames := select_variables(load_catalog(), args.patterns)):
+        parser.error('no numeric variables match')
+    t0 = time.perf_counter()
+    conn = connect(args.database)
+    try:
+        data = load_cohort(conn, varnames)
+    finally:
+        conn.close()
+    t_load = time.perf_counter() - t0
+    stats = grouped_stats(data, args.by)
+    asymmetry = asymmetry_stats(data, args.by)
+    t_total = time.perf_counter() - t0
+
+    print(format_table(stats))
+    print()
+    print(format_table(asymmetry))
+    print(
+        f'\n{len(data.age)} ROMs, {len(varnames)} variables; '
+        f'loaded in {t_load:.2f} s, total {t_total:.2f} s'
+    )
+    if args.csv:
+        write_csv(stats, args.csv)
+    if args.asymmetry_csv:
+        write_csv(asymmetry, args.asymmetry_csv)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,14 +10,15 @@ config file.
 
 from pathlib import Path
 from configdot import parse_config, update_config, dump_config
-from pkg_resources import resource_filename
 import logging
 
+from utils import package_file
+
 
 logger = logging.getLogger(__name__)
 
 # location of the default config file
-cfg_package_fn = resource_filename(__name__, 'data/default.cfg')
+cfg_package_fn = package_file('data/default.cfg')
 # Location of the user specific config file. On Windows, this typically puts the
 # config at C:\Users\Username, since the USERPROFILE environment variable points
 # there. Putting the config in a networked home dir requires some tinkering with
@@ -49,11 +50,7 @@ else:
 # if template locations are not configured by the user, we revert to package
 # default templates
 if cfg.templates.text is None:
-    cfg.templates.text = resource_filename(
-        'gaitbase', 'templates/text_template.py'
-    )
+    cfg.templates.text = package_file('templates/text_template.py')
 
 if cfg.templates.xls is None:
-    cfg.templates.xls = resource_filename(
-        'gaitbase', 'templates/rom_excel_template.xls'
-    )
+    cfg.templates.xls = package_file('templates/rom_excel_template.xls')
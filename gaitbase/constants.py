@@ -39,6 +39,7 @@ class Finnish:
     ok_button: str = 'Ok'
     ready: str = 'Valmis, {n} syötekenttää käytössä.'
     status_cleared: str = 'Kaikki lomakkeet tyhjennetty.'
+    db_locked: str = 'Tietokanta on lukittu, tallennusta yritetään uudelleen ({n}. yritys)...'
     keys_not_found: str = (
         'Seuraavia ohjelman käyttämiä muuttujia ei löytynyt tiedostosta:\n{keys}\n'
     )
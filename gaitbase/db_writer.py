@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer for ROM updates.
+
+The writer runs in a dedicated thread that owns its own SQLite connection.
+Update batches are taken from a queue, coalesced per ROM and written into the
+database. If the database is locked by another client, the write is retried
+with exponential backoff. The backoff is kept per ROM, so the other ROMs are
+written meanwhile. Results are reported back to the GUI thread using Qt
+signals, so the editor never blocks on database locks.
+
+The writer also counts its commits, and can check whether other connections
+have committed changes since the previous check (request_check). The main
+window uses these to tell the changes made by other clients apart from our own
+writes. Since the commits of the main window connection also look foreign to
+the writer, the main window reports them using note_commit().
+
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from PyQt5 import QtCore
+
+from dbconnect import connect
+
+logger = logging.getLogger(__name__)
+
+# busy timeout (ms) for a single write attempt; kept short, so that lock
+# contention is reported to the user instead of silently waiting
+WRITE_TIMEOUT = 1000
+# initial and maximum delay (s) between retries of a locked write
+RETRY_DELAY = 0.2
+MAX_RETRY_DELAY = 5.0
+
+# queue items that request a check for commits by other connections, and
+# report a commit made by another connection of this program
+_CHECK = 'check'
+_OWN_COMMIT = 'own commit'
+
+
+def _is_lock_error(exc):
+    """Check whether a sqlite3 exception was caused by database locking"""
+    msg = str(exc).lower()
+    return 'locked' in msg or 'busy' in msg
+
+
+class RomWriter(QtCore.QObject):
+    """Writes ROM updates into the database in a background thread"""
+
+    # emitted after a successful write; argument is rom_id
+    write_done = QtCore.pyqtSignal(object)
+    # emitted when a write failed due to locking and will be retried;
+    # arguments are rom_id, error message and number of failed attempts
+    write_retrying = QtCore.pyqtSignal(object, str, int)
+    # emitted when a write failed permanently (e.g. schema mismatch) and the
+    # batch was discarded; arguments are rom_id and error message
+    write_error = QtCore.pyqtSignal(object, str)
+    # emitted by a requested check if other connections have committed
+    # changes since the previous check
+    foreign_commit = QtCore.pyqtSignal()
+
+    def __init__(self, db_path):
+        super().__init__()
+        self.db_path = str(db_path)
+        self._queue = queue.Queue()
+        # coalesced updates waiting to be written, as (updates, seq) keyed by
+        # rom_id, where seq is that of the latest batch; only accessed from the
+        # writer thread
+        self._pending = dict()
+        # retries of locked writes, as (number of failed attempts, time of the
+        # next attempt) keyed by rom_id; only accessed from the writer thread
+        self._retries = dict()
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        # per-ROM sequence numbers of the submitted batches, and of the latest
+        # batch that was written or discarded
+        self._written = threading.Condition(self._lock)
+        self._submitted_seq = dict()
+        self._written_seq = dict()
+        # number of successful commits; only written by the writer thread
+        self.commits = 0
+        # the writer thread connection, and its PRAGMA data_version as of the
+        # previous check
+        self._conn = None
+        self._data_version = None
+        self._thread = threading.Thread(
+            target=self._run, name=f'RomWriter({self.db_path})', daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, rom_id, updates):
+        """Queue a dict of {variable: value} updates for a ROM"""
+        with self._lock:
+            self._idle.clear()
+            seq = self._submitted_seq.get(rom_id, 0) + 1
+            self._submitted_seq[rom_id] = seq
+            self._queue.put((rom_id, seq, dict(updates)))
+
+    def request_check(self):
+        """Request a check for commits by other connections (foreign_commit)"""
+        self._queue.put(_CHECK)
+
+    def note_commit(self):
+        """Report a commit made by another connection of this program.
+
+        Call this right after the commit. The commit is then not reported by a
+        later check. A commit by another client made at the same moment may go
+        unnoticed until the next one.
+        """
+        self._queue.put(_OWN_COMMIT)
+
+    def wait_idle(self, timeout=None):
+        """Wait until all queued updates are written.
+
+        Returns True if the writer became idle within the timeout.
+        """
+        return self._idle.wait(timeout)
+
+    def wait_written(self, rom_id, timeout=None):
+        """Wait until the updates submitted so far for a ROM are written.
+
+        Updates of other ROMs are not waited for. Returns True if the updates
+        were written (or discarded due to an error) within the timeout.
+        """
+        with self._written:
+            return self._written.wait_for(
+                lambda: self._written_seq.get(rom_id, 0) >= self._submitted_seq.get(rom_id, 0),
+                timeout,
+            )
+
+    def stop(self, timeout=None):
+        """Write out the remaining updates and stop the thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _collect(self, block=True, timeout=None):
+        """Move queued batches into the pending dict, coalescing per ROM.
+
+        Returns False if a stop request was received.
+        """
+        try:
+            item = self._queue.get(block, timeout)
+        except queue.Empty:
+            return True
+        while item is not None:
+            # the checks and the reported commits are handled in queue order
+            if item == _CHECK:
+                self._check_foreign(report=True)
+            elif item == _OWN_COMMIT:
+                self._check_foreign(report=False)
+            else:
+                rom_id, seq, updates = item
+                pending_updates, _ = self._pending.get(rom_id, (dict(), 0))
+                pending_updates.update(updates)
+                self._pending[rom_id] = (pending_updates, seq)
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return True
+        return False
+
+    @staticmethod
+    def _write(conn, rom_id, updates):
+        """Write updates for a single ROM as one transaction"""
+        thevars = list(updates)
+        varlist = ','.join(f'{var} = ?' for var in thevars)
+        values = [updates[var] for var in thevars] + [rom_id]
+        try:
+            conn.execute(f'UPDATE roms SET {varlist} WHERE rom_id = ?', values)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    def _run(self):
+        """The writer thread main loop"""
+        conn = self._conn = connect(self.db_path, busy_timeout=WRITE_TIMEOUT)
+        # PRAGMA data_version of this connection changes only when other
+        # connections commit
+        self._data_version = _data_version(conn)
+        running = True
+        while True:
+            if not self._pending:
+                with self._lock:
+                    if self._queue.empty():
+                        self._idle.set()
+                if not running:
+                    break
+                running = self._collect(block=True)
+                continue
+            if running:
+                running = self._collect(block=False)
+            rom_id, wait = self._next_write()
+            if rom_id is None:
+                # all the pending ROMs are waiting to be retried; keep
+                # collecting new updates meanwhile
+                running = self._collect(block=True, timeout=wait) and running
+                continue
+            updates, seq = self._pending[rom_id]
+            try:
+                self._write(conn, rom_id, updates)
+            except sqlite3.OperationalError as e:
+                if not _is_lock_error(e):
+                    self._discard(rom_id, seq, e)
+                    continue
+                attempt = self._retries.get(rom_id, (0, 0))[0] + 1
+                logger.warning(f'write of ROM {rom_id} failed ({attempt=}): {e}')
+                self.write_retrying.emit(rom_id, str(e), attempt)
+                delay = min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+                self._retries[rom_id] = (attempt, time.monotonic() + delay)
+            except sqlite3.Error as e:
+                self._discard(rom_id, seq, e)
+            else:
+                del self._pending[rom_id]
+                self._retries.pop(rom_id, None)
+                self._mark_written(rom_id, seq)
+                self.commits += 1
+                self.write_done.emit(rom_id)
+        conn.close()
+
+    def _next_write(self):
+        """Return the next ROM to write, and None or the time to wait (s).
+
+        The ROMs are written in the order of their first update, skipping the
+        ones that are waiting for a retry. If all of them are waiting, returns
+        None and the time until the next retry.
+        """
+        now = time.monotonic()
+        retry_times = list()
+        for rom_id in self._pending:
+            if (retry := self._retries.get(rom_id)) is None or retry[1] <= now:
+                return rom_id, None
+            retry_times.append(retry[1])
+        return None, min(retry_times) - now
+
+    def _check_foreign(self, report):
+        """Check for commits by other connections since the previous check.
+
+        If report is False, the commits are known to be our own and are only
+        taken into account.
+        """
+        try:
+            version = _data_version(self._conn)
+        except sqlite3.Error as e:
+            logger.warning(f'could not check for foreign commits: {e}')
+            return
+        if version != self._data_version:
+            self._data_version = version
+            if report:
+                self.foreign_commit.emit()
+
+    def _mark_written(self, rom_id, seq):
+        """Record that the batches of a ROM up to seq are done with"""
+        with self._written:
+            self._written_seq[rom_id] = seq
+            self._written.notify_all()
+
+    def _discard(self, rom_id, seq, exc):
+        """Drop a batch that cannot be written"""
+        logger.error(f'could not write ROM {rom_id}: {exc}')
+        del self._pending[rom_id]
+        self._retries.pop(rom_id, None)
+        self._mark_written(rom_id, seq)
+        self.write_error.emit(rom_id, str(exc))
+
+
+def _data_version(conn):
+    return conn.execute('PRAGMA data_version').fetchall()[0][0]
+
+
+# one writer per database file, shared by all editor windows
+_writers = dict()
+
+
+def shared_writer(db_path):
+    """Return the writer for a database, starting it if necessary"""
+    db_path = str(db_path)
+    if db_path not in _writers:
+        _writers[db_path] = RomWriter(db_path)
+    return _writers[db_path]
+
+
+def stop_writers(timeout=None):
+    """Stop all writers, writing out any remaining updates"""
+    while _writers:
+        _, writer = _writers.popitem()
+        writer.stop(timeout)
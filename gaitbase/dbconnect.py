@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Database connections with a uniform tuning profile.
+
+All SQLite connections opened by the package should be created (sqlite3) or
+configured (QtSql) using the functions in this module, so that the settings in
+the [database] section of the config are applied everywhere.
+
+The journal mode needs special care. The write-ahead log (WAL) allows readers
+and writers to proceed concurrently, but it relies on shared memory and thus
+does not work for databases on network shares. The journal mode is stored in
+the database file, so a database that is set to WAL on a local disk stays in WAL
+if it is later copied to a network share. Thus WAL is only used if explicitly
+configured. In 'auto' mode, the rollback journal (DELETE) is ensured for
+databases on network shares, and the mode of other databases is left as is.
+
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import sqlstats
+from config import cfg
+
+logger = logging.getLogger(__name__)
+
+# filesystem types (as reported in /proc/mounts) that are network filesystems
+NETWORK_FILESYSTEMS = {
+    'cifs',
+    'smbfs',
+    'smb3',
+    'nfs',
+    'nfs4',
+    'afs',
+    '9p',
+    'fuse.sshfs',
+    'davfs',
+}
+
+
+def is_network_path(path):
+    """Check whether a file resides on a network filesystem"""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):  # UNC path
+        return True
+    if sys.platform == 'win32':
+        import ctypes
+
+        drive = os.path.splitdrive(path)[0]
+        DRIVE_REMOTE = 4
+        return bool(drive) and (
+            ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == DRIVE_REMOTE
+        )
+    # on POSIX, find the filesystem of the longest matching mount point
+    try:
+        with open('/proc/mounts', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    best_mount, best_fstype = '', None
+    for mount, fstype in mounts:
+        mount = mount.replace('\\040', ' ')
+        if Path(path).is_relative_to(mount) and len(mount) > len(best_mount):
+            best_mount, best_fstype = mount, fstype
+    return best_fstype in NETWORK_FILESYSTEMS
+
+
+def journal_mode_for(path):
+    """Return the journal mode to use for a database, or None to leave as is"""
+    mode = cfg.database.journal_mode
+    if mode is None:
+        return None
+    mode = mode.upper()
+    if mode == 'AUTO':
+        return 'DELETE' if is_network_path(path) else None
+    return mode
+
+
+def tuning_pragmas(path, journal_mode):
+    """Return the PRAGMA statements of the tuning profile for a database.
+
+    journal_mode is the journal mode that is active for the connection. The
+    journal mode itself is set separately (see journal_mode_for), since the
+    other settings depend on the resulting mode.
+    """
+    dbcfg = cfg.database
+    network = is_network_path(path)
+    pragmas = ['PRAGMA foreign_keys = ON']
+    if dbcfg.busy_timeout is not None:
+        pragmas.append(f'PRAGMA busy_timeout = {int(dbcfg.busy_timeout)}')
+    if dbcfg.cache_size is not None:
+        pragmas.append(f'PRAGMA cache_size = {int(dbcfg.cache_size)}')
+    # memory mapped I/O is not safe over network filesystems
+    if dbcfg.mmap_size is not None and not network:
+        pragmas.append(f'PRAGMA mmap_size = {int(dbcfg.mmap_size)}')
+    synchronous = dbcfg.synchronous
+    if synchronous is None:
+        # NORMAL is safe with WAL; the rollback journal needs FULL
+        synchronous = 'NORMAL' if journal_mode == 'WAL' else 'FULL'
+    pragmas.append(f'PRAGMA synchronous = {synchronous}')
+    if dbcfg.temp_store is not None:
+        pragmas.append(f'PRAGMA temp_store = {dbcfg.temp_store}')
+    return pragmas
+
+
+def connect(path, busy_timeout=None, **kwargs):
+    """Open a sqlite3 connection and apply the tuning profile.
+
+    busy_timeout (ms) overrides the configured value. Other keyword arguments
+    are passed to sqlite3.connect(). If SQL statistics are enabled, the queries
+    of the connection are recorded (see sqlstats.py).
+    """
+    if sqlstats.enabled:
+        kwargs.setdefault('factory', sqlstats.StatsConnection)
+    conn = sqlite3.connect(path, **kwargs)
+    if (mode := journal_mode_for(path)) is not None:
+        try:
+            conn.execute(f'PRAGMA journal_mode = {mode}').fetchall()
+        except sqlite3.OperationalError as e:
+            # changing the journal mode requires exclusive access
+            logger.warning(f'could not set journal mode {mode} for {path}: {e}')
+    journal_mode = active_journal_mode(conn)
+    _check_journal_mode(path, journal_mode)
+    for pragma in tuning_pragmas(path, journal_mode):
+        try:
+            conn.execute(pragma).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning(f'could not apply {pragma!r} to {path}: {e}')
+    if busy_timeout is not None:
+        conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+    return conn
+
+
+def configure_qt_database(database):
+    """Apply the tuning profile to an open QSqlDatabase connection"""
+    path = database.databaseName()
+    if (mode := journal_mode_for(path)) is not None:
+        sqlstats.exec_sql(database, f'PRAGMA journal_mode = {mode}').finish()
+    journal_mode = active_journal_mode_qt(database)
+    _check_journal_mode(path, journal_mode)
+    for pragma in tuning_pragmas(path, journal_mode):
+        query = sqlstats.exec_sql(database, pragma)
+        query.finish()
+
+
+def active_journal_mode(conn):
+    """Return the journal mode that is actually in use for a sqlite3 connection"""
+    return conn.execute('PRAGMA journal_mode').fetchall()[0][0].upper()
+
+
+def active_journal_mode_qt(database):
+    """Return the journal mode that is actually in use for a QSqlDatabase"""
+    query = sqlstats.exec_sql(database, 'PRAGMA journal_mode')
+    mode = query.value(0).upper() if query.next() else ''
+    query.finish()
+    return mode
+
+
+def _check_journal_mode(path, active_mode):
+    """Warn if the journal mode could not be set as requested"""
+    if (wanted := journal_mode_for(path)) is not None and wanted != active_mode:
+        # changing the journal mode fails e.g. if other clients are connected
+        logger.warning(
+            f'requested journal mode {wanted} for {path}, but {active_mode} is active'
+        )
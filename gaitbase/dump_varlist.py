@@ -6,32 +6,14 @@ Dump gaitbase variable names and their SQLite affinities.
 @author: jussi (jnu@iki.fi)
 """
 import json
-import sys
 import argparse
 
-from PyQt5 import QtWidgets
-
-from rom_entryapp import EntryApp
-
-
-def _type_affinity(widget):
-    """Return type affinity (sqlite) for each widget"""
-    widget_class = widget.__class__.__name__
-    if widget_class in ('QSpinBox', 'QDoubleSpinBox', 'CheckableSpinBox'):
-        return 'NUMERIC'
-    else:
-        return 'TEXT'
+from varcatalog import load_catalog
 
 
 def get_vars_and_affinities():
     """Get a dict of variable names and their SQLite type affinities"""
-    app = QtWidgets.QApplication(sys.argv)  # needed for Qt stuff to function
-    eapp = EntryApp()
-    affs = dict()
-    for wname, widget in eapp.input_widgets.items():
-        varname = eapp.widget_to_var[wname]
-        affs[varname] = _type_affinity(widget)
-    return affs
+    return {varname: info.affinity for varname, info in load_catalog().items()}
 
 
 if __name__ == '__main__':
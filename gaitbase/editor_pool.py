@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of ROM editor windows.
+
+Creating a ROM editor builds a large widget tree, which takes a while. Instead
+of destroying closed editors, the pool keeps them hidden and rebinds them to the
+next ROM that is opened (EntryApp.bind). The number of idle editors is limited,
+and the least recently used ones are destroyed first. Idle editors are also
+destroyed if the memory use of the process exceeds a limit.
+
+"""
+
+import logging
+from collections import OrderedDict
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class EditorPool:
+    """Pool of idle ROM editors for reuse"""
+
+    def __init__(self, database, size, memory_limit, on_closing):
+        """Init the pool.
+
+        size is the maximum number of idle editors, and memory_limit is the
+        process memory use (MiB) above which idle editors are not kept.
+        on_closing is connected to the closing signal of each created editor.
+        """
+        self.database = database
+        self.size = size
+        self.memory_limit = memory_limit
+        self.on_closing = on_closing
+        # idle editors in the order of release (least recently used first)
+        self._idle = OrderedDict()
+
+    def _create(self, rom_id=None, newly_created=False):
+        # the editor module is imported on first use, to speed up startup
+        from rom_entryapp import EntryApp
+
+        editor = EntryApp(self.database, rom_id, newly_created)
+        editor.closing.connect(self.on_closing)
+        return editor
+
+    def acquire(self, rom_id, newly_created=False):
+        """Return an editor bound to a ROM; reuse an idle one if possible"""
+        if self._idle:
+            # the most recently used editor is the most likely to be in memory
+            editor, _ = self._idle.popitem(last=True)
+            editor.bind(rom_id, newly_created)
+            return editor
+        return self._create(rom_id, newly_created)
+
+    def release(self, editor):
+        """Return a closed editor into the pool"""
+        self._idle[editor] = None
+        self._trim()
+
+    def prefill(self):
+        """Create an idle editor in advance, unless there is one already"""
+        if not self._idle and self.size > 0:
+            self.release(self._create())
+
+    def _memory_use(self):
+        """Return the memory use (MiB) of the process"""
+        return psutil.Process().memory_info().rss / 2**20
+
+    def _trim(self):
+        """Destroy idle editors to satisfy the size and memory limits"""
+        while len(self._idle) > self.size or (
+            self._idle and self._memory_use() > self.memory_limit
+        ):
+            editor, _ = self._idle.popitem(last=False)
+            logger.debug(f'destroying idle editor, {len(self._idle)} left')
+            editor.deleteLater()
+
+    def clear(self):
+        """Destroy all idle editors"""
+        while self._idle:
+            editor, _ = self._idle.popitem()
+            editor.deleteLater()
@@ -6,17 +6,16 @@ the script needs to be adapted to create the corresponding tables.
 
 """
 from pathlib import Path
-import sqlite3
 
 from gaitbase.dump_varlist import get_vars_and_affinities
 from constants import Constants
+from dbconnect import connect
+from schema import create_change_log, create_indexes
 
 DB_FILEPATH = Path('patients.db')
 
-def main():
-    if DB_FILEPATH.is_file():
-        raise RuntimeError(f'File {DB_FILEPATH} already exists!')
-    conn = sqlite3.connect(DB_FILEPATH)
+def create_schema(conn):
+    """Create the tables and indexes using a sqlite3 connection"""
     conn.execute('PRAGMA foreign_keys = ON;')
 
     # create the patient table
@@ -49,12 +48,26 @@ def main():
 
     conn.execute(query)
 
+    # create the declared indexes
+    create_indexes(conn)
+
+    # log the changes of the rows, for refreshing local replicas
+    create_change_log(conn)
+
     # Write the DB version using PRAGMA
     conn.execute(f'PRAGMA user_version = {Constants.db_version}')
 
     conn.commit()
 
+
+def main():
+    if DB_FILEPATH.is_file():
+        raise RuntimeError(f'File {DB_FILEPATH} already exists!')
+    conn = connect(DB_FILEPATH)
+    create_schema(conn)
+    conn.close()
+
     print(f'created an empty database at {DB_FILEPATH.resolve()}')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
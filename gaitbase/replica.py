@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Local read replica of the database.
+
+For databases on network shares (e.g. accessed from home over VPN), every read
+costs network round trips. In replica mode, the patient and ROM lists are
+browsed from a local copy of the database, while all writes still go to the
+primary database.
+
+The copy is made using the SQLite online backup API. Copying can take long, so
+it is done into a new file (copy_primary, which can be run in a background
+thread) that then replaces the replica (swap). Changes are detected by PRAGMA
+data_version and the file modification time of the primary. They are applied by
+copying only the rows that were changed since the copy, as listed by the change
+log of the primary (see schema.py). A new copy is needed only if the primary
+has no change log, or if the replica has fallen behind the pruned log. Changes
+made by this client are also mirrored into the replica right away, row by row.
+
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from dbconnect import connect
+from schema import LOGGED_TABLES, changes_since, last_change
+
+logger = logging.getLogger(__name__)
+
+# number of pages to copy per backup step; the primary is unlocked between
+# steps, so that other clients are not blocked during a long copy
+BACKUP_PAGES = 1024
+# a write by another client restarts the copy; after this many restarts, the
+# rest is copied in a single step, which blocks the writers until done
+MAX_BACKUP_RESTARTS = 3
+# maximum number of keys per query
+KEYS_PER_QUERY = 500
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def default_replica_path(primary_path):
+    """Return the default location of the local replica for a database"""
+    key = hashlib.sha1(str(Path(primary_path).resolve()).encode()).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / f'gaitbase_replica_{key}.db'
+
+
+def _backup(source, target):
+    """Copy a database using the backup API, in steps"""
+    restarts = 0
+    previous = None
+
+    def _progress(status, remaining, total):
+        nonlocal restarts, previous
+        # the copy did not proceed, so it was restarted
+        if previous is not None and remaining >= previous:
+            restarts += 1
+            if restarts > MAX_BACKUP_RESTARTS:
+                raise _TooManyRestarts
+        previous = remaining
+
+    try:
+        source.backup(target, pages=BACKUP_PAGES, progress=_progress)
+    except _TooManyRestarts:
+        logger.warning('database is being modified, copying it in a single step')
+        source.backup(target, pages=-1)
+
+
+def _key_chunks(key, keys):
+    """Yield WHERE clauses and parameters selecting rows by their keys"""
+    keys = sorted(keys)
+    for k in range(0, len(keys), KEYS_PER_QUERY):
+        chunk = keys[k : k + KEYS_PER_QUERY]
+        yield f'{key} IN ({",".join("?" * len(chunk))})', chunk
+
+
+class LocalReplica:
+    """A local copy of the primary database"""
+
+    def __init__(self, primary_path, replica_path=None):
+        self.primary_path = str(primary_path)
+        self.replica_path = str(replica_path or default_replica_path(primary_path))
+        # The connection to the primary is kept open, since PRAGMA
+        # data_version only detects commits made by other connections. It
+        # does not hold any locks while idle.
+        self._primary = connect(self.primary_path)
+        # the connection to the replica, opened when the first copy is in
+        # place (swap); foreign keys are not enforced in the replica, since
+        # rows are mirrored from the primary as they are
+        self._local = None
+        self._seen_state = None
+        # the latest change log entry applied to the replica; None if the
+        # primary has no change log
+        self._seq = None
+
+    @property
+    def ready(self):
+        """Whether the replica can be used"""
+        return self._local is not None
+
+    @property
+    def _new_path(self):
+        return self.replica_path + '.new'
+
+    def primary_state(self):
+        """Return a value that changes whenever the primary is modified"""
+        data_version = self._primary.execute('PRAGMA data_version').fetchall()[0][0]
+        return data_version, os.stat(self.primary_path).st_mtime_ns
+
+    def is_stale(self, state=None):
+        """Check whether the primary was modified since the last sync.
+
+        state is a value from primary_state(); by default it is read now.
+        """
+        return (state or self.primary_state()) != self._seen_state
+
+    def mark_synced(self, state):
+        """Accept a state of the primary as synchronized.
+
+        Only call this with a state that was read when the replica was known to
+        match the primary, otherwise changes by other clients are missed.
+        """
+        self._seen_state = state
+
+    def copy_primary(self):
+        """Copy the primary database into a new file, to be swapped in.
+
+        This uses its own connections, so it can be run in a background thread.
+        Read the state of the primary before calling this. Returns the sequence
+        number of the latest change in the copy, to be passed to swap().
+        """
+        Path(self._new_path).unlink(missing_ok=True)
+        logger.debug(f'copying {self.primary_path} to {self._new_path}')
+        source = connect(self.primary_path)
+        target = sqlite3.connect(self._new_path)
+        try:
+            _backup(source, target)
+            return last_change(target)
+        finally:
+            source.close()
+            target.close()
+
+    def swap(self, state, seq):
+        """Replace the replica with the copy made by copy_primary().
+
+        state is the state of the primary that was read before the copy, and
+        seq is the value returned by copy_primary(). Other connections to the
+        replica must be closed meanwhile.
+        """
+        ready = self.ready
+        if ready:
+            self._local.close()
+        try:
+            os.replace(self._new_path, self.replica_path)
+        except OSError:
+            # keep using the previous copy
+            if ready:
+                self._local = sqlite3.connect(self.replica_path)
+            raise
+        self._local = sqlite3.connect(self.replica_path)
+        self._seen_state = state
+        self._seq = seq
+        if seq is None:
+            logger.warning(
+                f'{self.primary_path} has no change log, so the local copy is '
+                'copied again on every change; create it using update_rom_schema.py -u'
+            )
+
+    def refresh(self):
+        """Copy the rows changed since the copy or the previous refresh.
+
+        Returns the changed keys as {table: set of keys}, or None if the
+        changes are not available in the change log; a new copy is needed then.
+        """
+        if self._seq is None:
+            return None
+        # changes made after reading the state are detected on the next check
+        state = self.primary_state()
+        # read the changes and the rows in a single read transaction
+        self._primary.execute('BEGIN')
+        try:
+            if (result := changes_since(self._primary, self._seq)) is None:
+                return None
+            seq, changes = result
+            updates = [
+                (table, where, params, self._read_rows(table, where, params))
+                for table, keys in changes.items()
+                for where, params in _key_chunks(LOGGED_TABLES[table], keys)
+            ]
+        finally:
+            self._primary.rollback()
+        with self._local:
+            for table, where, params, rows in updates:
+                self._write_rows(table, where, params, rows)
+        self._seq = seq
+        self._seen_state = state
+        return changes
+
+    def mirror(self, table, where, params=()):
+        """Copy rows matching a WHERE clause from the primary into the replica.
+
+        Rows that no longer exist in the primary are deleted from the replica.
+        This is used to apply our own changes right away.
+        """
+        if not self.ready:
+            return
+        rows = self._read_rows(table, where, params)
+        with self._local:
+            self._write_rows(table, where, params, rows)
+
+    def _read_rows(self, table, where, params):
+        return self._primary.execute(f'SELECT * FROM {table} WHERE {where}', params).fetchall()
+
+    def _write_rows(self, table, where, params, rows):
+        """Replace the rows matching a WHERE clause in the replica"""
+        self._local.execute(f'DELETE FROM {table} WHERE {where}', params)
+        if rows:
+            placeholders = ','.join('?' * len(rows[0]))
+            self._local.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+
+    def close(self):
+        self._primary.close()
+        if self._local is not None:
+            self._local.close()
@@ -6,29 +6,31 @@ Gaitbase app for entering ROM values.
 """
 
 import datetime
+import graphlib
 import json
 import logging
 from pathlib import Path
 
 import sip
-from pkg_resources import resource_filename
-from PyQt5 import QtCore, QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtSql import QSqlQuery
 from PyQt5.QtGui import QPalette, QColor
 
 import rom_reporter
 from config import cfg
+from db_writer import shared_writer
+from sqlstats import exec_query
+from uicache import load_paged_ui, load_ui_page
+from varcatalog import load_catalog
 from constants import Constants, Finnish
 from widgets import (
     DegLineEdit,
     MyLineEdit,
     qt_message_dialog,
     keyPressEvent_resetOnEsc,
-    get_widget_value,
-    get_widget_units,
-    set_widget_value,
+    make_accessor,
 )
-from utils import _validate_date
+from utils import _validate_date, isnumeric
 
 logger = logging.getLogger(__name__)
 
@@ -71,33 +73,76 @@ class EntryApp(QtWidgets.QMainWindow):
                 created by _gaitbase.py.
         """
         super().__init__()
-        # load user interface made with Qt Designer
-        uifile = resource_filename('gaitbase', 'rom_entryapp.ui')
-        uic.loadUi(uifile, self)
+        # load user interface made with Qt Designer; the contents of the tab
+        # pages are created only when the pages are first shown
+        self._page_uis = load_paged_ui('rom_entryapp.ui', self)
         self.confirm_close = True  # used to implement force close
-        self.input_widgets = dict()
+        # names of the data input widgets
+        self.input_widgets = set()
+        # value accessors for the input widgets, keyed by widget name
+        self.accessors = dict()
+        # patient info shown in the read-only widgets
+        self._patient_info = dict()
+        # Write-behind buffer of changed variables. Changes are coalesced here
+        # and written into the database as a single UPDATE when the debounce
+        # timer fires, on tab change and when the window is closed.
+        self._pending_updates = dict()
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(cfg.database.write_delay)
+        self._flush_timer.timeout.connect(self.flush_updates)
+        # The variable catalog provides the default values. The widgets of the
+        # tab pages are created, wired and populated only when the pages are
+        # first shown; until then, their variables are served from the internal
+        # data dict.
+        self.catalog = load_catalog()
+        self.data_default = {var: info.default for var, info in self.catalog.items()}
+        self.data = self.data_default.copy()  # our internal copy of widget input data
         self._init_widgets()
-        self.data = dict()  # our internal copy of widget input data
-        self.read_data_from_widgets()
-        # read the widgets at their default state to determine default values
-        self.data_default = self.data.copy()
         # whether to update internal dict of variables on input changes
         self.do_update_data = True
-        self.rom_id = rom_id
-        self.newly_created = newly_created
         self.database = database
+        self._writer = None
         if database is not None:
+            # database writes are done in a background thread
+            self._writer = shared_writer(database.databaseName())
+        # whether the writer signals are connected; only while bound to a ROM
+        self._writer_connected = False
+        # widgets that are not on any tab page, and the current page
+        self._init_page(None)
+        self._initial_page = self.maintab.currentWidget()
+        self._init_page(self._initial_page.objectName())
+        self.bind(rom_id, newly_created)
+
+    def bind(self, rom_id, newly_created=False):
+        """Bind the editor to a ROM and read its data.
+
+        This is done on creation, and whenever a closed editor is reused for
+        another ROM (see editor_pool.py). Any pending changes must have been
+        flushed before rebinding.
+        """
+        self.confirm_close = True
+        self.rom_id = rom_id
+        self._connect_writer(rom_id is not None)
+        self.newly_created = newly_created
+        self.data = self.data_default.copy()
+        self._patient_info = dict()
+        # rom_id is None for editors created in advance (see editor_pool.py)
+        if self.database is not None and rom_id is not None:
             # the read only fields contain patient info from the patients table;
             # they are read only once at startup, and never writteh by this module
             self.init_patient_widgets()
             if newly_created:
                 # automatically set the date field to current date
                 datestr = datetime.datetime.now().strftime('%d.%m.%Y')
-                self.dataTiedotPvm.setText(datestr)
-                self.values_changed(self.dataTiedotPvm)
+                self.data['TiedotPvm'] = datestr
+                self.queue_update('TiedotPvm', datestr)
             else:
                 self.read_data()
-                self.update_widgets()
+        self.update_widgets()
+        # start from the same page as a newly created editor
+        self.maintab.setCurrentWidget(self._initial_page)
+        self.statusbar.showMessage(Finnish.ready.format(n=self.total_widgets))
 
     def force_close(self):
         """Force close without confirmation"""
@@ -133,24 +178,74 @@ class EntryApp(QtWidgets.QMainWindow):
         varlist = ','.join(thevars)
         query.prepare(f'SELECT {varlist} FROM roms WHERE rom_id = :rom_id')
         query.bindValue(':rom_id', self.rom_id)
-        if not query.exec() or not query.first():
+        if not exec_query(query) or not query.first():
             self.db_failure(query, fatal=True)
         results = tuple(query.value(k) for k in range(len(thevars)))
         return results
 
-    def update_rom(self, thevars, values):
-        """Update ROM row with a list of fields and corresponding values"""
-        if not len(thevars) == len(values):
-            raise ValueError('Arguments need to be of equal length')
-        query = QSqlQuery(self.database)
-        varlist = ','.join(f'{var} = :{var}' for var in thevars)
-        query.prepare(f'UPDATE roms SET {varlist} WHERE rom_id = :rom_id')
-        query.bindValue(':rom_id', self.rom_id)
-        for var, val in zip(thevars, values):
-            query.bindValue(f':{var}', val)
-        if not query.exec():
-            # it's possible that locking failures may occur here, so make them non-fatal
-            self.db_failure(query, fatal=False)
+    def queue_update(self, varname, value):
+        """Queue a variable for writing into the database.
+
+        Repeated changes to the same variable are coalesced, and the debounce
+        timer is restarted, so that a burst of changes (e.g. spinbox ticks)
+        results in a single database write.
+        """
+        self._pending_updates[varname] = value
+        self._flush_timer.start()
+
+    def flush_updates(self):
+        """Pass all pending changes to the database writer as one batch"""
+        self._flush_timer.stop()
+        if not self._pending_updates or self._writer is None:
+            return
+        self._writer.submit(self.rom_id, self._pending_updates)
+        self._pending_updates.clear()
+
+    def wait_for_writes(self, timeout=None):
+        """Wait until the changes passed to the writer are in the database.
+
+        Returns True if all writes completed within the timeout.
+        """
+        if self._writer is None:
+            return True
+        return self._writer.wait_written(self.rom_id, timeout or cfg.database.close_timeout)
+
+    def _connect_writer(self, connect):
+        """Connect or disconnect the writer signals.
+
+        A closed editor may stay in the pool for a long time, so it should not
+        receive the results of the writes made by other editors.
+        """
+        if self._writer is None or connect == self._writer_connected:
+            return
+        signals_slots = [
+            (self._writer.write_done, self._write_done),
+            (self._writer.write_retrying, self._write_retrying),
+            (self._writer.write_error, self._write_error),
+        ]
+        for signal, slot in signals_slots:
+            if connect:
+                signal.connect(slot)
+            else:
+                signal.disconnect(slot)
+        self._writer_connected = connect
+
+    def _write_done(self, rom_id):
+        """Callback for a successful database write"""
+        if rom_id == self.rom_id:
+            self.statusbar.showMessage(Finnish.ready.format(n=self.total_widgets))
+
+    def _write_retrying(self, rom_id, err, attempt):
+        """Callback for a database write that failed due to locking"""
+        if rom_id == self.rom_id:
+            self.statusbar.showMessage(Finnish.db_locked.format(n=attempt))
+
+    def _write_error(self, rom_id, err):
+        """Callback for a database write that could not be carried out"""
+        if rom_id == self.rom_id:
+            msg = f'Got a database error: "{err}"\n'
+            msg += 'The latest changes could not be saved.'
+            qt_message_dialog(msg)
 
     @property
     def patient_data(self):
@@ -161,16 +256,22 @@ class EntryApp(QtWidgets.QMainWindow):
         query = QSqlQuery(self.database)
         query.prepare(f'SELECT {varlist} FROM patients WHERE patient_id = :patient_id')
         query.bindValue(':patient_id', patient_id)
-        if not query.exec() or not query.first():
+        if not exec_query(query) or not query.first():
             self.db_failure(query, fatal=True)
         return {var: query.value(k) for k, var in enumerate(thevars)}
 
     def init_patient_widgets(self):
-        """Fill the read-only patient info widgets"""
-        for var, value in self.patient_data.items():
+        """Read the patient info and fill the read-only patient info widgets"""
+        self._patient_info = self.patient_data
+        self._show_patient_info()
+
+    def _show_patient_info(self):
+        """Fill the read-only patient info widgets, if they have been created"""
+        for var, value in self._patient_info.items():
             widget_name = 'rdonly_' + var  # corresponding UI widget name
-            self.__dict__[widget_name].setText(value)
-            self.__dict__[widget_name].setEnabled(False)
+            if (widget := self.__dict__.get(widget_name)) is not None:
+                widget.setText(value)
+                widget.setEnabled(False)
 
     def eventFilter(self, source, event):
         """Captures the FocusOut event for text widgets.
@@ -182,134 +283,117 @@ class EntryApp(QtWidgets.QMainWindow):
         return super().eventFilter(source, event)
 
     def _init_widgets(self):
-        """Initialize and collect the input widgets.
+        """Collect the input widget names and set up the autowidgets.
 
-        Also installs some convenience methods etc.
+        The widgets of the tab pages do not exist yet; they are created, wired
+        and populated per tab page by _init_page(). Until then, they are
+        handled by their names, which are read from the page .ui files.
         """
 
-        # collect all widgets (whether data input widgets or something else)
-        allwidgets = self.findChildren(QtWidgets.QWidget)
+        # names of all widgets (whether data input widgets or something else),
+        # grouped by the tab page that contains them (None for widgets outside
+        # the tabs)
+        self._page_widgets = {
+            page: widget_names for page, (_, widget_names) in self._page_uis.items()
+        }
+        self._page_widgets[None] = [
+            w.objectName() for w in self.findChildren(QtWidgets.QWidget) if w.objectName()
+        ]
+        self._page_of = {
+            wname: page
+            for page, widget_names in self._page_widgets.items()
+            for wname in widget_names
+        }
+        # pages that have been initialized
+        self._pages_ready = set()
+
         # data input widgets
         input_widget_prefix = Constants.input_widget_prefix
-        data_widgets = [
-            w
-            for w in allwidgets
-            if w.objectName()[: len(input_widget_prefix)] == input_widget_prefix
-        ]
+        self.input_widgets = {
+            wname
+            for wname in self._page_of
+            if wname[: len(input_widget_prefix)] == input_widget_prefix
+        }
+        self.total_widgets = len(self.input_widgets)
 
-        def _weight_normalize(widget):
+        # widget to varname translation dicts (both directions)
+        self.widget_to_var = dict()
+        self.var_to_widget = dict()
+        for wname in self.input_widgets:
+            varname = wname[len(input_widget_prefix) :]
+            self.widget_to_var[wname] = varname
+            self.var_to_widget[varname] = wname
+
+        def _input_values(wname):
+            """Return the values of the autowidget inputs from the data dict"""
+            return [self.data[self.widget_to_var[w]] for w in self.autowidgets[wname]]
+
+        def _weight_normalize(wname):
             """Auto calculate callback for weight normalized widgets"""
-            val, weight = (get_widget_value(w) for w in widget._autoinputs)
+            val, weight = _input_values(wname)
             noval = Constants.spinbox_novalue_text
             if val == noval or weight == noval:
-                set_widget_value(widget, noval)
+                return noval
             else:
-                set_widget_value(widget, val / weight)
+                return val / weight
 
-        def _SCALE_grade_to_pts(widget):
+        def _SCALE_grade_to_pts(wname):
             """Convert SCALE textual grade (Normaali/Alentunnut/Kykenemätön) to points"""
             grade_txt_2_pts = {'Ei mitattu': -1, 'Normaali (2)': 2, 'Alentunnut (1)': 1, 'Kykenemätön (0)': 0}
             tot = -1
-            for w in widget._autoinputs:
-                cur = grade_txt_2_pts[w.currentText()]
+            for grade in _input_values(wname):
+                cur = grade_txt_2_pts[grade]
                 if cur != -1:
                     if tot == -1:
                         tot = cur
                     else:
                         tot += cur
 
-            widget.setValue(tot)
+            return tot
 
         # Autowidgets are special widgets with automatically computed values.
         # Their values cannot be directly modified by the user.
-        # They must have an ._autocalculate() method which updates the widget,
-        # and ._autoinputs list which lists the necessary input widgets.
+        # self.autowidgets lists the names of the input widgets of each
+        # autowidget, and self._autocalculate has a function for each
+        # autowidget which returns the new widget value (computed from the data
+        # dict).
         #
                 
         # Autowidgets for for weight normalized data. Each autowidget has two
-        # inputs: the weight and the unnormalized value.
-        self.autowidgets = list()
-        weight_widget = self.dataAntropPaino
-        for widget in data_widgets:
-            wname = widget.objectName()
+        # inputs: the unnormalized value and the weight.
+        self.autowidgets = dict()
+        self._autocalculate = dict()
+        weight_wname = 'dataAntropPaino'
+        for wname in self._page_of:
             # handle the 'magic' autowidgets with weight normalized data
-            if wname[-4:] == 'Norm':
-                self.autowidgets.append(widget)
+            if wname in self.input_widgets and wname[-4:] == 'Norm':
                 # corresponding unnormalized widget
                 wname_unnorm = wname.replace('Norm', 'NormUn')
-                w_unnorm = self.__dict__[wname_unnorm]
-                widget._autoinputs = [w_unnorm, weight_widget]
-                widget._autocalculate = lambda w=widget: _weight_normalize(w)
+                if wname_unnorm not in self.input_widgets:
+                    raise RuntimeError(f'No unnormalized input widget for {wname}')
+                self.autowidgets[wname] = [wname_unnorm, weight_wname]
+                self._autocalculate[wname] = lambda w=wname: _weight_normalize(w)
 
         # Autowidgets for SCALE points - totals
         # Right
-        widget = self.findChildren(QtWidgets.QWidget, 'SCALEWholeLimbTotOikPts')[0]
-        self.autowidgets.append(widget)
-        widget._autoinputs = [self.findChildren(QtWidgets.QWidget, objName)[0] for objName in ['dataSCALELonkkaTotOik',
-                                                                                               'dataSCALEPolviTotOik',
-                                                                                               'dataSCALENilkkaTotOik',
-                                                                                               'dataSCALESTJTotOik',
-                                                                                               'dataSCALEVarpaatTotOik']]
-        widget._autocalculate = lambda w=widget: _SCALE_grade_to_pts(w)
+        wname = 'SCALEWholeLimbTotOikPts'
+        self.autowidgets[wname] = ['dataSCALELonkkaTotOik',
+                                   'dataSCALEPolviTotOik',
+                                   'dataSCALENilkkaTotOik',
+                                   'dataSCALESTJTotOik',
+                                   'dataSCALEVarpaatTotOik']
+        self._autocalculate[wname] = lambda w=wname: _SCALE_grade_to_pts(w)
         
         # Left
-        widget = self.findChildren(QtWidgets.QWidget, 'SCALEWholeLimbTotVasPts')[0]
-        self.autowidgets.append(widget)
-        widget._autoinputs = [self.findChildren(QtWidgets.QWidget, objName)[0] for objName in ['dataSCALELonkkaTotVas',
-                                                                                               'dataSCALEPolviTotVas',
-                                                                                               'dataSCALENilkkaTotVas',
-                                                                                               'dataSCALESTJTotVas',
-                                                                                               'dataSCALEVarpaatTotVas']]
-        widget._autocalculate = lambda w=widget: _SCALE_grade_to_pts(w)
-
-        # autowidget values cannot be directly modified
-        for widget in self.autowidgets:
-
-            # Change the text color in the disabled widgets to black
-            palette = widget.palette()
-            palette.setColor(QPalette.Disabled, QPalette.Text, QColor('black'))
-            widget.setPalette(palette)
-
-            widget.setEnabled(False)
+        wname = 'SCALEWholeLimbTotVasPts'
+        self.autowidgets[wname] = ['dataSCALELonkkaTotVas',
+                                   'dataSCALEPolviTotVas',
+                                   'dataSCALENilkkaTotVas',
+                                   'dataSCALESTJTotVas',
+                                   'dataSCALEVarpaatTotVas']
+        self._autocalculate[wname] = lambda w=wname: _SCALE_grade_to_pts(w)
 
-        # set various widget convenience methods/properties, collect input
-        # widgets into a dict
-        # NOTE: this loop will implicitly cause destruction of certain widgets
-        # (e.g. QLineEdits) by replacing them with new ones. Do not try to reuse
-        # the 'allwidgets' variable after this loop, it will cause a crash.
-        for widget in data_widgets:
-            wname = widget.objectName()
-            widget_class = widget.__class__.__name__
-            if widget_class in ('QSpinBox', 'QDoubleSpinBox'):
-                # -lambdas need default arguments because of late binding
-                # -lambda expression needs to consume unused 'new value' arg
-                widget.valueChanged.connect(
-                    lambda new_value, w=widget: self.values_changed(w)
-                )
-                widget.setLineEdit(MyLineEdit())
-                widget.keyPressEvent = lambda event, w=widget: keyPressEvent_resetOnEsc(
-                    w, event
-                )
-            elif widget_class in ('QLineEdit', 'QTextEdit'):
-                # for text editors, do not perform data updates on every value change, like so:
-                # w.textChanged.connect(lambda new_value, w=w: self.values_changed(w))
-                # since it will make the editor slow
-                # instead, update the values when focus is lost (editing completed)
-                widget.installEventFilter(self)
-            elif widget_class == 'QComboBox':
-                widget.currentIndexChanged.connect(
-                    lambda new_value, w=widget: self.values_changed(w)
-                )
-            elif widget_class == 'QCheckBox':
-                widget.stateChanged.connect(
-                    lambda new_value, w=widget: self.values_changed(w)
-                )
-            elif widget_class == 'CheckableSpinBox':
-                widget.valueChanged.connect(lambda w=widget: self.values_changed(w))
-                widget.degSpinBox.setLineEdit(DegLineEdit())
-            else:
-                raise RuntimeError(f'Invalid type of data input widget: {widget_class}')
-            self.input_widgets[wname] = widget
+        self._autodependents = self._compile_autowidget_deps()
 
         # slot called on tab change
         self.maintab.currentChanged.connect(self.page_change)
@@ -318,22 +402,19 @@ class EntryApp(QtWidgets.QMainWindow):
         # focus/selectall on the 1st widget on page change, so that data can be
         # entered immediately.
         self.firstwidget = dict()
-        self.firstwidget[self.tabTiedot] = self.rdonly_firstname
-        self.firstwidget[self.tabKysely] = self.dataKyselyPaivittainenMatka
-        self.firstwidget[self.tabAntrop] = self.dataAntropAlaraajaOik
-        self.firstwidget[self.tabLonkka] = self.dataLonkkaFleksioOik
-        self.firstwidget[self.tabNilkka] = self.dataNilkkaSoleusCatchOik
-        self.firstwidget[self.tabPolvi] = self.dataPolviEkstensioVapOik
-        self.firstwidget[self.tabIsokin] = self.dataIsokinPolviEkstensioOik
-        self.firstwidget[self.tabVirheas] = self.dataVirheasAnteversioOik
-        self.firstwidget[self.tabTasap] = self.dataTasapOik
-        self.total_widgets = len(self.input_widgets)
-
-        # widget to varname translation dict
-        self.widget_to_var = dict()
-        for wname in self.input_widgets:
-            varname = wname[len(input_widget_prefix) :]
-            self.widget_to_var[wname] = varname
+        self.firstwidget['tabTiedot'] = 'rdonly_firstname'
+        self.firstwidget['tabKysely'] = 'dataKyselyPaivittainenMatka'
+        self.firstwidget['tabAntrop'] = 'dataAntropAlaraajaOik'
+        self.firstwidget['tabLonkka'] = 'dataLonkkaFleksioOik'
+        self.firstwidget['tabNilkka'] = 'dataNilkkaSoleusCatchOik'
+        self.firstwidget['tabPolvi'] = 'dataPolviEkstensioVapOik'
+        self.firstwidget['tabIsokin'] = 'dataIsokinPolviEkstensioOik'
+        self.firstwidget['tabVirheas'] = 'dataVirheasAnteversioOik'
+        self.firstwidget['tabTasap'] = 'dataTasapOik'
+
+        # units of the variables; these depend on the variable values, and are
+        # updated whenever a value changes between numeric and non-numeric
+        self.var_units = dict()
 
         self.statusbar.showMessage(Finnish.ready.format(n=self.total_widgets))
 
@@ -342,22 +423,169 @@ class EntryApp(QtWidgets.QMainWindow):
 
         # FIXME: make sure we always start on 1st tab
 
+    def _wire_widget(self, widget):
+        """Connect the signals etc. of a data input widget"""
+        widget_class = widget.__class__.__name__
+        if widget_class in ('QSpinBox', 'QDoubleSpinBox'):
+            # -lambdas need default arguments because of late binding
+            # -lambda expression needs to consume unused 'new value' arg
+            widget.valueChanged.connect(
+                lambda new_value, w=widget: self.values_changed(w)
+            )
+            widget.setLineEdit(MyLineEdit())
+            widget.keyPressEvent = lambda event, w=widget: keyPressEvent_resetOnEsc(
+                w, event
+            )
+        elif widget_class in ('QLineEdit', 'QTextEdit'):
+            # for text editors, do not perform data updates on every value change, like so:
+            # w.textChanged.connect(lambda new_value, w=w: self.values_changed(w))
+            # since it will make the editor slow
+            # instead, update the values when focus is lost (editing completed)
+            widget.installEventFilter(self)
+        elif widget_class == 'QComboBox':
+            widget.currentIndexChanged.connect(
+                lambda new_value, w=widget: self.values_changed(w)
+            )
+        elif widget_class == 'QCheckBox':
+            widget.stateChanged.connect(
+                lambda new_value, w=widget: self.values_changed(w)
+            )
+        elif widget_class == 'CheckableSpinBox':
+            widget.valueChanged.connect(lambda w=widget: self.values_changed(w))
+            widget.degSpinBox.setLineEdit(DegLineEdit())
+        else:
+            raise RuntimeError(f'Invalid type of data input widget: {widget_class}')
+
+    def _init_page(self, page):
+        """Create, wire and populate the widgets of a tab page, if not done yet.
+
+        page is the name of the tab page, or None for the widgets outside the
+        tab pages (these are created with the window).
+        """
+        if page in self._pages_ready or page not in self._page_widgets:
+            return
+        self._pages_ready.add(page)
+        if page is not None:
+            pagefile, _ = self._page_uis[page]
+            load_ui_page(pagefile, self.__dict__[page], self)
+        wnames = self._page_widgets[page]
+        # NOTE: wiring will implicitly cause destruction of certain widgets
+        # (e.g. QLineEdits) by replacing them with new ones. Do not try to reuse
+        # widgets collected by findChildren() before this, it will cause a crash.
+        for wname in wnames:
+            if wname in self.input_widgets:
+                widget = self.__dict__[wname]
+                self._wire_widget(widget)
+                self.accessors[wname] = make_accessor(widget)
+        # autowidget values cannot be directly modified
+        for wname in wnames:
+            if wname in self.autowidgets:
+                widget = self.__dict__[wname]
+                # Change the text color in the disabled widgets to black
+                palette = widget.palette()
+                palette.setColor(QPalette.Disabled, QPalette.Text, QColor('black'))
+                widget.setPalette(palette)
+                widget.setEnabled(False)
+        # populate the widgets without triggering data updates
+        do_update_data, self.do_update_data = self.do_update_data, False
+        for wname in wnames:
+            if wname in self.input_widgets:
+                self.accessors[wname].set(self.data[self.widget_to_var[wname]])
+        # autowidgets that are not data widgets (e.g. SCALE totals) are only
+        # shown, so they need to be calculated
+        for wname in wnames:
+            if wname in self.autowidgets and wname not in self.input_widgets:
+                self._update_autowidget(wname)
+        self.do_update_data = do_update_data
+        self._show_patient_info()
+
+    def _update_autowidget(self, wname):
+        """Recalculate an autowidget from the data dict.
+
+        Returns the variable name of the autowidget if its value was changed,
+        or None.
+        """
+        value = self._autocalculate[wname]()
+        # set the widget if its page has been initialized; signals are blocked,
+        # so that it does not trigger updates of its own
+        if self._page_of[wname] in self._pages_ready:
+            autowidget = self.__dict__[wname]
+            accessor = self.accessors.get(wname) or make_accessor(autowidget)
+            blocked = autowidget.blockSignals(True)
+            accessor.set(value)
+            autowidget.blockSignals(blocked)
+            value = accessor.get()
+        # some autowidgets are not data widgets (e.g. SCALE totals)
+        if (varname := self.widget_to_var.get(wname)) is None:
+            return None
+        value = self.catalog[varname].coerce(value)
+        if value == self.data[varname]:
+            return None
+        self.data[varname] = value
+        return varname
+
+    def _compile_autowidget_deps(self):
+        """Compile the autowidget dependencies into a reverse dependency map.
+
+        Returns a dict of {input widget name: autowidget names}, where the
+        autowidgets include also the indirect dependents (autowidgets that
+        depend on other autowidgets). They are in topological order, i.e. each
+        autowidget comes after the autowidgets that it depends on.
+        """
+        graph = {
+            autowidget: [w for w in autoinputs if w in self.autowidgets]
+            for autowidget, autoinputs in self.autowidgets.items()
+        }
+        try:
+            order = list(graphlib.TopologicalSorter(graph).static_order())
+        except graphlib.CycleError as e:
+            raise RuntimeError(f'Circular autowidget dependencies: {e.args[1]}')
+        # the direct dependents of each widget
+        dependents = dict()
+        for autowidget, autoinputs in self.autowidgets.items():
+            for w in autoinputs:
+                dependents.setdefault(w, set()).add(autowidget)
+        autodependents = dict()
+        for widget in dependents:
+            # collect the indirect dependents too
+            found = set()
+            stack = [widget]
+            while stack:
+                for autowidget in dependents.get(stack.pop(), ()):
+                    if autowidget not in found:
+                        found.add(autowidget)
+                        stack.append(autowidget)
+            autodependents[widget] = [w for w in order if w in found]
+        return autodependents
+
     def get_var_units(self, varname):
         """Get units for a variable.
 
         The units may change dynamically depending on widget states.
         """
-        # get widget name corresponding to variable; this is a bit clumsy
-        widget_name = [
-            wname
-            for wname, varname_ in self.widget_to_var.items()
-            if varname_ == varname
-        ][0]
-        widget = self.input_widgets[widget_name]
-        return get_widget_units(widget)
+        return self.var_units[varname]
+
+    def _refresh_units(self, varnames=None):
+        """Update the units of given variables (default all)"""
+        if varnames is None:
+            varnames = self.data
+        for varname in varnames:
+            self.var_units[varname] = self.catalog[varname].get_units(self.data[varname])
 
     def do_close(self, event):
         """The actual closing ritual"""
+        # write out any pending changes before closing
+        self.flush_updates()
+        if not self.wait_for_writes():
+            msg = 'Could not save all changes, since the database is locked. '
+            msg += 'Close all other applications that may be using the database.'
+            if self.confirm_close:
+                # the writer keeps retrying; the user may try closing again
+                qt_message_dialog(msg + ' Then try closing the window again.')
+                event.ignore()
+                return
+            # on forced close, the writer keeps retrying in the background
+            logger.warning(msg)
         # XXX: we may want to undo the database entry, if no values were entered?
         # XXX: if ROM was newly created, we also create JSON for backup purposes
         # this is for the "beta phase"  only
@@ -369,6 +597,7 @@ class EntryApp(QtWidgets.QMainWindow):
                 self.dump_json(fname)
             except IOError:  # ignore errors for now
                 pass
+        self._connect_writer(False)
         self.closing.emit(self.rom_id)
         event.accept()
 
@@ -400,18 +629,27 @@ class EntryApp(QtWidgets.QMainWindow):
 
         This does several things, most importantly updates the database.
         """
-        # find autowidgets that depend on the argument widget and update them
-        autowidgets_this = [w for w in self.autowidgets if widget in w._autoinputs]
-        for autowidget in autowidgets_this:
-            autowidget._autocalculate()
-        if self.do_update_data:
-            # update internal data dict
-            wname = widget.objectName()
-            varname = self.widget_to_var[wname]
-            newval = get_widget_value(widget)
-            self.data[varname] = newval
-            # perform the corresponding SQL update
-            self.update_rom([varname], [newval])
+        if not self.do_update_data:
+            return
+        # update internal data dict
+        wname = widget.objectName()
+        varname = self.widget_to_var[wname]
+        oldval = self.data[varname]
+        newval = self.data[varname] = self.accessors[wname].get()
+        changed = [varname]
+        # Update the autowidgets that depend on the argument widget, in
+        # dependency order. They are calculated from the data dict, so this
+        # works also for autowidgets on pages that have not been shown yet. All
+        # the changed values are queued below as one batch.
+        for autowidget in self._autodependents.get(wname, []):
+            if (auto_varname := self._update_autowidget(autowidget)) is not None:
+                changed.append(auto_varname)
+        if isnumeric(newval) != isnumeric(oldval):
+            self._refresh_units([varname])
+        self._refresh_units(changed[1:])
+        # queue the corresponding SQL updates
+        for varname in changed:
+            self.queue_update(varname, self.data[varname])
 
     def read_data(self):
         """Update the internal data dict from the database"""
@@ -449,10 +687,10 @@ class EntryApp(QtWidgets.QMainWindow):
     def make_text_report(self, template, include_units=True):
         """Create text report from current data"""
         if include_units:
-            data = dict()
-            for varname, value in self.data.items():
-                units = self.get_var_units(varname)
-                data[varname] = f'{value}{units}'
+            data = {
+                varname: f'{value}{self.var_units[varname]}'
+                for varname, value in self.data.items()
+            }
         else:
             data = self.data.copy()  # don't mutate the original
         # patient ID data is needed for the report, but it's not part of the ROM
@@ -471,30 +709,41 @@ class EntryApp(QtWidgets.QMainWindow):
 
     def page_change(self):
         """Callback for tab change"""
-        newpage = self.maintab.currentWidget()
+        self.flush_updates()
+        newpage = self.maintab.currentWidget().objectName()
+        self._init_page(newpage)
         # focus / selectAll on 1st widget of new tab
         if newpage in self.firstwidget:
-            widget = self.firstwidget[newpage]
+            widget = self.__dict__[self.firstwidget[newpage]]
             if widget.isEnabled():
                 widget.selectAll()
                 widget.setFocus()
 
     def update_widgets(self):
-        """Restore widget input values from the internal data dictionary"""
+        """Restore widget input values from the internal data dictionary.
+
+        Only the initialized pages are updated; the rest are created and
+        populated from the data dictionary when they are first shown.
+        """
         # need to disable widget callbacks and automatic data saving while
         # programmatic updating of widgets is taking place
         self.do_update_data = False
-        for wname, widget in self.input_widgets.items():
-            varname = self.widget_to_var[wname]
-            set_widget_value(widget, self.data[varname])
+        for wname, accessor in self.accessors.items():
+            accessor.set(self.data[self.widget_to_var[wname]])
+        # autowidgets that are not data widgets are only shown
+        for autowidget in self.autowidgets:
+            if autowidget not in self.input_widgets:
+                if self._page_of[autowidget] in self._pages_ready:
+                    self._update_autowidget(autowidget)
+        self._refresh_units()
         self.do_update_data = True
 
     def read_data_from_widgets(self):
         """Read the internal data dictionary from widget inputs.
 
         Usually not needed, since the dictionary is updated automatically
-        whenever widget inputs change.
+        whenever widget inputs change. Only the initialized pages are read.
         """
-        for wname, widget in self.input_widgets.items():
-            varname = self.widget_to_var[wname]
-            self.data[varname] = get_widget_value(widget)
+        for wname, accessor in self.accessors.items():
+            self.data[self.widget_to_var[wname]] = accessor.get()
+        self._refresh_units()
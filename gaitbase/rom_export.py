@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Export ROM data of many measurements into a single table, for research use.
+
+The ROMs are read from the database joined to the patients, in chunks of rows,
+and written into a CSV, Parquet or NumPy (.npz) file. Only one chunk is held in
+memory at a time, so the whole database can be exported. Example:
+
+python rom_export.py roms.parquet --patient-code D0012_AB
+
+The variable catalog gives the type of each column. Numeric variables are
+exported as floats; values that are not numbers (e.g. 'Ei mitattu') become NaN.
+For CheckableSpinBox variables, an additional boolean column <varname>_normal
+tells whether the value was marked as 'within normal range'. Patient names and
+SSNs are only exported with --identifying.
+
+Parquet export requires pyarrow, and .npz export requires numpy.
+
+"""
+
+import argparse
+import collections
+import csv
+import math
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from config import cfg
+from dbconnect import connect
+from utils import isnumeric
+from varcatalog import load_catalog
+
+EXPORT_FORMATS = ('csv', 'parquet', 'npz')
+# patient fields that are always exported
+PATIENT_FIELDS = ['patient_code', 'diagnosis']
+# patient fields that identify the patient
+IDENTIFYING_FIELDS = ['firstname', 'lastname', 'ssn']
+# rows per chunk
+CHUNK_SIZE = 5000
+
+# An exported column. kind is one of 'int', 'float', 'text' or 'bool'. The
+# value is computed from the SQL column sql_column by convert, which takes the
+# list of values of a chunk.
+Column = collections.namedtuple('Column', ['name', 'kind', 'sql_column', 'convert'])
+
+
+def _to_float(values):
+    """Convert numeric values into floats, and other values into NaN"""
+    return [float(v) if isnumeric(v) else math.nan for v in values]
+
+
+def _to_text(values):
+    return ['' if v is None else str(v) for v in values]
+
+
+def _unchanged(values):
+    return list(values)
+
+
+def export_columns(catalog, varnames=None, identifying=False):
+    """Return the list of Column for the export"""
+    patient_fields = PATIENT_FIELDS + (IDENTIFYING_FIELDS if identifying else [])
+    columns = [
+        Column('rom_id', 'int', 'roms.rom_id', _unchanged),
+        Column('patient_id', 'int', 'roms.patient_id', _unchanged),
+    ]
+    columns += [Column(f, 'text', f'patients.{f}', _to_text) for f in patient_fields]
+    for varname in varnames or catalog:
+        info = catalog[varname]
+        if info.affinity != 'NUMERIC':
+            columns.append(Column(varname, 'text', f'roms.{varname}', _to_text))
+            continue
+        columns.append(Column(varname, 'float', f'roms.{varname}', _to_float))
+        if info.default_text is not None:
+            columns.append(
+                Column(
+                    f'{varname}_normal',
+                    'bool',
+                    f'roms.{varname}',
+                    lambda values, text=info.default_text: [v == text for v in values],
+                )
+            )
+    return columns
+
+
+def _where_clause(patient_codes):
+    """Return the WHERE clause and its parameters for selecting the ROMs"""
+    if not patient_codes:
+        return '', []
+    placeholders = ','.join('?' * len(patient_codes))
+    return f' WHERE patients.patient_code IN ({placeholders})', list(patient_codes)
+
+
+def iter_chunks(conn, columns, patient_codes=None, chunk_size=CHUNK_SIZE):
+    """Read the ROMs in chunks.
+
+    Yields dicts of {column name: list of converted values}.
+    """
+    # a SQL column can be used by several exported columns
+    sql_columns = list(dict.fromkeys(col.sql_column for col in columns))
+    index = {sql_col: k for k, sql_col in enumerate(sql_columns)}
+    where, params = _where_clause(patient_codes)
+    cursor = conn.execute(
+        f'SELECT {",".join(sql_columns)} FROM roms JOIN patients USING (patient_id)'
+        f'{where} ORDER BY roms.rom_id',
+        params,
+    )
+    while rows := cursor.fetchmany(chunk_size):
+        values = list(zip(*rows))
+        yield {col.name: col.convert(values[index[col.sql_column]]) for col in columns}
+
+
+def count_roms(conn, patient_codes=None):
+    """Return the number of ROMs to export"""
+    where, params = _where_clause(patient_codes)
+    query = f'SELECT COUNT(*) FROM roms JOIN patients USING (patient_id){where}'
+    return conn.execute(query, params).fetchone()[0]
+
+
+def _max_text_lengths(conn, columns, patient_codes=None):
+    """Return the maximum lengths of the text columns"""
+    text_columns = [col for col in columns if col.kind == 'text']
+    if not text_columns:
+        return dict()
+    lengths = ','.join(f'MAX(LENGTH({col.sql_column}))' for col in text_columns)
+    where, params = _where_clause(patient_codes)
+    query = f'SELECT {lengths} FROM roms JOIN patients USING (patient_id){where}'
+    row = conn.execute(query, params).fetchone()
+    return {col.name: length or 0 for col, length in zip(text_columns, row)}
+
+
+class CsvWriter:
+    """Write the chunks into a CSV file; NaN is written as an empty field"""
+
+    def __init__(self, fname, columns):
+        self._file = open(fname, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([col.name for col in columns])
+        self._float_columns = [col.name for col in columns if col.kind == 'float']
+
+    def write(self, chunk):
+        for name in self._float_columns:
+            chunk[name] = ['' if math.isnan(v) else v for v in chunk[name]]
+        self._writer.writerows(zip(*chunk.values()))
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Write the chunks into a Parquet file, one row group per chunk"""
+
+    _ARROW_TYPES = {'int': 'int64', 'float': 'float64', 'text': 'string', 'bool': 'bool_'}
+
+    def __init__(self, fname, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema(
+            [(col.name, getattr(pa, self._ARROW_TYPES[col.kind])()) for col in columns]
+        )
+        self._writer = pq.ParquetWriter(fname, self._schema)
+
+    def write(self, chunk):
+        batch = self._pa.RecordBatch.from_pydict(chunk, schema=self._schema)
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+class NpzWriter:
+    """Write the chunks into a NumPy .npz file, with one array per column.
+
+    The arrays are filled in memory-mapped temporary files, which are finally
+    stored into the .npz archive. Text columns are fixed-width unicode arrays,
+    so the maximum lengths of the texts must be known in advance.
+    """
+
+    _DTYPES = {'int': 'int64', 'float': 'float64', 'bool': 'bool'}
+
+    def __init__(self, fname, columns, n_rows, text_lengths):
+        import numpy as np
+
+        self._fname = fname
+        self._tmpdir = tempfile.TemporaryDirectory(dir=Path(fname).parent)
+        self._arrays = dict()
+        for k, col in enumerate(columns):
+            dtype = self._DTYPES.get(col.kind) or f'U{max(text_lengths[col.name], 1)}'
+            # the file names do not depend on the column names
+            path = Path(self._tmpdir.name) / f'{k}.npy'
+            self._arrays[col.name] = (
+                path,
+                np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_rows,)),
+            )
+        self._row = 0
+
+    def write(self, chunk):
+        n = len(next(iter(chunk.values())))
+        for name, values in chunk.items():
+            self._arrays[name][1][self._row : self._row + n] = values
+        self._row += n
+
+    def close(self):
+        paths = dict()
+        for name, (path, array) in self._arrays.items():
+            array.flush()
+            paths[name] = path
+        # release the memory maps, so that the files can be removed
+        self._arrays.clear()
+        with zipfile.ZipFile(self._fname, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, path in paths.items():
+                zf.write(path, arcname=f'{name}.npy')
+        self._tmpdir.cleanup()
+
+
+def export_roms(
+    conn, fname, fmt, varnames=None, patient_codes=None, identifying=False, catalog=None
+):
+    """Export ROMs into a file; return the number of exported ROMs"""
+    catalog = catalog or load_catalog()
+    columns = export_columns(catalog, varnames, identifying)
+    # read in a single transaction, so that the row count and the text lengths
+    # match the rows even if the database is modified meanwhile
+    conn.execute('BEGIN')
+    if fmt == 'csv':
+        writer = CsvWriter(fname, columns)
+    elif fmt == 'parquet':
+        writer = ParquetWriter(fname, columns)
+    elif fmt == 'npz':
+        n_rows = count_roms(conn, patient_codes)
+        text_lengths = _max_text_lengths(conn, columns, patient_codes)
+        writer = NpzWriter(fname, columns, n_rows, text_lengths)
+    else:
+        conn.rollback()
+        raise ValueError(f'Unknown export format: {fmt}')
+    n_exported = 0
+    try:
+        for chunk in iter_chunks(conn, columns, patient_codes):
+            writer.write(chunk)
+            n_exported += len(chunk['rom_id'])
+    finally:
+        writer.close()
+        conn.rollback()
+    return n_exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export ROM data into a table')
+    parser.add_argument('fname', help='output file (.csv, .parquet or .npz)')
+    parser.add_argument(
+        '--database',
+        help='path to the database file (default: configured database)',
+        default=cfg.database.database,
+    )
+    parser.add_argument(
+        '--format',
+        help='output format (default: from the file extension)',
+        choices=EXPORT_FORMATS,
+    )
+    parser.add_argument(
+        '--patient-code',
+        help='export ROMs of given patients (can be repeated)',
+        action='append',
+        dest='patient_codes',
+    )
+    parser.add_argument(
+        '--var',
+        help='export given ROM variable (can be repeated; default: all)',
+        action='append',
+        dest='varnames',
+    )
+    parser.add_argument(
+        '--identifying',
+        help='also export patient names and SSNs',
+        action='store_true',
+    )
+    args = parser.parse_args()
+
+    fmt = args.format or Path(args.fname).suffix.lstrip('.').lower()
+    if fmt not in EXPORT_FORMATS:
+        parser.error(f'cannot determine the format of {args.fname}, use --format')
+    catalog = load_catalog()
+    if unknown := [var for var in args.varnames or [] if var not in catalog]:
+        parser.error(f'unknown variables: {", ".join(unknown)}')
+
+    t0 = time.perf_counter()
+    conn = connect(args.database)
+    try:
+        n_exported = export_roms(
+            conn,
+            args.fname,
+            fmt,
+            args.varnames,
+            args.patient_codes,
+            args.identifying,
+            catalog,
+        )
+    finally:
+        conn.close()
+    print(f'{n_exported} ROMs exported into {args.fname} in {time.perf_counter() - t0:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Headless access to ROM measurements.
+
+RomRecord holds the data of a single ROM measurement, loaded directly from the
+database using the variable catalog. No Qt widgets are needed, so reports can
+be created quickly and without a display.
+
+"""
+
+import rom_reporter
+from varcatalog import load_catalog
+
+# the fields of the patients table that are available for reports
+PATIENT_FIELDS = ['firstname', 'lastname', 'ssn', 'patient_code', 'diagnosis']
+
+
+class RomRecord:
+    """Data of a single ROM measurement and the corresponding patient"""
+
+    def __init__(self, rom_id, data, patient_data, catalog):
+        self.rom_id = rom_id
+        self.data = data
+        self.patient_data = patient_data
+        self.catalog = catalog
+        self.data_default = {var: info.default for var, info in catalog.items()}
+
+    @classmethod
+    def load(cls, conn, rom_id, catalog=None):
+        """Load a ROM measurement from a sqlite3 connection.
+
+        NULL values (variables never written into the database) are replaced by
+        the variable defaults, like in the ROM editor.
+        """
+        catalog = catalog or load_catalog()
+        thevars = list(catalog)
+        varlist = ','.join(['patient_id'] + thevars)
+        rows = conn.execute(
+            f'SELECT {varlist} FROM roms WHERE rom_id = ?', [rom_id]
+        ).fetchall()
+        if not rows:
+            raise KeyError(f'No ROM with id {rom_id}')
+        patient_id, *values = rows[0]
+        data = {
+            var: catalog[var].default if val is None else val
+            for var, val in zip(thevars, values)
+        }
+        varlist = ','.join(PATIENT_FIELDS)
+        rows = conn.execute(
+            f'SELECT {varlist} FROM patients WHERE patient_id = ?', [patient_id]
+        ).fetchall()
+        patient_data = dict(zip(PATIENT_FIELDS, rows[0]))
+        return cls(rom_id, data, patient_data, catalog)
+
+    @property
+    def vars_at_default(self):
+        """Return varnames that are at their default values"""
+        return [var for var in self.data if self.data[var] == self.data_default[var]]
+
+    def get_var_units(self, varname):
+        """Get units for a variable"""
+        return self.catalog[varname].get_units(self.data[varname])
+
+    def make_text_report(self, template, include_units=True):
+        """Create text report from current data"""
+        if include_units:
+            data = {
+                varname: f'{value}{self.get_var_units(varname)}'
+                for varname, value in self.data.items()
+            }
+        else:
+            data = self.data.copy()  # don't mutate the original
+        report_data = data | self.patient_data
+        return rom_reporter.make_text_report(template, report_data, self.vars_at_default)
+
+    def make_excel_report(self, xls_template):
+        """Create Excel report from current data"""
+        report_data = self.data | self.patient_data
+        return rom_reporter.make_excel_report(
+            xls_template, report_data, self.vars_at_default
+        )
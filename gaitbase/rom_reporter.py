@@ -4,12 +4,34 @@ Create reports for gaitbase.
 
 @author: Jussi (jnu@iki.fi)
 """
+import os
 import string
-from xlrd import open_workbook
-from xlutils.copy import copy
+from functools import lru_cache
 
 from config import cfg
 
+# compiled text templates, keyed by path; values are (mtime, code object)
+_template_cache = dict()
+# parsed Excel templates, keyed by path; values are (mtime, workbook, cells)
+_xls_template_cache = dict()
+
+
+def _compile_template(template):
+    """Return the compiled code of a Python template.
+
+    The compiled code is cached. The cache entry is invalidated when the
+    modification time of the file changes, so edits to the template are still
+    visible immediately.
+    """
+    key = os.path.abspath(template)
+    mtime = os.stat(key).st_mtime_ns
+    if (cached := _template_cache.get(key)) is not None and cached[0] == mtime:
+        return cached[1]
+    with open(template, 'rb') as f:
+        template_code = compile(f.read(), template, 'exec')
+    _template_cache[key] = (mtime, template_code)
+    return template_code
+
 
 def make_text_report(template, data, fields_at_default):
     """Create a text report using a Python template.
@@ -35,8 +57,8 @@ def make_text_report(template, data, fields_at_default):
     for field, value in data.items():
         if value in cfg.report.replace_data:
             data[field] = cfg.report.replace_data[value]
-    # compile the template code
-    template_code = compile(open(template, "rb").read(), template, 'exec')
+    # get the compiled template code
+    template_code = _compile_template(template)
     # namespace of executed code
     exec_namespace = dict()
     # inject the data variables into the global namespace used by exec()
@@ -89,13 +111,19 @@ def _conditional_format(thestr, data, fields_at_default):
         return ''
 
 
+@lru_cache(maxsize=8192)
 def _get_format_fields(thestr):
-    """Return a list of fields, given a format string.
+    """Return a tuple of fields, given a format string.
 
-    For '{foo} is {bar}' would return ['foo', 'bar']
+    For '{foo} is {bar}' would return ('foo', 'bar'). The results are cached,
+    since the same template strings are parsed for every report. (The block
+    tree itself cannot be cached, since the template code may build it
+    differently depending on the data.)
     """
     formatter = string.Formatter()
-    return [fieldname for (_, fieldname, _, _) in formatter.parse(thestr) if fieldname]
+    return tuple(
+        fieldname for (_, fieldname, _, _) in formatter.parse(thestr) if fieldname
+    )
 
 
 def make_excel_report(xls_template, data, fields_at_default):
@@ -122,33 +150,53 @@ def make_excel_report(xls_template, data, fields_at_default):
     workbook
         xlrd workbook.
     """
-    workbook_in = open_workbook(xls_template, formatting_info=True)
+    from xlutils.copy import copy
+
+    workbook_in, format_cells = _load_xls_template(xls_template)
     workbook_out = copy(workbook_in)
-    r_sheet = workbook_in.sheet_by_index(0)
     w_sheet = workbook_out.get_sheet(0)
     # replace some values to improve readability
     for field, value in data.items():
         if value in cfg.report.replace_data:
             data[field] = cfg.report.replace_data[value]
-    # loop through cells, conditionally replace fields with variable names
+    # conditionally replace fields with variable names; other cells are
+    # already correct in the copied workbook
+    for row, col, cell_text in format_cells:
+        # if all variables are at default, the result will be an empty cell
+        cell_text_formatted = _conditional_format(cell_text, data, fields_at_default)
+        # apply replacement text only if formatting changed something
+        # (to avoid undesired changes to text-only cells)
+        if cell_text_formatted != cell_text:
+            for oldstr, newstr in cfg.report.xls_replace_strings.items():
+                cell_text_formatted = cell_text_formatted.replace(oldstr, newstr)
+        _xlrd_set_cell(w_sheet, col, row, cell_text_formatted)
+    return workbook_out
+
+
+def _load_xls_template(xls_template):
+    """Read an Excel template.
+
+    Returns a tuple of (workbook, cells), where cells is a list of (row, col,
+    text) for the cells in the first sheet that need formatting. The result is
+    cached and invalidated when the modification time of the file changes.
+    """
+    key = os.path.abspath(xls_template)
+    mtime = os.stat(key).st_mtime_ns
+    if (cached := _xls_template_cache.get(key)) is not None and cached[0] == mtime:
+        return cached[1:]
+    from xlrd import open_workbook
+
+    workbook_in = open_workbook(xls_template, formatting_info=True)
+    r_sheet = workbook_in.sheet_by_index(0)
+    format_cells = list()
     for row in range(r_sheet.nrows):
         for col in range(r_sheet.ncols):
-            cell = r_sheet.cell(row, col)
-            cell_text = cell.value
-            if cell_text:  # format non-empty cells only
-                # if all variables are at default, the result will be an empty cell
-                cell_text_formatted = _conditional_format(
-                    cell_text, data, fields_at_default
-                )
-                # apply replacement text only if formatting changed something
-                # (to avoid undesired changes to text-only cells)
-                if cell_text_formatted != cell_text:
-                    for oldstr, newstr in cfg.report.xls_replace_strings.items():
-                        cell_text_formatted = cell_text_formatted.replace(
-                            oldstr, newstr
-                        )
-                _xlrd_set_cell(w_sheet, col, row, cell_text_formatted)
-    return workbook_out
+            cell_text = r_sheet.cell(row, col).value
+            # cells without braces are not changed by formatting
+            if isinstance(cell_text, str) and ('{' in cell_text or '}' in cell_text):
+                format_cells.append((row, col, cell_text))
+    _xls_template_cache[key] = (mtime, workbook_in, format_cells)
+    return workbook_in, format_cells
 
 
 def _xlrd_get_cell(out_sheet, col_ind, row_ind):
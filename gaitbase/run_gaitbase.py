@@ -2,8 +2,39 @@
 """
 Gait database utils.
 
+With --profile-startup, the durations of the startup phases are reported and
+the program exits once the main window has been shown.
+
 """
-from gaitbase import _gaitbase
+import argparse
+
+import startup_profile
 
 if __name__ == '__main__':
-    _gaitbase.main()
+    parser = argparse.ArgumentParser(description='Gait database')
+    parser.add_argument(
+        '--profile-startup',
+        nargs='?',
+        const='-',
+        metavar='JSON_FILE',
+        help='report the startup timings and exit; optionally write them into a file',
+    )
+    parser.add_argument('--database', help='use this database instead of the configured one')
+    args = parser.parse_args()
+    if args.profile_startup:
+        startup_profile.start()
+
+    from config import cfg
+
+    startup_profile.mark('import config')
+    if args.database:
+        cfg.database.database = args.database
+
+    from PyQt5 import QtCore, QtSql, QtWidgets  # noqa: F401
+
+    startup_profile.mark('import PyQt5')
+
+    from gaitbase import _gaitbase
+
+    startup_profile.mark('import gaitbase modules')
+    _gaitbase.main(profile_startup=args.profile_startup)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Schema objects for the gait database, in addition to the tables.
+
+The declared indexes (INDEXES) speed up the queries that the application runs
+most often (HOT_QUERIES). They are created by recreate_db.py and verified by
+update_rom_schema.py, which can also report the query plans of the hot queries.
+
+The optional patient search index is a SQLite FTS5 table using the trigram
+tokenizer, which supports case-insensitive substring matching. It is kept in
+sync with the patients table by triggers. Note that once the index has been
+created, every client that writes into the patients table needs a SQLite
+version with FTS5 and the trigram tokenizer (3.34 or newer).
+
+The change log records the primary keys of the inserted, updated and deleted
+rows of the patients and roms tables, using triggers. It is used to refresh the
+local replica (replica.py) by copying only the changed rows. Only the latest
+entries are kept; a replica that has fallen behind further is copied again.
+
+"""
+
+from sqlstats import exec_sql
+
+# declared indexes as {index name: (table, [columns])}
+INDEXES = {
+    # ROM list of a patient, deleting a patient (ON DELETE CASCADE)
+    'roms_patient_id': ('roms', ['patient_id']),
+    # measurement date
+    'roms_date': ('roms', ['TiedotPvm']),
+}
+
+# the queries that the application runs most often, as {description: SQL}
+HOT_QUERIES = {
+    'patient list': 'SELECT * FROM patients ORDER BY patient_id',
+    'ROM list of a patient': (
+        'SELECT rom_id, patient_id, TiedotPvm, TiedotMittaajat FROM roms '
+        'WHERE patient_id = 1 ORDER BY rom_id'
+    ),
+    'ROMs of a deleted patient': 'SELECT rom_id FROM roms WHERE patient_id = 1',
+    # the same lookup is done by ON DELETE CASCADE, whose plan is not reported
+    # by EXPLAIN QUERY PLAN
+    'cascade delete of ROMs': 'DELETE FROM roms WHERE patient_id = 1',
+    'load ROM': 'SELECT * FROM roms WHERE rom_id = 1',
+    'ROMs by date': "SELECT rom_id FROM roms WHERE TiedotPvm = '1.1.2020'",
+    'unique SSN check': "SELECT EXISTS (SELECT 1 FROM patients WHERE ssn = '')",
+    'unique patient code check': (
+        "SELECT EXISTS (SELECT 1 FROM patients WHERE patient_code = '')"
+    ),
+}
+
+SEARCH_TABLE = 'patients_fts'
+# the patient columns that are searched
+SEARCH_COLUMNS = ['firstname', 'lastname', 'ssn', 'patient_code', 'diagnosis']
+# the trigram tokenizer cannot match shorter strings
+SEARCH_MIN_LENGTH = 3
+
+CHANGE_LOG_TABLE = 'change_log'
+# the tables whose changes are logged, as {table: primary key}
+LOGGED_TABLES = {'patients': 'patient_id', 'roms': 'rom_id'}
+# number of entries kept in the change log
+CHANGE_LOG_SIZE = 10000
+
+
+def _index_columns(conn, index):
+    """Return the columns of an index, or None if it does not exist"""
+    columns = [row[2] for row in conn.execute(f"PRAGMA index_info('{index}')")]
+    return columns or None
+
+
+def check_indexes(conn):
+    """Check the declared indexes using a sqlite3 connection.
+
+    Returns a list of names of the indexes that are missing or have wrong
+    columns.
+    """
+    return [
+        index
+        for index, (_, columns) in INDEXES.items()
+        if _index_columns(conn, index) != columns
+    ]
+
+
+def create_indexes(conn):
+    """Create missing declared indexes using a sqlite3 connection.
+
+    An index with wrong columns is recreated. Returns a list of names of the
+    created indexes.
+    """
+    created = check_indexes(conn)
+    for index in created:
+        table, columns = INDEXES[index]
+        conn.execute(f'DROP INDEX IF EXISTS {index}')
+        conn.execute(f'CREATE INDEX {index} ON {table} ({", ".join(columns)})')
+    conn.commit()
+    return created
+
+
+def explain_hot_queries(conn):
+    """Return the query plans of the hot queries.
+
+    Returns a dict of {description: list of query plan lines}.
+    """
+    return {
+        desc: [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        for desc, sql in HOT_QUERIES.items()
+    }
+
+
+def _search_index_statements():
+    """Return the SQL statements that create the patient search index"""
+    cols = ', '.join(SEARCH_COLUMNS)
+    new_vals = ', '.join(f'new.{col}' for col in SEARCH_COLUMNS)
+    old_vals = ', '.join(f'old.{col}' for col in SEARCH_COLUMNS)
+    insert_new = (
+        f'INSERT INTO {SEARCH_TABLE} (rowid, {cols}) VALUES (new.patient_id, {new_vals});'
+    )
+    delete_old = (
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, {cols}) "
+        f"VALUES ('delete', old.patient_id, {old_vals});"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({cols}, "
+        f"content='patients', content_rowid='patient_id', tokenize='trigram')",
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON patients '
+        f'BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON patients '
+        f'BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE ON patients '
+        f'BEGIN {delete_old} {insert_new} END',
+        # index the existing patients
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def create_search_index(conn):
+    """Create the patient search index using a sqlite3 connection"""
+    for statement in _search_index_statements():
+        conn.execute(statement)
+    conn.commit()
+
+
+def drop_search_index(conn):
+    """Remove the patient search index using a sqlite3 connection"""
+    for suffix in ('_ai', '_ad', '_au'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}{suffix}')
+    conn.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    conn.commit()
+
+
+def _change_log_statements():
+    """Return the SQL statements that create the change log"""
+    # the sequence numbers are never reused (AUTOINCREMENT), so that pruned
+    # entries can be detected
+    statements = [
+        f'CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} ('
+        'seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, key INTEGER NOT NULL)'
+    ]
+    prune = (
+        f'DELETE FROM {CHANGE_LOG_TABLE} WHERE seq <= '
+        f'(SELECT max(seq) FROM {CHANGE_LOG_TABLE}) - {CHANGE_LOG_SIZE};'
+    )
+    for table, key in LOGGED_TABLES.items():
+        log = f"INSERT INTO {CHANGE_LOG_TABLE} (tbl, key) VALUES ('{table}', {{}});"
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS {CHANGE_LOG_TABLE}_{table}_ai '
+            f'AFTER INSERT ON {table} BEGIN {log.format(f"new.{key}")} {prune} END',
+            f'CREATE TRIGGER IF NOT EXISTS {CHANGE_LOG_TABLE}_{table}_ad '
+            f'AFTER DELETE ON {table} BEGIN {log.format(f"old.{key}")} {prune} END',
+            f'CREATE TRIGGER IF NOT EXISTS {CHANGE_LOG_TABLE}_{table}_au '
+            f'AFTER UPDATE ON {table} BEGIN {log.format(f"old.{key}")} '
+            f'{log.format(f"new.{key}")} {prune} END',
+        ]
+    return statements
+
+
+def create_change_log(conn):
+    """Create the change log using a sqlite3 connection"""
+    for statement in _change_log_statements():
+        conn.execute(statement)
+    conn.commit()
+
+
+def drop_change_log(conn):
+    """Remove the change log using a sqlite3 connection"""
+    for table in LOGGED_TABLES:
+        for suffix in ('_ai', '_ad', '_au'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {CHANGE_LOG_TABLE}_{table}{suffix}')
+    conn.execute(f'DROP TABLE IF EXISTS {CHANGE_LOG_TABLE}')
+    conn.commit()
+
+
+def has_change_log(conn):
+    """Check whether the change log exists, using a sqlite3 connection"""
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(query, [CHANGE_LOG_TABLE]).fetchone() is not None
+
+
+def last_change(conn):
+    """Return the sequence number of the latest change (0 if none).
+
+    Returns None if the database has no change log.
+    """
+    if not has_change_log(conn):
+        return None
+    return conn.execute(f'SELECT max(seq) FROM {CHANGE_LOG_TABLE}').fetchone()[0] or 0
+
+
+def changes_since(conn, seq):
+    """Return the changes after the change seq, using a sqlite3 connection.
+
+    Returns the latest sequence number and the changed keys as {table: set of
+    keys}, or None if the changes are not all in the log (e.g. pruned).
+    """
+    if (last := last_change(conn)) is None or last < seq:
+        return None
+    first = conn.execute(f'SELECT min(seq) FROM {CHANGE_LOG_TABLE}').fetchone()[0]
+    if last > seq and first > seq + 1:
+        return None
+    changes = {table: set() for table in LOGGED_TABLES}
+    query = f'SELECT DISTINCT tbl, key FROM {CHANGE_LOG_TABLE} WHERE seq > ?'
+    for table, key in conn.execute(query, [seq]):
+        changes[table].add(key)
+    return last, changes
+
+
+def has_search_index_qt(database):
+    """Check whether the search index exists and is usable by a QSqlDatabase.
+
+    The index may exist but be unusable, if the SQLite library of the Qt driver
+    does not support FTS5 or the trigram tokenizer.
+    """
+    query = exec_sql(database, f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH 'xyz' LIMIT 0")
+    ok = query.isActive()
+    query.finish()
+    return ok
+
+
+def _sql_string(value):
+    """Quote a value as a SQL string literal"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def search_filter(text):
+    """Return a SQL WHERE clause for the patients table that matches text.
+
+    The text is matched as a substring of any of the search columns, ignoring
+    case. Texts shorter than the trigram length cannot use the index, so they
+    are matched with LIKE instead.
+    """
+    if len(text) < SEARCH_MIN_LENGTH:
+        pattern = (
+            text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        )
+        pattern = _sql_string(f'%{pattern}%')
+        return ' OR '.join(f"{col} LIKE {pattern} ESCAPE '\\'" for col in SEARCH_COLUMNS)
+    # match the whole text as a phrase
+    phrase = '"' + text.replace('"', '""') + '"'
+    return (
+        f'patient_id IN (SELECT rowid FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH {_sql_string(phrase)})'
+    )
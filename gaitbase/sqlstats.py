@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Timing statistics of SQL queries.
+
+When enabled (debug.sql_stats), every query made through QtSql (exec_query,
+exec_sql) or through a sqlite3 connection created by dbconnect.connect() is
+timed. For each query, the hash of the normalized query text, the duration, the
+number of rows and whether it failed due to locking (SQLITE_BUSY) is recorded in
+an in-memory ring buffer. The statistics can be viewed from the Debug menu of
+the main window, and are written into a file when the program exits.
+
+Commits of sqlite3 connections are recorded as COMMIT, since a write may fail
+due to locking only at commit. The rows of a SELECT are read after the query
+has been executed, so reading them is recorded as a separate query, marked
+with /* fetch */. For sqlite3 connections, this is done by the cursor once the
+results have been read; for QtSql, the callers that read many rows do it using
+record_fetch().
+
+When disabled, the queries are executed directly, and the only cost is a flag
+check.
+
+"""
+
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from pathlib import Path
+
+from config import cfg
+from utils import cache_dir
+
+logger = logging.getLogger(__name__)
+
+enabled = cfg.debug.sql_stats
+
+Record = collections.namedtuple(
+    'Record', ['timestamp', 'query_hash', 'duration', 'rows', 'busy', 'source']
+)
+
+# the recorded queries; the writer thread records too, so access is locked
+_records = collections.deque(maxlen=cfg.debug.sql_stats_size)
+_lock = threading.Lock()
+# query texts by hash
+_queries = dict()
+
+# literals are replaced by placeholders, so that queries that differ only by
+# their parameters get the same hash
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def _normalize(sql):
+    """Normalize query text for hashing"""
+    return ' '.join(_LITERAL_RE.sub('?', sql).split())
+
+
+def record(sql, duration, rows=None, busy=False, source='sqlite3'):
+    """Record a query"""
+    normalized = _normalize(sql)
+    query_hash = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    with _lock:
+        _queries.setdefault(query_hash, normalized)
+        _records.append(Record(time.time(), query_hash, duration, rows, busy, source))
+
+
+def record_fetch(sql, t0, rows, source='qt'):
+    """Record reading the rows of a SELECT, started at perf_counter() t0"""
+    record(f'{sql} /* fetch */', time.perf_counter() - t0, rows, source=source)
+
+
+def _snapshot():
+    """Return copies of the recorded queries and of the query texts"""
+    with _lock:
+        return list(_records), dict(_queries)
+
+
+def is_busy_error(msg):
+    """Check whether an error message indicates SQLITE_BUSY"""
+    return 'locked' in msg or 'busy' in msg
+
+
+def exec_query(query, sql=None):
+    """Execute a QSqlQuery, like query.exec(); returns success"""
+    if not enabled:
+        return query.exec() if sql is None else query.exec(sql)
+    t0 = time.perf_counter()
+    ok = query.exec() if sql is None else query.exec(sql)
+    duration = time.perf_counter() - t0
+    if ok:
+        rows = None if query.isSelect() else query.numRowsAffected()
+        busy = False
+    else:
+        rows = None
+        busy = is_busy_error(query.lastError().databaseText())
+    record(query.lastQuery(), duration, rows, busy, 'qt')
+    return ok
+
+
+def exec_sql(database, sql):
+    """Execute SQL on a QSqlDatabase, like database.exec(); returns the query"""
+    if not enabled:
+        return database.exec(sql)
+    t0 = time.perf_counter()
+    query = database.exec(sql)
+    duration = time.perf_counter() - t0
+    busy = is_busy_error(query.lastError().databaseText())
+    rows = None if busy or query.isSelect() else query.numRowsAffected()
+    record(sql, duration, rows, busy, 'qt')
+    return query
+
+
+class StatsCursor(sqlite3.Cursor):
+    """sqlite3 cursor that records its queries and the reading of their rows"""
+
+    # the SELECT whose rows are being read, the time spent in reading them and
+    # the number of rows read
+    _fetch_sql = None
+    _fetch_time = 0.0
+    _fetch_rows = 0
+
+    def _timed(self, method, sql, params):
+        self._record_fetch()
+        t0 = time.perf_counter()
+        try:
+            method(sql, params)
+        except sqlite3.OperationalError as e:
+            record(sql, time.perf_counter() - t0, busy=is_busy_error(str(e)))
+            raise
+        rows = self.rowcount if self.rowcount >= 0 else None
+        record(sql, time.perf_counter() - t0, rows)
+        if self.description is not None:
+            self._fetch_sql, self._fetch_time, self._fetch_rows = sql, 0.0, 0
+        return self
+
+    def execute(self, sql, params=()):
+        return self._timed(super().execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._timed(super().executemany, sql, params)
+
+    def _fetched(self, t0, rows, done):
+        """Account for rows read in perf_counter() time since t0"""
+        if self._fetch_sql is not None:
+            self._fetch_time += time.perf_counter() - t0
+            self._fetch_rows += rows
+            if done:
+                self._record_fetch()
+
+    def _record_fetch(self):
+        if self._fetch_sql is not None:
+            record(f'{self._fetch_sql} /* fetch */', self._fetch_time, self._fetch_rows)
+            self._fetch_sql = None
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(t0, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(t0, 0, True)
+            raise
+        self._fetched(t0, 1, False)
+        return row
+
+    def close(self):
+        self._record_fetch()
+        super().close()
+
+    def __del__(self):
+        # the rows of a cursor are often not read to the end
+        self._record_fetch()
+
+
+class StatsConnection(sqlite3.Connection):
+    """sqlite3 connection that records its queries and commits"""
+
+    def cursor(self, factory=StatsCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            record('COMMIT', time.perf_counter() - t0, busy=is_busy_error(str(e)))
+            raise
+        record('COMMIT', time.perf_counter() - t0)
+
+
+def _percentile(sorted_values, p):
+    """Return the p:th percentile of sorted values (nearest rank)"""
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summary():
+    """Return per-query statistics as a list of dicts.
+
+    The list is sorted by the total time spent in the query. Times are in ms.
+    """
+    records, queries = _snapshot()
+    by_hash = collections.defaultdict(list)
+    for rec in records:
+        by_hash[rec.query_hash].append(rec)
+    stats = list()
+    for query_hash, recs in by_hash.items():
+        durations = sorted(rec.duration * 1000 for rec in recs)
+        rows = [rec.rows for rec in recs if rec.rows is not None]
+        stats.append(
+            {
+                'query_hash': query_hash,
+                'query': queries[query_hash],
+                'count': len(recs),
+                'total': sum(durations),
+                'median': statistics.median(durations),
+                'p95': _percentile(durations, 95),
+                'p99': _percentile(durations, 99),
+                'max': durations[-1],
+                'rows': sum(rows) if rows else None,
+                'busy': sum(rec.busy for rec in recs),
+            }
+        )
+    return sorted(stats, key=lambda s: s['total'], reverse=True)
+
+
+def summary_text(max_queries=30):
+    """Return the statistics as text"""
+    stats = summary()
+    lines = [f'{sum(s["count"] for s in stats)} queries recorded (buffer size {_records.maxlen})']
+    for s in stats[:max_queries]:
+        lines.append(
+            f"\n{s['query'][:200]}\n"
+            f"  n={s['count']} total={s['total']:.1f} ms median={s['median']:.2f} ms "
+            f"p95={s['p95']:.2f} ms p99={s['p99']:.2f} ms max={s['max']:.2f} ms "
+            f"rows={s['rows']} busy={s['busy']}"
+        )
+    return '\n'.join(lines)
+
+
+def default_dump_path():
+    """Return the default file for dumping the statistics"""
+    return cache_dir() / 'sqlstats.json'
+
+
+def dump(fname=None):
+    """Write the statistics and the recorded queries into a JSON file"""
+    fname = Path(fname or cfg.debug.sql_stats_file or default_dump_path())
+    records, _ = _snapshot()
+    data = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'summary': summary(),
+        'records': [rec._asdict() for rec in records],
+    }
+    try:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+    except OSError as e:
+        logger.warning(f'could not write SQL statistics into {fname}: {e}')
+        return None
+    return fname
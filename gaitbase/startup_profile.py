@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the startup phases of gaitbase.
+
+run_gaitbase.py --profile-startup starts the profile, and the startup code
+marks the end of each phase with mark(). When the main window has been shown,
+the durations of the phases are reported. When the profile has not been
+started, mark() does nothing.
+
+Only the standard library is imported here, so that the imports of the other
+modules can be timed.
+
+"""
+
+import json
+import time
+
+# the profile start time, and the marked phases as (name, time)
+_t0 = None
+_marks = None
+# time from the start of the process to the start of the profile (s)
+_process_startup = None
+
+
+def start():
+    """Start the profile"""
+    global _t0, _marks, _process_startup
+    _marks = list()
+    # the interpreter startup is measured from the creation time of the process
+    import psutil
+
+    _process_startup = max(0.0, time.time() - psutil.Process().create_time())
+    _t0 = time.perf_counter()
+
+
+def is_active():
+    """Check whether the profile was started"""
+    return _marks is not None
+
+
+def mark(phase):
+    """Mark the end of a startup phase"""
+    if _marks is not None:
+        _marks.append((phase, time.perf_counter()))
+
+
+def results():
+    """Return the phase durations (s) as a dict.
+
+    The phases are in chronological order. The 'time to first window' item
+    includes the interpreter startup.
+    """
+    durations = {'python startup': _process_startup}
+    t_prev = _t0
+    for phase, t in _marks:
+        durations[phase] = t - t_prev
+        t_prev = t
+    durations['time to first window'] = _process_startup + t_prev - _t0
+    return durations
+
+
+def report(fname='-'):
+    """Print the phase durations, or write them into a JSON file"""
+    durations = results()
+    if fname == '-':
+        for phase, duration in durations.items():
+            print(f'{phase:>40}: {duration * 1000:7.0f} ms')
+    else:
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(durations, f, indent=2)
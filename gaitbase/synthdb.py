@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Create a synthetic gait database for benchmarking.
+
+The database has the real schema (see recreate_db.py). The ROM values are drawn
+from the properties of the data entry widgets (ranges, decimals, combobox
+choices etc.), as given by the variable catalog. Like in real data, many of the
+variables are never entered (NULL in the database). Example:
+
+python synthdb.py synthetic.db --patients 50000 --roms 500000
+
+"""
+
+import argparse
+import datetime
+import random
+import string
+import time
+from pathlib import Path
+
+from constants import Constants
+from dbconnect import connect
+from recreate_db import create_schema
+from varcatalog import load_catalog
+
+# probability that a variable was entered for a ROM
+ENTERED_PROB = 0.3
+# rows per transaction
+BATCH_SIZE = 2000
+
+FIRSTNAMES = ['Aino', 'Eero', 'Helmi', 'Ilmari', 'Kaarina', 'Lauri', 'Maija', 'Onni']
+LASTNAMES = ['Virtanen', 'Korhonen', 'Mäkinen', 'Nieminen', 'Heikkinen', 'Laine']
+DIAGNOSES = ['CP diplegia', 'CP hemiplegia', 'MMC', 'muu', None]
+PERSONNEL = ['HL, JN', 'TR', 'MK, TR', 'JN']
+TEXTS = ['', 'ok', 'kivulias', 'ei yhteistyökykyinen', 'mitattu ortooseilla']
+
+
+def _random_date(rng, start_year=2000, end_year=2024):
+    """Return a random date as dd.mm.yyyy (not zero padded, like user input)"""
+    start = datetime.date(start_year, 1, 1).toordinal()
+    end = datetime.date(end_year, 12, 31).toordinal()
+    date = datetime.date.fromordinal(rng.randint(start, end))
+    return f'{date.day}.{date.month}.{date.year}'
+
+
+def _patient_code(k):
+    """Return a unique and valid patient code for a running number"""
+    prefixes = Constants.patient_code_prefixes
+    n_prefixes = len(prefixes)
+    prefix = prefixes[k % n_prefixes]
+    number = (k // n_prefixes) % 10000
+    i = k // (n_prefixes * 10000)
+    initials = string.ascii_uppercase[i // 26 % 26] + string.ascii_uppercase[i % 26]
+    return f'{prefix}{number:04d}_{initials}'
+
+
+def _make_patient(rng, k):
+    """Return values for a patients table row"""
+    date = datetime.date.fromordinal(
+        rng.randint(datetime.date(1990, 1, 1).toordinal(), datetime.date(2022, 12, 31).toordinal())
+    )
+    century_sign = '-' if date.year < 2000 else 'A'
+    ssn = f'{date:%d%m%y}{century_sign}{k:06d}'
+    return (
+        rng.choice(FIRSTNAMES),
+        rng.choice(LASTNAMES),
+        ssn,
+        _patient_code(k),
+        rng.choice(DIAGNOSES),
+    )
+
+
+def _random_value(rng, info):
+    """Return a random value for a ROM variable"""
+    if info.widget_class == 'QComboBox':
+        return rng.choice(info.items) if info.items else info.default
+    elif info.widget_class == 'QCheckBox':
+        return rng.choice([Constants.checkbox_yestext, Constants.checkbox_notext])
+    elif info.widget_class in ('QLineEdit', 'QTextEdit'):
+        return rng.choice(TEXTS)
+    elif info.widget_class == 'CheckableSpinBox' and rng.random() < 0.3:
+        return info.default_text
+    # spinboxes; the minimum is the 'not measured' value
+    lo, hi = info.minimum + 1, info.maximum
+    if info.decimals is None:
+        return rng.randint(lo, max(lo, hi))
+    # rounding may hit the minimum, which is OK
+    return info.coerce(rng.triangular(lo, hi, (lo + hi) / 2))
+
+
+def _make_rom(rng, patient_id, catalog):
+    """Return values for a roms table row, in the order of the catalog"""
+    values = [
+        _random_value(rng, info) if rng.random() < ENTERED_PROB else None
+        for info in catalog.values()
+    ]
+    data = dict(zip(catalog, values))
+    data['TiedotPvm'] = _random_date(rng)
+    data['TiedotMittaajat'] = rng.choice(PERSONNEL)
+    return [patient_id] + list(data.values())
+
+
+def _fill_db(conn, n_patients, n_roms, seed):
+    """Create the schema and insert synthetic patients and ROMs"""
+    rng = random.Random(seed)
+    catalog = load_catalog()
+    create_schema(conn)
+
+    for start in range(0, n_patients, BATCH_SIZE):
+        rows = [
+            _make_patient(rng, k)
+            for k in range(start, min(start + BATCH_SIZE, n_patients))
+        ]
+        with conn:
+            conn.executemany(
+                'INSERT INTO patients (firstname, lastname, ssn, patient_code, diagnosis) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    varlist = ','.join(['patient_id'] + list(catalog))
+    placeholders = ','.join('?' * (len(catalog) + 1))
+    for start in range(0, n_roms, BATCH_SIZE):
+        rows = [
+            _make_rom(rng, rng.randint(1, n_patients), catalog)
+            for _ in range(start, min(start + BATCH_SIZE, n_roms))
+        ]
+        with conn:
+            conn.executemany(f'INSERT INTO roms ({varlist}) VALUES ({placeholders})', rows)
+    conn.execute('ANALYZE')
+
+
+def create_synthetic_db(db_fname, n_patients, n_roms, seed=0):
+    """Create a synthetic database.
+
+    The ROMs are distributed randomly among the patients. The database is
+    created under a temporary name and renamed when complete, so that a failure
+    does not leave a partial database behind.
+    """
+    db_fname = Path(db_fname)
+    if db_fname.is_file():
+        raise RuntimeError(f'File {db_fname} already exists!')
+    tmp_fname = db_fname.with_name(db_fname.name + '.partial')
+    # left over from an interrupted run
+    tmp_fname.unlink(missing_ok=True)
+    conn = connect(tmp_fname)
+    try:
+        _fill_db(conn, n_patients, n_roms, seed)
+    except BaseException:
+        conn.close()
+        tmp_fname.unlink(missing_ok=True)
+        raise
+    conn.close()
+    tmp_fname.rename(db_fname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a synthetic gait database')
+    parser.add_argument('db_fname', help='path of the database file to create')
+    parser.add_argument('--patients', type=int, default=1000, help='number of patients')
+    parser.add_argument('--roms', type=int, default=5000, help='number of ROMs')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    create_synthetic_db(args.db_fname, args.patients, args.roms, args.seed)
+    print(
+        f'created {args.db_fname} with {args.patients} patients and {args.roms} ROMs '
+        f'in {time.perf_counter() - t0:.1f} s'
+    )
+
+
+if __name__ == '__main__':
+    main()
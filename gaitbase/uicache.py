@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Cached loading of the Qt Designer user interface files.
+
+uic.loadUi() parses the .ui XML and generates Python code every time a window
+is created. Instead, load_ui() compiles each .ui file into a Python module with
+pyuic once, and caches the module in the user's cache directory. The module name
+contains the hash of the .ui file, so a changed .ui file is compiled again. If
+the compiled module cannot be created or loaded, loadUi() is used instead.
+
+For large windows, the pages of a tab widget can be split into .ui files of
+their own (load_paged_ui()). The window is then created with empty pages, and
+the contents of each page are created only when needed (load_ui_page()).
+
+The modules can also be compiled in advance (e.g. when installing) by running
+this file.
+
+"""
+
+import hashlib
+import importlib.util
+import logging
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from config import cfg
+from utils import cache_dir, package_file
+
+logger = logging.getLogger(__name__)
+
+# the user interface files of the package
+UI_FILES = ['rom_entryapp.ui', 'gaitbase_main.ui', 'edit_patient.ui']
+
+# user interface files whose tab widget pages are split into separate files,
+# as {ui file: name of the tab widget}
+PAGED_UI_FILES = {'rom_entryapp.ui': 'maintab'}
+
+# compiled modules that have been imported by this process
+_modules = dict()
+
+# split user interface files, keyed by (ui file, tab widget, ui file hash)
+_splits = dict()
+
+
+def _ui_cache_dir():
+    """Return the directory for the compiled modules"""
+    return cache_dir() / 'ui'
+
+
+def _ui_hash(uifile):
+    """Return hash of the contents of a .ui file"""
+    with open(uifile, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _module_path(uifile):
+    """Return path of the compiled module for a .ui file"""
+    return _ui_cache_dir() / f'{Path(uifile).stem}_{_ui_hash(uifile)}.py'
+
+
+def _write_ui(root, path):
+    """Write a .ui XML tree into the cache, unless already done"""
+    if path.is_file():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # see compile_ui() for the temporary file
+    tmppath = path.with_suffix('.tmp')
+    ET.ElementTree(root).write(tmppath, encoding='utf-8', xml_declaration=True)
+    tmppath.replace(path)
+
+
+def split_ui(uifile, tabwidget):
+    """Split the pages of a tab widget into .ui files of their own.
+
+    The pages are left empty in the rest of the user interface. The .ui files
+    are written into the cache, named by the hash of the original .ui file.
+    Returns the path of the .ui file for the rest of the user interface, and a
+    dict of {page name: (path of the page .ui file, names of the page widgets)}.
+    """
+    key = (uifile, tabwidget, _ui_hash(uifile))
+    if (split := _splits.get(key)) is not None:
+        return split
+    root = ET.parse(uifile).getroot()
+    stem = f'{Path(uifile).stem}_{key[2]}'
+    # the custom widget declarations etc. are needed by the pages too
+    shared = [elem for elem in root if elem.tag in ('customwidgets', 'resources')]
+    tabstops = root.find('tabstops')
+    tabstop_names = [] if tabstops is None else [elem.text for elem in tabstops]
+    page_roots = dict()
+    pages = dict()
+    for page in root.find(f".//widget[@name='{tabwidget}']").findall('widget'):
+        name = page.get('name')
+        page_root = ET.Element('ui', root.attrib)
+        ET.SubElement(page_root, 'class').text = name
+        page_widget = ET.SubElement(page_root, 'widget', page.attrib)
+        # move the contents of the page; the tab title stays in the tab widget
+        for elem in [elem for elem in page if elem.tag != 'attribute']:
+            page.remove(elem)
+            page_widget.append(elem)
+        page_root.extend(shared)
+        widget_names = [w.get('name') for w in page_widget.iter('widget')][1:]
+        page_roots[name] = page_root
+        pages[name] = (_ui_cache_dir() / f'{stem}_{name}.ui', widget_names)
+    # each file gets the tab stops of its own widgets
+    if tabstops is not None:
+        for name, page_root in page_roots.items():
+            if page_tabstop_names := [w for w in tabstop_names if w in pages[name][1]]:
+                page_tabstops = ET.SubElement(page_root, 'tabstops')
+                for wname in page_tabstop_names:
+                    ET.SubElement(page_tabstops, 'tabstop').text = wname
+        for elem in list(tabstops):
+            if any(elem.text in widget_names for _, widget_names in pages.values()):
+                tabstops.remove(elem)
+    main_path = _ui_cache_dir() / f'{stem}.ui'
+    _write_ui(root, main_path)
+    for name, page_root in page_roots.items():
+        _write_ui(page_root, pages[name][0])
+    _splits[key] = main_path, pages
+    return main_path, pages
+
+
+def compile_ui(uifile):
+    """Compile a .ui file into a module in the cache, unless already done.
+
+    Returns path of the compiled module.
+    """
+    modpath = _module_path(uifile)
+    if not modpath.is_file():
+        logger.debug(f'compiling {uifile} into {modpath}')
+        modpath.parent.mkdir(parents=True, exist_ok=True)
+        # write into a temporary file first, so that other processes never see
+        # a partially written module
+        tmppath = modpath.with_suffix('.tmp')
+        # uic is slow to import, and only needed when compiling
+        from PyQt5 import uic
+
+        with open(tmppath, 'w', encoding='utf-8') as f:
+            uic.compileUi(str(uifile), f)
+        tmppath.replace(modpath)
+    return modpath
+
+
+def _import_module(modpath):
+    """Import a compiled module from its path"""
+    if (module := _modules.get(modpath)) is None:
+        spec = importlib.util.spec_from_file_location(modpath.stem, modpath)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[modpath] = module
+    return module
+
+
+def _ui_class(module):
+    """Return the Ui_* class of a compiled module"""
+    return next(
+        obj for name, obj in vars(module).items() if name.startswith('Ui_')
+    )
+
+
+def _setup_ui(uifile, widget, owner):
+    """Set up a widget from a .ui file; the child widgets become attributes of owner"""
+    if cfg.visual.compiled_ui:
+        try:
+            ui_class = _ui_class(_import_module(compile_ui(uifile)))
+        except Exception as e:  # any failure: fall back to runtime loading
+            logger.warning(
+                f'could not use compiled user interface for {Path(uifile).name}: {e}'
+            )
+        else:
+            ui = ui_class()
+            ui.setupUi(widget)
+            # like loadUi(), make the child widgets attributes of the owner
+            owner.__dict__.update(vars(ui))
+            return
+    from PyQt5 import uic
+
+    uic.loadUi(uifile, widget)
+    if owner is not widget:
+        owner.__dict__.update(vars(widget))
+
+
+def load_ui(uiname, widget):
+    """Set up a widget from a package .ui file, like uic.loadUi().
+
+    uiname is the file name of the .ui file in the package. The child widgets
+    become attributes of the widget.
+    """
+    _setup_ui(package_file(uiname), widget, widget)
+
+
+def load_paged_ui(uiname, widget):
+    """Set up a widget from a package .ui file, leaving the tab pages empty.
+
+    The tab widget is given by PAGED_UI_FILES. Returns a dict of {page name:
+    (page .ui file, names of the page widgets)}; the contents of a page are set
+    up by passing its .ui file to load_ui_page().
+    """
+    main_path, pages = split_ui(package_file(uiname), PAGED_UI_FILES[uiname])
+    _setup_ui(main_path, widget, widget)
+    return pages
+
+
+def load_ui_page(pagefile, page, widget):
+    """Set up the contents of a tab page created by load_paged_ui().
+
+    The child widgets become attributes of widget (the window), like the rest
+    of its widgets.
+    """
+    _setup_ui(pagefile, page, widget)
+
+
+def compile_package_ui(uiname):
+    """Compile a package .ui file (or its split files) into the cache.
+
+    Returns the paths of the compiled modules.
+    """
+    uifile = package_file(uiname)
+    if (tabwidget := PAGED_UI_FILES.get(uiname)) is None:
+        return [compile_ui(uifile)]
+    main_path, pages = split_ui(uifile, tabwidget)
+    return [compile_ui(path) for path in [main_path] + [p for p, _ in pages.values()]]
+
+
+if __name__ == '__main__':
+    # compile all the user interface files in advance
+    for uiname in UI_FILES:
+        for modpath in compile_package_ui(uiname):
+            print(modpath)
@@ -6,10 +6,45 @@ Update the ROM table schema. Necessary when new ROM variables are introduced.
 
 import argparse
 from pathlib import Path
-import sqlite3
 
 from dump_varlist import get_vars_and_affinities
 from constants import Constants
+from dbconnect import active_journal_mode, connect
+from schema import (
+    INDEXES,
+    check_indexes,
+    create_change_log,
+    create_indexes,
+    create_search_index,
+    drop_search_index,
+    explain_hot_queries,
+    has_change_log,
+)
+
+
+def update_search_index(db_fname, create=True):
+    """Create or remove the patient search index"""
+    conn = connect(db_fname)
+    if create:
+        print('*** Creating the patient search index...')
+        create_search_index(conn)
+    else:
+        print('*** Removing the patient search index...')
+        drop_search_index(conn)
+    conn.close()
+
+
+def explain_queries(db_fname):
+    """Print the query plans of the hot queries of the application"""
+    conn = connect(db_fname)
+    print('*** Query plans:')
+    for desc, plan in explain_hot_queries(conn).items():
+        print(f'{desc}:')
+        for line in plan:
+            # a full scan of the ROM table is slow for large databases
+            note = '  <-- full table scan' if line.startswith('SCAN roms') else ''
+            print(f'    {line}{note}')
+    conn.close()
 
 
 def check_ui_vs_sql(db_fname, update=False):
@@ -18,8 +53,9 @@ def check_ui_vs_sql(db_fname, update=False):
     db_fname = Path(db_fname)
     if not db_fname.is_file():
         raise RuntimeError('DB file needs to exist!')
-    conn = sqlite3.connect(db_fname)
+    conn = connect(db_fname)
     conn.execute('PRAGMA foreign_keys = ON;')
+    print(f'*** Database journal mode: {active_journal_mode(conn)}')
 
     # Compare DB version vs the version the application expects
     db_ver = list(conn.execute('PRAGMA user_version'))[0][0]
@@ -33,6 +69,25 @@ def check_ui_vs_sql(db_fname, update=False):
         else:
             print('Use -u to update the DB schema version.')
 
+    # check the declared indexes
+    for index in check_indexes(conn):
+        table, columns = INDEXES[index]
+        print(f"*** NOTE: index '{index}' on {table} ({', '.join(columns)}) is missing!")
+        if not update:
+            print('Use -u to create it automatically.')
+    if update:
+        for index in create_indexes(conn):
+            print(f"*** Created index '{index}'")
+
+    # check the change log, which is needed for refreshing local replicas
+    if not has_change_log(conn):
+        print('*** NOTE: the change log is missing!')
+        if update:
+            print('*** Creating the change log...')
+            create_change_log(conn)
+        else:
+            print('Use -u to create it automatically.')
+
     # get database columns and affinities
     var_affs_sql = dict()
     for varinfo in conn.execute("PRAGMA table_info('roms');"):
@@ -76,6 +131,25 @@ if __name__ == '__main__':
         help='automatically update the database (add missing columns and more)',
         action='store_true',
     )
+    parser.add_argument(
+        '--search-index',
+        help='create the patient search index (needs SQLite 3.34+ on all clients)',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--drop-search-index',
+        help='remove the patient search index',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--explain',
+        help='report the query plans of the most frequent queries',
+        action='store_true',
+    )
     args = parser.parse_args()
 
     check_ui_vs_sql(args.db_fname, args.update)
+    if args.search_index or args.drop_search_index:
+        update_search_index(args.db_fname, create=args.search_index)
+    if args.explain:
+        explain_queries(args.db_fname)
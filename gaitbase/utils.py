@@ -8,17 +8,29 @@ import subprocess
 import sys
 import os
 import datetime
-
-from ulstools.env import make_shortcut
+from importlib.resources import files
+from pathlib import Path
 
 from constants import Constants
 
 
 def make_my_shortcut():
     """Make a desktop shortcut"""
+    from ulstools.env import make_shortcut
+
     make_shortcut('gaitbase', 'run_gaitbase.py', title='Gait database')
 
 
+def package_file(fname):
+    """Return path of a data file in the package, as a string"""
+    return str(files('gaitbase') / fname)
+
+
+def cache_dir():
+    """Return the directory for the user-specific cached data"""
+    return Path.home() / '.gaitbase_cache'
+
+
 def validate_code(code):
     """Check if patient code is valid.
     
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of ROM variables, read directly from the user interface file.
+
+The data entry widgets in rom_entryapp.ui define the ROM variables. This module
+parses the .ui XML to find the variables and their properties (widget class,
+SQLite affinity, default value, units etc.) without instantiating any Qt
+widgets. The defaults follow the conventions described in the README, e.g. a
+spinbox at its minimum value corresponds to the 'not measured' value.
+
+Parsing the .ui file takes a while, so the catalog is cached as JSON in the
+user's cache directory. The cache is invalidated when the .ui file changes
+(detected by its hash) or when the catalog format (CATALOG_VERSION) changes.
+
+"""
+
+import hashlib
+import json
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from constants import Constants
+from utils import cache_dir, isnumeric, package_file
+
+logger = logging.getLogger(__name__)
+
+# increase this whenever VarInfo or the parsing logic changes
+CATALOG_VERSION = 1
+
+# widget classes whose values are stored with NUMERIC affinity
+NUMERIC_WIDGETS = ('QSpinBox', 'QDoubleSpinBox', 'CheckableSpinBox')
+
+# Qt default properties for spinbox types, used if not set in the .ui file.
+# For CheckableSpinBox, these are the defaults set by the widget itself.
+_SPINBOX_DEFAULTS = {
+    'QSpinBox': {'minimum': 0, 'maximum': 99, 'value': 0, 'suffix': ''},
+    'QDoubleSpinBox': {'minimum': 0.0, 'maximum': 99.99, 'value': 0.0, 'suffix': ''},
+    'CheckableSpinBox': {'minimum': -181, 'maximum': 180, 'value': -181, 'suffix': '°'},
+}
+
+
+@dataclass
+class VarInfo:
+    """Properties of a single ROM variable"""
+
+    varname: str
+    widget_name: str
+    widget_class: str
+    affinity: str
+    # the value of the widget in its default state
+    default: object
+    # units (spinbox suffix); only applied to numeric values
+    units: str = ''
+    minimum: float = None
+    maximum: float = None
+    decimals: int = None
+    # choices for comboboxes
+    items: list = field(default_factory=list)
+    # 'within normal range' text for CheckableSpinBox
+    default_text: str = None
+
+    def get_units(self, value):
+        """Get units for a value of this variable.
+
+        As for the widgets, units are only returned for numeric values.
+        """
+        return self.units if isnumeric(value) else ''
+
+    def coerce(self, value):
+        """Convert a value like the widget does when the value is set.
+
+        Spinboxes round the value to their decimals and clamp it into their
+        range; the minimum value means 'not measured'.
+        """
+        if self.widget_class not in NUMERIC_WIDGETS or not isnumeric(value):
+            return value
+        value = min(max(value, self.minimum), self.maximum)
+        if self.decimals is not None:
+            value = round(value, self.decimals)
+        return Constants.spinbox_novalue_text if value == self.minimum else value
+
+
+def default_uifile():
+    """Return path of the package ROM entry user interface"""
+    return package_file('rom_entryapp.ui')
+
+
+def _property_value(prop):
+    """Convert a <property> element of the .ui file into a Python value"""
+    val = prop[0]
+    if val.tag == 'number':
+        return int(val.text)
+    elif val.tag == 'double':
+        return float(val.text)
+    elif val.tag == 'bool':
+        return val.text == 'true'
+    elif val.tag == 'string':
+        return val.text or ''
+    return val.text
+
+
+def _widget_properties(elem):
+    """Return dict of the properties of a <widget> element"""
+    return {prop.get('name'): _property_value(prop) for prop in elem.findall('property')}
+
+
+def _make_varinfo(elem):
+    """Create a VarInfo from a data widget <widget> element"""
+    wname = elem.get('name')
+    wclass = elem.get('class')
+    props = _widget_properties(elem)
+    varname = wname[len(Constants.input_widget_prefix) :]
+    affinity = 'NUMERIC' if wclass in NUMERIC_WIDGETS else 'TEXT'
+    info = VarInfo(varname, wname, wclass, affinity, default=None)
+
+    if wclass in NUMERIC_WIDGETS:
+        spin_props = _SPINBOX_DEFAULTS[wclass] | props
+        info.minimum = spin_props['minimum']
+        info.maximum = spin_props['maximum']
+        info.units = spin_props['suffix']
+        # like Qt, clamp the value into the allowed range
+        value = min(max(spin_props['value'], info.minimum), info.maximum)
+        if wclass == 'QDoubleSpinBox':
+            info.decimals = props.get('decimals', 2)
+            value = round(value, info.decimals)
+        if wclass == 'CheckableSpinBox':
+            info.default_text = props.get('defaultText', 'NR')
+        info.default = Constants.spinbox_novalue_text if value == info.minimum else value
+
+    elif wclass in ('QLineEdit', 'QTextEdit'):
+        text = props.get('text' if wclass == 'QLineEdit' else 'plainText', '')
+        info.default = text.strip()
+
+    elif wclass == 'QCheckBox':
+        checked = props.get('checked', False)
+        info.default = (
+            Constants.checkbox_yestext if checked else Constants.checkbox_notext
+        )
+
+    elif wclass == 'QComboBox':
+        info.items = [
+            _property_value(item.find('property')) for item in elem.findall('item')
+        ]
+        idx = props.get('currentIndex', 0)
+        info.default = info.items[idx] if info.items else ''
+
+    else:
+        raise RuntimeError(f'Invalid type of data input widget: {wclass}')
+    return info
+
+
+def build_catalog(uifile=None):
+    """Parse the ROM variables from a .ui file.
+
+    Returns a dict of {varname: VarInfo}, in the order of the widgets in the
+    file.
+    """
+    uifile = uifile or default_uifile()
+    root = ET.parse(uifile).getroot()
+    catalog = dict()
+    for elem in root.iter('widget'):
+        if elem.get('name', '').startswith(Constants.input_widget_prefix):
+            info = _make_varinfo(elem)
+            catalog[info.varname] = info
+    return catalog
+
+
+def _file_hash(fname):
+    """Return SHA-256 hash of a file"""
+    with open(fname, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_catalog(uifile=None, cachedir=None):
+    """Return the catalog of ROM variables, using the cache if possible.
+
+    Returns a dict of {varname: VarInfo}, in the order of the widgets in the
+    .ui file.
+    """
+    uifile = uifile or default_uifile()
+    cachefile = Path(cachedir or cache_dir()) / 'varcatalog.json'
+    ui_hash = _file_hash(uifile)
+    try:
+        with open(cachefile, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['version'] == CATALOG_VERSION and cached['ui_hash'] == ui_hash:
+            return {d['varname']: VarInfo(**d) for d in cached['vars']}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    catalog = build_catalog(uifile)
+    cached = {
+        'version': CATALOG_VERSION,
+        'ui_hash': ui_hash,
+        'vars': [asdict(info) for info in catalog.values()],
+    }
+    try:
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        with open(cachefile, 'w', encoding='utf-8') as f:
+            json.dump(cached, f, ensure_ascii=False)
+    except OSError as e:  # the cache is optional
+        logger.warning(f'could not write variable catalog cache {cachefile}: {e}')
+    return catalog
@@ -3,9 +3,10 @@
 Custom widgets, dialogs and related Qt code.
 """
 
-from PyQt5 import QtWidgets, QtCore
+from abc import ABC, abstractmethod
+
+from PyQt5 import QtWidgets, QtCore, QtGui
 from constants import Constants, Finnish
-from utils import isnumeric
 
 
 def qt_message_dialog(msg):
@@ -32,6 +33,23 @@ def qt_confirm_dialog(msg):
     return dlg.buttonRole(dlg.clickedButton()) == QtWidgets.QMessageBox.YesRole
 
 
+def qt_text_dialog(title, text):
+    """Show a long text in a scrollable read-only view"""
+    dlg = QtWidgets.QDialog()
+    dlg.setWindowTitle(title)
+    layout = QtWidgets.QVBoxLayout(dlg)
+    view = QtWidgets.QPlainTextEdit(text)
+    view.setReadOnly(True)
+    view.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+    view.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+    layout.addWidget(view)
+    buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close)
+    buttons.rejected.connect(dlg.reject)
+    layout.addWidget(buttons)
+    dlg.resize(900, 600)
+    dlg.exec()
+
+
 def keyPressEvent_resetOnEsc(obj, event):
     """Special event handler for spinboxes. Resets value (sets it
     to minimum) when Esc is pressed."""
@@ -42,96 +60,130 @@ def keyPressEvent_resetOnEsc(obj, event):
         super(obj.__class__, obj).keyPressEvent(event)
 
 
-def get_widget_value(widget):
-    """Get the value from a data input widget"""
-    widget_class = widget.__class__.__name__
+class WidgetAccessor(ABC):
+    """Value access for a single data input widget.
 
-    if widget_class in ('QSpinBox', 'QDoubleSpinBox'):
-        if widget.value() == widget.minimum():
-            val = Constants.spinbox_novalue_text
-        else:
-            val = widget.value()
+    Subclasses implement the access for a class of widgets, and are registered
+    for the widget class names using register_accessor(). Accessors are created
+    once for each widget, so that the widget class does not need to be looked up
+    on every access.
+    """
 
-    elif widget_class == 'CheckableSpinBox':
-        # CheckableSpinBox handles the special value condition by itself
-        val = widget.value()
+    def __init__(self, widget):
+        self.widget = widget
 
-    elif widget_class == 'QLineEdit':
-        val = widget.text().strip()
+    @abstractmethod
+    def get(self):
+        """Get the value of the widget"""
 
-    elif widget_class == 'QCheckBox':
-        state = int(widget.checkState())
-        if state == 0:
-            val = Constants.checkbox_notext
-        elif state == 2:
-            val = Constants.checkbox_yestext
-        else:
-            raise RuntimeError('unexpected checkbox value')
+    @abstractmethod
+    def set(self, value):
+        """Set the value of the widget"""
 
-    elif widget_class == 'QComboBox':
-        val = widget.currentText()
 
-    elif widget_class == 'QTextEdit':
-        val = widget.toPlainText().strip()
+# registered accessor classes as {widget class name: accessor class}
+_accessor_classes = dict()
 
-    else:
-        raise RuntimeError(f'Invalid class of input widget: {widget_class}')
-    return val
 
+def register_accessor(*widget_classes):
+    """Class decorator that registers an accessor for widget class names"""
+
+    def _register(accessor_class):
+        for widget_class in widget_classes:
+            _accessor_classes[widget_class] = accessor_class
+        return accessor_class
+
+    return _register
 
-def set_widget_value(widget, value):
-    """Set the value of a data input widget"""
+
+def make_accessor(widget):
+    """Create the accessor for a data input widget"""
     widget_class = widget.__class__.__name__
+    try:
+        return _accessor_classes[widget_class](widget)
+    except KeyError:
+        raise RuntimeError(f'Invalid class of input widget: {widget_class}')
+
+
+@register_accessor('QSpinBox', 'QDoubleSpinBox')
+class SpinBoxAccessor(WidgetAccessor):
+    """Spinboxes use the minimum value to indicate 'not measured'"""
+
+    # the value when the spinbox is at its minimum
+    novalue = Constants.spinbox_novalue_text
+
+    def get(self):
+        if self.widget.value() == self.widget.minimum():
+            return self.novalue
+        return self.widget.value()
+
+    def set(self, value):
+        if value == self.novalue:
+            value = self.widget.minimum()
+        self.widget.setValue(value)
+
+
+@register_accessor('CheckableSpinBox')
+class CheckableSpinBoxAccessor(WidgetAccessor):
+    """CheckableSpinBox handles the special value condition by itself"""
 
-    if widget_class in ('QSpinBox', 'QDoubleSpinBox'):
-        if value == Constants.spinbox_novalue_text:
-            value = widget.minimum()
-        widget.setValue(value)
+    def get(self):
+        return self.widget.value()
 
-    elif widget_class == 'CheckableSpinBox':
-        # CheckableSpinBox handles the special value condition by itself
-        widget.setValue(value)
+    def set(self, value):
+        self.widget.setValue(value)
 
-    elif widget_class == 'QLineEdit':
-        widget.setText(value)
 
-    elif widget_class == 'QCheckBox':
+@register_accessor('QLineEdit')
+class LineEditAccessor(WidgetAccessor):
+    def get(self):
+        return self.widget.text().strip()
+
+    def set(self, value):
+        self.widget.setText(value)
+
+
+@register_accessor('QTextEdit')
+class TextEditAccessor(WidgetAccessor):
+    def get(self):
+        return self.widget.toPlainText().strip()
+
+    def set(self, value):
+        self.widget.setPlainText(value)
+
+
+@register_accessor('QCheckBox')
+class CheckBoxAccessor(WidgetAccessor):
+    def get(self):
+        state = int(self.widget.checkState())
+        if state == 0:
+            return Constants.checkbox_notext
+        elif state == 2:
+            return Constants.checkbox_yestext
+        else:
+            raise RuntimeError('unexpected checkbox value')
+
+    def set(self, value):
         if value == Constants.checkbox_yestext:
-            widget.setCheckState(2)
+            self.widget.setCheckState(2)
         elif value == Constants.checkbox_notext:
-            widget.setCheckState(0)
+            self.widget.setCheckState(0)
         else:
             raise RuntimeError(f'Unexpected checkbox value: {value}')
 
-    elif widget_class == 'QComboBox':
-        idx = widget.findText(value)
+
+@register_accessor('QComboBox')
+class ComboBoxAccessor(WidgetAccessor):
+    def get(self):
+        return self.widget.currentText()
+
+    def set(self, value):
+        idx = self.widget.findText(value)
         if idx >= 0:
-            widget.setCurrentIndex(idx)
+            self.widget.setCurrentIndex(idx)
         else:
             raise RuntimeError(f'Invalid combobox value: {value}')
 
-    elif widget_class == 'QTextEdit':
-        widget.setPlainText(value)
-
-    else:
-        raise RuntimeError(f'Invalid class of input widget: {widget_class}')
-
-
-def get_widget_units(widget):
-    """Get units of data associated with a ROM data entry widget.
-
-    We only return a unit if the widget returns a numeric value.
-    """
-    widget_class = widget.__class__.__name__
-    if widget_class in ('QSpinBox', 'QDoubleSpinBox'):
-        units = widget.suffix() if isnumeric(get_widget_value(widget)) else ''
-    elif widget_class == 'CheckableSpinBox':
-        units = widget.getSuffix() if isnumeric(get_widget_value(widget)) else ''
-    else:
-        # currently no units for other widget types
-        units = ''
-    return units
-
 
 class MyLineEdit(QtWidgets.QLineEdit):
     """Custom line edit that selects the input on mouse click."""
@@ -19,7 +19,9 @@ setup(
         'console_scripts': [
             'gaitbase=gaitbase._gaitbase:main',
             'gaitbase_make_shortcut=gaitbase.utils:make_my_shortcut',
-            'gaitbase_recreate_db=gaitbase.recreate_db:main'
+            'gaitbase_recreate_db=gaitbase.recreate_db:main',
+            'gaitbase_batch_report=gaitbase.batch_report:main',
+            'gaitbase_export=gaitbase.rom_export:main',
         ]
     },
     include_package_data=True
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the tests.
+
+The package modules import each other as top level modules, so the package
+directory is put on the module search path, like when running the package
+scripts.
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / 'gaitbase'))
+
+
+@pytest.fixture
+def rom_db(tmp_path):
+    """Return path of a new database with a patient and three ROMs"""
+    from recreate_db import create_schema
+
+    db_path = tmp_path / 'patients.db'
+    conn = sqlite3.connect(db_path)
+    create_schema(conn)
+    conn.execute(
+        'INSERT INTO patients (patient_id, firstname, lastname, ssn, patient_code, diagnosis) '
+        "VALUES (1, 'Matti', 'Meikäläinen', '010101-0101', 'C0001', 'G80.1')"
+    )
+    for rom_id in (1, 2, 3):
+        conn.execute('INSERT INTO roms (rom_id, patient_id) VALUES (?, 1)', [rom_id])
+    conn.commit()
+    conn.close()
+    return db_path
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the cohort statistics (cohort_stats.py).
+"""
+
+import sqlite3
+
+import numpy as np
+import pytest
+
+from cohort_stats import NOVALUE, NULL, NUMBER, TEXT, _classify, load_cohort, side_of
+from constants import Constants
+
+
+def test_classify():
+    raw = np.array([[1, 2.5, None], [Constants.spinbox_novalue_text, 'NR', 0]], dtype=object)
+    values, status = _classify(raw)
+    np.testing.assert_array_equal(status, [[NUMBER, NUMBER, NULL], [NOVALUE, TEXT, NUMBER]])
+    np.testing.assert_array_equal(values, [[1.0, 2.5, np.nan], [np.nan, np.nan, 0.0]])
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE patients (patient_id integer PRIMARY KEY, ssn text, patient_code text)'
+    )
+    conn.execute(
+        'CREATE TABLE roms (rom_id integer PRIMARY KEY, patient_id integer, '
+        'TiedotPvm text, AntropPaino numeric)'
+    )
+    conn.executemany(
+        'INSERT INTO patients VALUES (?, ?, ?)',
+        [
+            (1, '150610A1234', 'C0001'),
+            (2, '311299-123X', 'D0002'),
+            (3, 'unknown', 'X0003'),
+        ],
+    )
+    conn.executemany(
+        'INSERT INTO roms VALUES (?, ?, ?, ?)',
+        [
+            # the day before and on the birthday
+            (1, 1, '14.6.2020', 30),
+            (2, 1, '15.06.2020', Constants.spinbox_novalue_text),
+            (3, 2, '1.1.2010', None),
+            (4, 3, '1.1.2010', 40.5),
+        ],
+    )
+    yield conn
+    conn.close()
+
+
+def test_load_cohort(conn):
+    data = load_cohort(conn, ['AntropPaino'])
+    np.testing.assert_array_equal(data.age, [9, 10, 10, np.nan])
+    np.testing.assert_array_equal(data.diagnosis, ['C', 'C', 'D', '?'])
+    np.testing.assert_array_equal(data.status[:, 0], [NUMBER, NOVALUE, NULL, NUMBER])
+    np.testing.assert_array_equal(data.values[:, 0], [30, np.nan, np.nan, 40.5])
+
+
+def test_age_bands(conn):
+    data = load_cohort(conn, [])
+    np.testing.assert_array_equal(
+        data.age_bands([0, 10, 18]), ['0-9', '10-17', '10-17', 'unknown']
+    )
+
+
+def test_side_of():
+    assert side_of('AntropPolviOik') == ('AntropPolvi', 'Oik')
+    assert side_of('IsokinPolviFleksioMomenttiVasNorm') == (
+        'IsokinPolviFleksioMomenttiNorm',
+        'Vas',
+    )
+    assert side_of('TasapOikeaJalka') == ('TasapOikeaJalka', '')
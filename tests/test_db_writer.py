@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the background database writer (db_writer.py).
+"""
+
+import sqlite3
+
+import pytest
+
+import db_writer
+from db_writer import RomWriter
+
+
+def _read(db_path, rom_id, *thevars):
+    conn = sqlite3.connect(db_path)
+    varlist = ','.join(thevars)
+    row = conn.execute(f'SELECT {varlist} FROM roms WHERE rom_id = ?', [rom_id]).fetchone()
+    conn.close()
+    return row
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """Make the locked writes fail and retry quickly"""
+    monkeypatch.setattr(db_writer, 'WRITE_TIMEOUT', 10)
+    monkeypatch.setattr(db_writer, 'RETRY_DELAY', 0.02)
+    monkeypatch.setattr(db_writer, 'MAX_RETRY_DELAY', 0.05)
+
+
+@pytest.fixture
+def writer(rom_db, fast_retries):
+    writer = RomWriter(rom_db)
+    yield writer
+    writer.stop(5)
+
+
+def test_write(rom_db, writer):
+    writer.submit(1, {'TiedotPvm': '01.02.2023', 'AntropPaino': 30})
+    assert writer.wait_written(1, 5)
+    assert _read(rom_db, 1, 'TiedotPvm', 'AntropPaino') == ('01.02.2023', 30)
+    assert writer.commits == 1
+
+
+def test_wait_written_without_updates(writer):
+    assert writer.wait_written(1, 0)
+
+
+def test_batches_are_written_in_order(rom_db, writer):
+    for weight in range(10, 20):
+        writer.submit(1, {'AntropPaino': weight})
+    assert writer.wait_written(1, 5)
+    assert _read(rom_db, 1, 'AntropPaino') == (19,)
+
+
+def test_locked_writes_are_coalesced(rom_db, writer):
+    locker = sqlite3.connect(rom_db)
+    locker.execute('BEGIN EXCLUSIVE')
+    writer.submit(1, {'AntropPaino': 30})
+    # the write cannot complete while the database is locked
+    assert not writer.wait_written(1, 0.2)
+    writer.submit(1, {'TiedotPvm': '01.02.2023'})
+    writer.submit(1, {'AntropPaino': 31})
+    locker.rollback()
+    locker.close()
+    assert writer.wait_written(1, 5)
+    assert _read(rom_db, 1, 'TiedotPvm', 'AntropPaino') == ('01.02.2023', 31)
+    # the batches were written as one transaction
+    assert writer.commits == 1
+
+
+def test_locked_rom_does_not_block_others(rom_db, writer, monkeypatch):
+    # ROM 1 cannot be written until it has failed a few times
+    failures = {1: 5}
+    write = RomWriter._write
+
+    def _write(conn, rom_id, updates):
+        if failures.get(rom_id):
+            failures[rom_id] -= 1
+            raise sqlite3.OperationalError('database is locked')
+        write(conn, rom_id, updates)
+
+    monkeypatch.setattr(RomWriter, '_write', staticmethod(_write))
+    writer.submit(1, {'AntropPaino': 30})
+    writer.submit(2, {'AntropPaino': 40})
+    writer.submit(3, {'AntropPaino': 50})
+    assert writer.wait_written(2, 5)
+    assert writer.wait_written(3, 5)
+    assert writer.wait_written(1, 5)
+    assert failures[1] == 0
+    assert _read(rom_db, 1, 'AntropPaino') == (30,)
+
+
+def test_failed_write_is_discarded(rom_db, writer):
+    writer.submit(1, {'NoSuchVariable': 1})
+    writer.submit(2, {'AntropPaino': 40})
+    # the failed batch counts as done with
+    assert writer.wait_written(1, 5)
+    assert writer.wait_written(2, 5)
+    # later updates of the ROM are written normally
+    writer.submit(1, {'AntropPaino': 30})
+    assert writer.wait_written(1, 5)
+    assert _read(rom_db, 1, 'AntropPaino') == (30,)
+
+
+def test_stop_writes_pending_updates(rom_db, fast_retries):
+    writer = RomWriter(rom_db)
+    writer.submit(1, {'AntropPaino': 30})
+    writer.stop(5)
+    assert _read(rom_db, 1, 'AntropPaino') == (30,)
+
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the ROM export (rom_export.py).
+"""
+
+import math
+
+from constants import Constants
+from rom_export import export_columns
+from varcatalog import VarInfo
+
+NOVALUE = Constants.spinbox_novalue_text
+
+CATALOG = {
+    'AntropPaino': VarInfo('AntropPaino', 'dataAntropPaino', 'QSpinBox', 'NUMERIC', NOVALUE),
+    'LonkkaFleksioOik': VarInfo(
+        'LonkkaFleksioOik',
+        'dataLonkkaFleksioOik',
+        'CheckableSpinBox',
+        'NUMERIC',
+        NOVALUE,
+        default_text='NR',
+    ),
+    'TiedotPvm': VarInfo('TiedotPvm', 'dataTiedotPvm', 'QLineEdit', 'TEXT', ''),
+}
+
+
+def _columns(**kwargs):
+    return {column.name: column for column in export_columns(CATALOG, **kwargs)}
+
+
+def test_column_kinds():
+    columns = _columns()
+    assert list(columns) == [
+        'rom_id',
+        'patient_id',
+        'patient_code',
+        'diagnosis',
+        'AntropPaino',
+        'LonkkaFleksioOik',
+        'LonkkaFleksioOik_normal',
+        'TiedotPvm',
+    ]
+    assert columns['rom_id'].kind == 'int'
+    assert columns['diagnosis'].sql_column == 'patients.diagnosis'
+    assert columns['AntropPaino'].kind == 'float'
+    assert columns['LonkkaFleksioOik_normal'].kind == 'bool'
+    assert columns['LonkkaFleksioOik_normal'].sql_column == 'roms.LonkkaFleksioOik'
+    assert columns['TiedotPvm'].kind == 'text'
+
+
+def test_identifying_fields():
+    assert 'ssn' not in _columns()
+    columns = _columns(identifying=True, varnames=['TiedotPvm'])
+    assert list(columns) == [
+        'rom_id',
+        'patient_id',
+        'patient_code',
+        'diagnosis',
+        'firstname',
+        'lastname',
+        'ssn',
+        'TiedotPvm',
+    ]
+
+
+def test_conversions():
+    columns = _columns()
+    values = columns['AntropPaino'].convert([30, 40.5, NOVALUE, None])
+    assert values[:2] == [30.0, 40.5]
+    assert all(math.isnan(v) for v in values[2:])
+    assert columns['LonkkaFleksioOik_normal'].convert(['NR', 10, NOVALUE]) == [
+        True,
+        False,
+        False,
+    ]
+    assert columns['TiedotPvm'].convert(['1.2.2023', None, 12]) == ['1.2.2023', '', '12']
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the database schema helpers (schema.py).
+"""
+
+import sqlite3
+
+import pytest
+
+import schema
+from schema import (
+    SEARCH_MIN_LENGTH,
+    changes_since,
+    create_change_log,
+    create_search_index,
+    last_change,
+    search_filter,
+)
+
+PATIENTS = [
+    (1, 'Matti', 'Meikäläinen', '010101-0101', 'C0001', 'G80.1'),
+    (2, 'Maija', 'Virtanen', '020202-0202', 'D0002', 'G80_0'),
+    (3, 'Pekka', "O'Brien", '030303-0303', 'E0003', '100% ok'),
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        """CREATE TABLE patients (
+        patient_id integer NOT NULL PRIMARY KEY,
+        firstname text NOT NULL,
+        lastname text NOT NULL,
+        ssn text NOT NULL UNIQUE,
+        patient_code text NOT NULL UNIQUE,
+        diagnosis text
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE roms (
+        rom_id integer NOT NULL PRIMARY KEY,
+        patient_id integer NOT NULL REFERENCES patients (patient_id) ON DELETE CASCADE,
+        TiedotPvm text
+        )"""
+    )
+    conn.executemany('INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?)', PATIENTS)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _search(conn, text):
+    query = f'SELECT patient_id FROM patients WHERE {search_filter(text)} ORDER BY patient_id'
+    return [row[0] for row in conn.execute(query)]
+
+
+def test_short_text_uses_like():
+    assert len('ab') < SEARCH_MIN_LENGTH
+    assert 'LIKE' in search_filter('ab')
+    assert 'MATCH' in search_filter('abc')
+
+
+@pytest.mark.parametrize(
+    'text, patient_ids',
+    [
+        ('', [1, 2, 3]),
+        ('ma', [1, 2]),
+        ('MA', [1, 2]),
+        ('ll', []),
+        ('80', [1, 2]),
+        ('_', [2]),
+        ('%', [3]),
+        ("'", [3]),
+        ('meikä', [1]),
+        ('virtanen', [2]),
+        ('D0002', [2]),
+        ('G80.', [1]),
+        ('G80_', [2]),
+        ("O'Br", [3]),
+        ('0% o', [3]),
+        ('"x"', []),
+        ('xyz', []),
+    ],
+)
+def test_search(conn, text, patient_ids):
+    create_search_index(conn)
+    assert _search(conn, text) == patient_ids
+
+
+def test_search_index_follows_changes(conn):
+    create_search_index(conn)
+    conn.execute("UPDATE patients SET lastname = 'Korhonen' WHERE patient_id = 2")
+    conn.execute('DELETE FROM patients WHERE patient_id = 1')
+    conn.commit()
+    assert _search(conn, 'virtanen') == []
+    assert _search(conn, 'korhonen') == [2]
+    assert _search(conn, 'matti') == []
+
+
+def test_change_log(conn):
+    assert last_change(conn) is None
+    assert changes_since(conn, 0) is None
+    create_change_log(conn)
+    assert last_change(conn) == 0
+    assert changes_since(conn, 0) == (0, {'patients': set(), 'roms': set()})
+    conn.execute('INSERT INTO roms (rom_id, patient_id) VALUES (10, 1)')
+    conn.execute('INSERT INTO roms (rom_id, patient_id) VALUES (11, 2)')
+    conn.commit()
+    seq = last_change(conn)
+    conn.execute("UPDATE roms SET TiedotPvm = '01.02.2023' WHERE rom_id = 10")
+    conn.execute("UPDATE patients SET diagnosis = 'G80.2' WHERE patient_id = 3")
+    conn.commit()
+    last, changes = changes_since(conn, seq)
+    assert last == last_change(conn)
+    assert changes == {'patients': {3}, 'roms': {10}}
+    # deleting a patient deletes its ROMs too
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('DELETE FROM patients WHERE patient_id = 2')
+    conn.commit()
+    _, changes = changes_since(conn, last)
+    assert changes == {'patients': {2}, 'roms': {11}}
+
+
+def test_pruned_change_log(conn, monkeypatch):
+    monkeypatch.setattr(schema, 'CHANGE_LOG_SIZE', 5)
+    create_change_log(conn)
+    conn.execute('INSERT INTO roms (rom_id, patient_id) VALUES (10, 1)')
+    conn.commit()
+    seq = last_change(conn)
+    for k in range(10):
+        conn.execute('UPDATE roms SET TiedotPvm = ? WHERE rom_id = 10', [str(k)])
+    conn.commit()
+    # the changes after seq are no longer all in the log
+    assert changes_since(conn, seq) is None
+    assert changes_since(conn, last_change(conn) - 2) is not None
+    # a log that is behind the given change cannot be used either
+    assert changes_since(conn, last_change(conn) + 1) is None
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQL statistics (sqlstats.py).
+"""
+
+import pytest
+
+from sqlstats import _normalize, _percentile
+
+
+@pytest.mark.parametrize(
+    'p, expected', [(0, 1), (10, 1), (50, 5), (90, 9), (95, 10), (100, 10)]
+)
+def test_percentile(p, expected):
+    assert _percentile(list(range(1, 11)), p) == expected
+
+
+def test_percentile_single_value():
+    assert _percentile([3.0], 50) == 3.0
+
+
+def test_normalize():
+    sql = "SELECT *  FROM roms\n WHERE rom_id = 12 AND TiedotPvm = '1.2.2023' AND x = 'it''s'"
+    assert _normalize(sql) == 'SELECT * FROM roms WHERE rom_id = ? AND TiedotPvm = ? AND x = ?'
+    assert _normalize('SELECT a1 FROM t2') == 'SELECT a1 FROM t2'
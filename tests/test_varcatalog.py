@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the catalog of ROM variables (varcatalog.py).
+"""
+
+import pytest
+
+from constants import Constants
+from varcatalog import build_catalog, load_catalog
+
+NOVALUE = Constants.spinbox_novalue_text
+
+UI_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ui version="4.0">
+ <class>MainWindow</class>
+ <widget class="QMainWindow" name="MainWindow">
+  <widget class="QWidget" name="centralwidget">
+   <widget class="QSpinBox" name="dataSpin">
+    <property name="minimum"><number>-1</number></property>
+    <property name="maximum"><number>200</number></property>
+    <property name="value"><number>-1</number></property>
+    <property name="suffix"><string>kg</string></property>
+   </widget>
+   <widget class="QSpinBox" name="dataSpinValue">
+    <property name="value"><number>150</number></property>
+   </widget>
+   <widget class="QDoubleSpinBox" name="dataDouble">
+    <property name="minimum"><double>-1.000000000000000</double></property>
+    <property name="maximum"><double>10.000000000000000</double></property>
+    <property name="decimals"><number>1</number></property>
+   </widget>
+   <widget class="CheckableSpinBox" name="dataCheckable">
+    <property name="defaultText"><string>NR</string></property>
+   </widget>
+   <widget class="QLineEdit" name="dataLine">
+    <property name="text"><string> text </string></property>
+   </widget>
+   <widget class="QTextEdit" name="dataText"/>
+   <widget class="QCheckBox" name="dataCheck">
+    <property name="checked"><bool>true</bool></property>
+   </widget>
+   <widget class="QComboBox" name="dataCombo">
+    <property name="currentIndex"><number>1</number></property>
+    <item><property name="text"><string>Ei mitattu</string></property></item>
+    <item><property name="text"><string>Normaali</string></property></item>
+   </widget>
+   <widget class="QLabel" name="label"/>
+  </widget>
+ </widget>
+</ui>
+"""
+
+
+@pytest.fixture
+def uifile(tmp_path):
+    fname = tmp_path / 'test.ui'
+    fname.write_text(UI_XML, encoding='utf-8')
+    return fname
+
+
+@pytest.fixture
+def catalog(uifile):
+    return build_catalog(uifile)
+
+
+def test_variables(catalog):
+    assert list(catalog) == [
+        'Spin', 'SpinValue', 'Double', 'Checkable', 'Line', 'Text', 'Check', 'Combo'
+    ]
+    assert catalog['Spin'].widget_name == 'dataSpin'
+    assert catalog['Spin'].affinity == 'NUMERIC'
+    assert catalog['Checkable'].affinity == 'NUMERIC'
+    assert catalog['Line'].affinity == 'TEXT'
+    assert catalog['Combo'].affinity == 'TEXT'
+
+
+def test_defaults(catalog):
+    # spinboxes at their minimum are not measured
+    assert catalog['Spin'].default == NOVALUE
+    assert catalog['Checkable'].default == NOVALUE
+    # the default value of a spinbox is 0, clamped into its range
+    assert catalog['Double'].default == 0.0
+    # like in Qt, the value is clamped into the default range 0-99
+    assert catalog['SpinValue'].default == 99
+    assert catalog['Line'].default == 'text'
+    assert catalog['Text'].default == ''
+    assert catalog['Check'].default == Constants.checkbox_yestext
+    assert catalog['Combo'].default == 'Normaali'
+    assert catalog['Combo'].items == ['Ei mitattu', 'Normaali']
+
+
+def test_spinbox_properties(catalog):
+    spin = catalog['Spin']
+    assert (spin.minimum, spin.maximum, spin.units) == (-1, 200, 'kg')
+    assert catalog['Double'].decimals == 1
+    checkable = catalog['Checkable']
+    assert (checkable.minimum, checkable.maximum, checkable.units) == (-181, 180, '°')
+    assert checkable.default_text == 'NR'
+
+
+def test_coerce_clamps_and_rounds(catalog):
+    spin = catalog['Spin']
+    assert spin.coerce(50) == 50
+    assert spin.coerce(500) == 200
+    assert spin.coerce(-5) == NOVALUE
+    assert spin.coerce(-1) == NOVALUE
+    double = catalog['Double']
+    assert double.coerce(2.345) == 2.3
+    assert double.coerce(12.0) == 10.0
+
+
+def test_coerce_passes_text(catalog):
+    assert catalog['Spin'].coerce(NOVALUE) == NOVALUE
+    assert catalog['Checkable'].coerce('NR') == 'NR'
+    assert catalog['Line'].coerce(' x ') == ' x '
+
+
+def test_units(catalog):
+    assert catalog['Spin'].get_units(50) == 'kg'
+    assert catalog['Spin'].get_units(NOVALUE) == ''
+    assert catalog['Line'].get_units('text') == ''
+
+
+def test_load_catalog_cache(uifile, tmp_path):
+    catalog = load_catalog(uifile, cachedir=tmp_path)
+    assert (tmp_path / 'varcatalog.json').is_file()
+    assert load_catalog(uifile, cachedir=tmp_path) == catalog
+    # a changed .ui file invalidates the cache
+    uifile.write_text(UI_XML.replace('dataCombo', 'dataCombo2'), encoding='utf-8')
+    assert 'Combo2' in load_catalog(uifile, cachedir=tmp_path)
+
+
+def test_package_catalog():
+    catalog = build_catalog()
+    assert catalog
+    for info in catalog.values():
+        # the defaults are values that the widgets can have
+        assert info.coerce(info.default) == info.default